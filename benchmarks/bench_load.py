@@ -0,0 +1,377 @@
+"""
+Load test of a running adapter against local stand-ins. It starts the stubs of
+benchmarks/stubs.py, a local mongod (when one is installed or --mongo-url is
+given) and the adapter itself, then drives /execute, /preview and /embeddings at
+each concurrency level and reports req/s, latency percentiles and memory.
+
+Mongo scenarios are skipped when there's no mongod binary and no --mongo-url.
+The embeddings scenario also needs the tiktoken encoding, which is downloaded
+on first use.
+
+Usage: python benchmarks/bench_load.py [--concurrency 1,8,32] [--duration S]
+                                       [--scenarios a,b] [--mongo-url URL]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+
+import aiohttp
+import pymongo
+from cryptography.fernet import Fernet
+
+from common import ROOT, SRC, environment, process_memory, save_results
+from common import summarize_latencies
+
+REST_METADATA = {"method": "GET", "path": "/items?n={{n}}", "headers": {}, "body": {}}
+FIND_METADATA = {
+    "method": "find",
+    "collection": "items",
+    "filter_body": {"n": {"$lt": "{{max}}"}},
+    "update_body": {},
+}
+AGGREGATE_METADATA = {
+    "method": "aggregate",
+    "collection": "items",
+    "filter_body": [
+        {"$match": {"n": {"$lt": "{{max}}"}}},
+        {"$group": {"_id": "$group", "total": {"$sum": "$n"}, "count": {"$sum": 1}}},
+    ],
+    "update_body": {},
+}
+VECTOR_SEARCH_METADATA = {
+    "method": "vectorSearch",
+    "collection": "items",
+    "index_created": False,
+    "embeddings_created": False,
+    "query": "{{text}}",
+    "limit": 10,
+    "num_candidates": 100,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[0]} exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for port {port}")
+
+
+@contextmanager
+def running(args: list, port: int, **kwargs):
+    process = subprocess.Popen(args, **kwargs)
+    try:
+        wait_for_port(port, process)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+@contextmanager
+def local_mongod(mongod: str):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as dbpath:
+        command = [
+            mongod,
+            "--port",
+            str(port),
+            "--dbpath",
+            dbpath,
+            "--bind_ip",
+            "127.0.0.1",
+        ]
+        with running(command, port, stdout=subprocess.DEVNULL):
+            yield f"mongodb://127.0.0.1:{port}/bench"
+
+
+def seed_mongo(mongo_url: str, documents: int):
+    client = pymongo.MongoClient(mongo_url)
+    try:
+        collection = client.get_default_database("bench")["items"]
+        collection.drop()
+        collection.insert_many(
+            [
+                {
+                    "n": i,
+                    "group": i % 10,
+                    "name": f"item {i}",
+                    "text": f"Item number {i} in group {i % 10}",
+                    "tags": ["a", "b", f"tag-{i % 10}"],
+                }
+                for i in range(documents)
+            ]
+        )
+        collection.create_index("n")
+    finally:
+        client.close()
+
+
+def build_definitions(stub_url: str, mongo_url: str, encrypted_api_key: str) -> dict:
+    rest = {
+        "id": "rest",
+        "type": "REST",
+        "credentials": {"main_url": stub_url},
+        "variables": {},
+    }
+    mongo = {
+        "id": "mongo",
+        "type": "MONGO",
+        "credentials": {"main_url": mongo_url, "openai_api_key": encrypted_api_key},
+        "variables": {},
+    }
+
+    def query(connection, metadata):
+        return {"user_id": "bench", "connection": connection, "metadata": dict(metadata)}
+
+    return {
+        "queries": {
+            "rest-items": query(rest, REST_METADATA),
+            "rest-items-cached": query(rest, {**REST_METADATA, "cache_ttl": 3600}),
+            "mongo-find": query(mongo, FIND_METADATA),
+            "mongo-aggregate": query(mongo, AGGREGATE_METADATA),
+            "mongo-vector-search": query(mongo, VECTOR_SEARCH_METADATA),
+        },
+        "connections": {"rest": rest, "mongo": mongo},
+    }
+
+
+def build_scenarios(rows: int) -> dict:
+    # name -> (path, body, needs Mongo)
+    rest_parameters = {"parameters": {"n": rows}}
+    mongo_parameters = {"parameters": {"max": rows}}
+    return {
+        "execute_rest": ("/v1/adapter/execute/rest-items", rest_parameters, False),
+        "execute_rest_cached": (
+            "/v1/adapter/execute/rest-items-cached",
+            rest_parameters,
+            False,
+        ),
+        "preview_rest": (
+            "/v1/adapter/rest/preview",
+            {**rest_parameters, "connection_metadata": REST_METADATA},
+            False,
+        ),
+        "execute_find": ("/v1/adapter/execute/mongo-find", mongo_parameters, True),
+        "execute_aggregate": (
+            "/v1/adapter/execute/mongo-aggregate",
+            mongo_parameters,
+            True,
+        ),
+        "preview_find": (
+            "/v1/adapter/mongo/preview",
+            {**mongo_parameters, "connection_metadata": FIND_METADATA},
+            True,
+        ),
+    }
+
+
+async def drive(url: str, body: dict, concurrency: int, duration: float, warmup: float):
+    """
+    Sends requests from `concurrency` workers for `warmup` + `duration` seconds.
+    Only the requests that start after the warmup are measured.
+    """
+    latencies = []
+    status_codes = {}
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started_at = time.perf_counter()
+        measure_from = started_at + warmup
+        deadline = measure_from + duration
+
+        async def worker():
+            nonlocal errors
+            while True:
+                request_started_at = time.perf_counter()
+                if request_started_at >= deadline:
+                    return
+                try:
+                    async with session.post(url, json=body) as response:
+                        await response.read()
+                        status = response.status
+                except aiohttp.ClientError:
+                    status = None
+                if request_started_at < measure_from:
+                    continue
+                latencies.append(time.perf_counter() - request_started_at)
+                status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+                if status is None or status >= 400:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": status_codes,
+        "requests_per_second": len(latencies) / duration,
+        "latency_ms": summarize_latencies(latencies),
+    }
+
+
+async def run_embeddings(base_url: str, timeout: float) -> dict:
+    async with aiohttp.ClientSession() as session:
+        started_at = time.perf_counter()
+        async with session.post(
+            f"{base_url}/v1/adapter/embeddings/mongo-vector-search",
+            params={"index_field": "text"},
+        ) as response:
+            job = await response.json()
+            if response.status != 202:
+                return {"error": job}
+        while time.perf_counter() - started_at < timeout:
+            await asyncio.sleep(0.2)
+            async with session.get(
+                f"{base_url}/v1/adapter/embeddings/jobs/{job['id']}"
+            ) as r:
+                job = await r.json()
+            if job["status"] in ("completed", "failed", "cancelled"):
+                break
+    return {
+        "status": job["status"],
+        "error": job.get("error"),
+        "documents": job.get("processed"),
+        "elapsed_seconds": job.get("elapsed_seconds"),
+        "documents_per_second": job.get("documents_per_second"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated levels")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per run")
+    parser.add_argument(
+        "--warmup", type=float, default=2, help="seconds before measuring"
+    )
+    parser.add_argument("--scenarios", help="comma separated, all by default")
+    parser.add_argument("--rows", type=int, default=100, help="rows per query result")
+    parser.add_argument("--documents", type=int, default=10000, help="documents seeded")
+    parser.add_argument("--latency-ms", type=float, default=0, help="stub latency")
+    parser.add_argument("--mongo-url", help="use this Mongo instead of a local mongod")
+    parser.add_argument("--mongod", default=shutil.which("mongod"), help="mongod binary")
+    parser.add_argument("--no-embeddings", action="store_true")
+    parser.add_argument("--embeddings-timeout", type=float, default=300)
+    parser.add_argument("--output", help="result file, by default in benchmarks/results")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    scenarios = build_scenarios(args.rows)
+    if args.scenarios:
+        names = args.scenarios.split(",")
+        scenarios = {name: scenarios[name] for name in names}
+
+    private_key = Fernet.generate_key()
+    encrypted_api_key = Fernet(private_key).encrypt(b"bench").decode()
+    stub_port = free_port()
+    adapter_port = free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    base_url = f"http://127.0.0.1:{adapter_port}"
+
+    with ExitStack() as stack:
+        mongo_url = args.mongo_url
+        if mongo_url is None and args.mongod:
+            mongo_url = stack.enter_context(local_mongod(args.mongod))
+        if mongo_url is None:
+            print("No mongod found and no --mongo-url given, skipping Mongo scenarios")
+            scenarios = {name: s for name, s in scenarios.items() if not s[2]}
+        else:
+            seed_mongo(mongo_url, args.documents)
+
+        directory = stack.enter_context(tempfile.TemporaryDirectory())
+        definitions_path = os.path.join(directory, "definitions.json")
+        with open(definitions_path, "w") as file:
+            json.dump(
+                build_definitions(stub_url, mongo_url or "", encrypted_api_key), file
+            )
+
+        stubs = [
+            sys.executable,
+            os.path.join(ROOT, "benchmarks", "stubs.py"),
+            f"--definitions={definitions_path}",
+            f"--port={stub_port}",
+            f"--latency-ms={args.latency_ms}",
+        ]
+        stack.enter_context(running(stubs, stub_port))
+
+        adapter_env = {
+            **os.environ,
+            "APP_HOST": "127.0.0.1",
+            "APP_PORT": str(adapter_port),
+            "DASHBOARDS_SERVICE_URL": stub_url,
+            "API_KEY": "bench",
+            "PRIVATE_KEY": private_key.decode(),
+            "EMBEDDINGS_URL": f"{stub_url}/v1/embeddings",
+        }
+        adapter = stack.enter_context(
+            running(
+                [sys.executable, os.path.join(SRC, "main.py")],
+                adapter_port,
+                env=adapter_env,
+                stdout=subprocess.DEVNULL,
+            )
+        )
+
+        results = []
+        for name, (path, body, _) in scenarios.items():
+            for concurrency in levels:
+                result = asyncio.run(
+                    drive(base_url + path, body, concurrency, args.duration, args.warmup)
+                )
+                result.update(
+                    scenario=name,
+                    concurrency=concurrency,
+                    memory=process_memory(adapter.pid),
+                )
+                results.append(result)
+                latency = result["latency_ms"]
+                print(
+                    f"{name:22} c={concurrency:<4} {result['requests_per_second']:9.1f} req/s"
+                    f"  p50 {latency['p50'] or 0:7.2f} ms  p95 {latency['p95'] or 0:7.2f} ms"
+                    f"  p99 {latency['p99'] or 0:7.2f} ms  errors {result['errors']}"
+                    f"  rss {result['memory']['rss_mib'] or 0:.0f} MiB"
+                )
+
+        embeddings = None
+        if mongo_url is not None and not args.no_embeddings:
+            embeddings = asyncio.run(run_embeddings(base_url, args.embeddings_timeout))
+            embeddings["memory"] = process_memory(adapter.pid)
+            print(f"embeddings: {embeddings}")
+
+    output = save_results(
+        "load",
+        {
+            "environment": environment(),
+            "config": {**vars(args), "mongo": mongo_url is not None},
+            "scenarios": results,
+            "embeddings": embeddings,
+        },
+        args.output,
+    )
+    print(f"results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
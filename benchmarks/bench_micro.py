@@ -0,0 +1,97 @@
+"""
+Micro-benchmarks for the hot paths of a query execution: parameter substitution,
+ObjectId string replacement, and turning Mongo results into a JSON response.
+Mongo values are converted while encoding, so parse_response is measured along
+with the encoder.
+
+Usage: python benchmarks/bench_micro.py [--size N] [--repeat N] [--output FILE]
+"""
+
+import argparse
+import datetime
+import timeit
+
+from common import add_src_to_path, environment, save_results
+
+add_src_to_path()
+
+from bson import Decimal128, ObjectId  # noqa: E402
+from bench_parameters import build_pipeline  # noqa: E402
+from lib.encoding import dumps  # noqa: E402
+from lib.object_id import replace_objectid_strings  # noqa: E402
+from lib.parameters import compile_template, replace_parameters  # noqa: E402
+
+
+def build_documents(count: int) -> list:
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"document {i}",
+            "price": Decimal128(f"{i}.25"),
+            "created_at": datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i),
+            "owner": {"_id": ObjectId(), "tags": ["a", "b", ObjectId()]},
+            "values": list(range(10)),
+        }
+        for i in range(count)
+    ]
+
+
+def build_filter(count: int) -> dict:
+    return {
+        "$or": [
+            {
+                "_id": f"ObjectId('{ObjectId()}')",
+                "owner": {"$in": [f"ObjectId('{ObjectId()}')"]},
+            }
+            for _ in range(count)
+        ]
+    }
+
+
+def measure(fn, repeat: int) -> dict:
+    times = timeit.repeat(fn, number=1, repeat=repeat)
+    return {
+        "mean_ms": sum(times) / len(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "max_ms": max(times) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10000, help="documents per result")
+    parser.add_argument("--stages", type=int, default=500, help="pipeline stages")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="result file, by default in benchmarks/results")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args.stages)
+    parameters = {"status": "active", "min_amount": 10}
+    template = compile_template(pipeline)
+    filter_body = build_filter(args.size // 10)
+    documents = build_documents(args.size)
+
+    benchmarks = {
+        "replace_parameters": lambda: replace_parameters(pipeline, parameters, set()),
+        "compiled_bind": lambda: template.bind(parameters),
+        "replace_objectid_strings": lambda: replace_objectid_strings(filter_body),
+        "parse_response": lambda: dumps({"body": documents}),
+    }
+    results = {name: measure(fn, args.repeat) for name, fn in benchmarks.items()}
+    for name, result in results.items():
+        print(f"{name:28} {result['mean_ms']:10.2f} ms (min {result['min_ms']:.2f})")
+
+    output = save_results(
+        "micro",
+        {
+            "environment": environment(),
+            "config": vars(args),
+            "benchmarks": results,
+        },
+        args.output,
+    )
+    print(f"results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
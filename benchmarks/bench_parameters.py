@@ -0,0 +1,68 @@
+"""
+Micro-benchmark for parameter substitution on a large Mongo pipeline.
+
+Usage: python benchmarks/bench_parameters.py [--stages N] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lib.parameters import replace_parameters, compile_template  # noqa: E402
+
+
+def build_pipeline(stages: int) -> list:
+    pipeline = []
+    for i in range(stages):
+        pipeline.append(
+            {
+                "$match": {
+                    "status": "{{status}}",
+                    "amount": {"$gte": "{{min_amount}}", "$lte": 1000 + i},
+                    "tags": {"$in": ["a", "b", "c", f"tag-{i}"]},
+                    "created_by": "ObjectId('5f6c6f6e6e656374696f6f6e')",
+                }
+            }
+        )
+        pipeline.append(
+            {
+                "$project": {
+                    "_id": 1,
+                    "name": 1,
+                    "label": "prefix-{{status}}-suffix",
+                    "nested": {"field": f"$values.{i}", "flag": "True"},
+                }
+            }
+        )
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args.stages)
+    parameters = {"status": "active", "min_amount": 10}
+    template = compile_template(pipeline)
+    assert template.bind(parameters)[0] == replace_parameters(pipeline, parameters, set())
+
+    interpreted = timeit.timeit(
+        lambda: replace_parameters(pipeline, parameters, set()), number=args.repeat
+    )
+    compile_time = timeit.timeit(lambda: compile_template(pipeline), number=args.repeat)
+    bind = timeit.timeit(lambda: template.bind(parameters), number=args.repeat)
+
+    print(f"pipeline stages:      {len(pipeline)}")
+    print(f"replace_parameters:   {interpreted / args.repeat * 1000:.2f} ms")
+    print(f"compile_template:     {compile_time / args.repeat * 1000:.2f} ms")
+    print(f"compiled bind:        {bind / args.repeat * 1000:.2f} ms")
+    print(f"speedup (cached):     {interpreted / bind:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Helpers shared by the benchmark scripts: percentiles, process memory and the
+JSON result files used to compare runs between commits.
+"""
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SRC = os.path.join(ROOT, "src")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def add_src_to_path():
+    if SRC not in sys.path:
+        sys.path.insert(0, SRC)
+
+
+def percentile(values: list, fraction: float) -> float:
+    # Nearest-rank percentile, values don't need to be sorted
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize_latencies(latencies: list) -> dict:
+    # Latencies are in seconds, reported in milliseconds
+    if not latencies:
+        return {"mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "mean": sum(latencies) / len(latencies) * 1000,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "max": max(latencies) * 1000,
+    }
+
+
+def process_memory(pid: int) -> dict:
+    """
+    Current and peak resident memory of a process in MiB, read from /proc, so
+    it's only available on Linux.
+    """
+    memory = {"rss_mib": None, "peak_rss_mib": None}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                name, _, value = line.partition(":")
+                if name == "VmRSS":
+                    memory["rss_mib"] = int(value.split()[0]) / 1024
+                elif name == "VmHWM":
+                    memory["peak_rss_mib"] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+def git_commit() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=ROOT,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment() -> dict:
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save_results(kind: str, results: dict, output: str = None) -> str:
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        environment_info = results["environment"]
+        name = f"{kind}-{environment_info['commit']}-{environment_info['timestamp']}.json"
+        output = os.path.join(RESULTS_DIR, name.replace(":", ""))
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    return output
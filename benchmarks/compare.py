@@ -0,0 +1,71 @@
+"""
+Compares two result files of bench_micro.py or bench_load.py, usually from two
+commits, and flags the measurements that got worse by more than --threshold.
+Exits with 1 when there are regressions.
+
+Usage: python benchmarks/compare.py BASELINE CURRENT [--threshold PERCENT]
+"""
+
+import argparse
+import json
+import sys
+
+
+def measurements(results: dict) -> dict:
+    # name -> (value, True when higher is better)
+    values = {}
+    for name, benchmark in results.get("benchmarks", {}).items():
+        values[f"{name} min ms"] = (benchmark["min_ms"], False)
+    for scenario in results.get("scenarios", []):
+        name = f"{scenario['scenario']} c={scenario['concurrency']}"
+        values[f"{name} req/s"] = (scenario["requests_per_second"], True)
+        for percentile in ("p50", "p95", "p99"):
+            values[f"{name} {percentile} ms"] = (
+                scenario["latency_ms"][percentile],
+                False,
+            )
+        values[f"{name} rss MiB"] = (scenario["memory"]["rss_mib"], False)
+    embeddings = results.get("embeddings") or {}
+    if embeddings.get("documents_per_second"):
+        values["embeddings docs/s"] = (embeddings["documents_per_second"], True)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10, help="percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+
+    print(
+        f"baseline {baseline['environment']['commit']}, current {current['environment']['commit']}"
+    )
+    baseline_values = measurements(baseline)
+    regressions = 0
+    for name, (value, higher_is_better) in measurements(current).items():
+        if name not in baseline_values:
+            continue
+        before, _ = baseline_values[name]
+        if not before or value is None:
+            continue
+        change = (value - before) / before * 100
+        regression = -change if higher_is_better else change
+        flag = ""
+        if regression > args.threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name:40} {before:12.2f} {value:12.2f} {change:+8.1f}%{flag}")
+
+    if regressions:
+        print(f"{regressions} regressions above {args.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
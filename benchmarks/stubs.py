@@ -0,0 +1,107 @@
+"""
+Local stand-ins for the services the adapter calls: the dashboards service
+(query and connection definitions), a REST API and the embeddings API. Every
+route waits `--latency-ms` before answering, to simulate a network hop.
+
+Usage: python benchmarks/stubs.py --definitions FILE [--port N] [--latency-ms N]
+"""
+
+import argparse
+import asyncio
+import json
+
+from aiohttp import web
+
+
+def item(i: int) -> dict:
+    return {
+        "id": i,
+        "name": f"item {i}",
+        "price": i * 1.25,
+        "active": i % 2 == 0,
+        "tags": ["a", "b", f"tag-{i % 10}"],
+        "owner": {"id": i % 100, "email": f"user{i % 100}@example.com"},
+    }
+
+
+def embedding(text: str, dimensions: int) -> list:
+    # Deterministic, so repeated texts get the same vector
+    seed = sum(text.encode()) or 1
+    return [((seed * (i + 1)) % 1000) / 1000 for i in range(dimensions)]
+
+
+def build_app(definitions: dict, latency: float, dimensions: int) -> web.Application:
+    async def delay():
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def get_query(request):
+        await delay()
+        query = definitions["queries"].get(request.match_info["id"])
+        if query is None:
+            return web.json_response(
+                {"error": {"code": "QUERY_NOT_FOUND", "description": "Query not found"}},
+                status=404,
+            )
+        return web.json_response(query)
+
+    async def update_query(request):
+        await delay()
+        query = definitions["queries"].get(request.match_info["id"])
+        if query is None:
+            return web.json_response({}, status=404)
+        query["metadata"].update((await request.json()).get("metadata", {}))
+        return web.json_response(query)
+
+    async def get_connection(request):
+        await delay()
+        connection = definitions["connections"].get(request.match_info["id"])
+        if connection is None:
+            return web.json_response({}, status=404)
+        return web.json_response(connection)
+
+    async def get_items(request):
+        await delay()
+        count = int(request.query.get("n", 10))
+        return web.json_response([item(i) for i in range(count)])
+
+    async def create_embeddings(request):
+        await delay()
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = [
+            {"index": i, "embedding": embedding(text, dimensions)}
+            for i, text in enumerate(texts)
+        ]
+        return web.json_response({"data": data, "usage": {"total_tokens": 0}})
+
+    app = web.Application()
+    app.add_routes(
+        [
+            web.get("/v1/queries/{id}", get_query),
+            web.patch("/v1/queries/{id}", update_query),
+            web.get("/v1/connections/{id}", get_connection),
+            web.get("/items", get_items),
+            web.post("/v1/embeddings", create_embeddings),
+        ]
+    )
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--definitions", required=True, help="JSON file with definitions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--dimensions", type=int, default=256)
+    args = parser.parse_args()
+
+    with open(args.definitions) as file:
+        definitions = json.load(file)
+    app = build_app(definitions, args.latency_ms / 1000, args.dimensions)
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
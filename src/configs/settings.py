@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 
@@ -8,6 +9,110 @@ class Settings(BaseSettings):
     API_KEY: str
     PRIVATE_KEY: str
 
+    # Worker processes, 0 runs one per CPU. Pool and cache sizes are limits for
+    # the whole instance, each worker gets its share. Metrics are kept per
+    # worker, with more than one they carry a worker label with its pid
+    WORKERS: int = 1
+    SERVER_LOOP: str = "uvloop"
+    SERVER_HTTP: str = "httptools"
+    SERVER_BACKLOG: int = 2048
+    SERVER_KEEPALIVE_TIMEOUT: float = 5
+    # Seconds in-flight requests get to finish on shutdown or reload
+    SERVER_GRACEFUL_SHUTDOWN_TIMEOUT: float = 30
+    SERVER_LIMIT_CONCURRENCY: Optional[int] = None
+    # Workers are replaced after this many requests, disabled when unset
+    SERVER_MAX_REQUESTS: Optional[int] = None
+
+    # Seconds a request may take unless its X-Request-Timeout header says
+    # otherwise, up to the maximum. Unset means no limit
+    REQUEST_TIMEOUT: Optional[float] = 60
+    REQUEST_MAX_TIMEOUT: Optional[float] = 300
+
+    HTTP_POOL_SIZE: int = 100
+    HTTP_POOL_SIZE_PER_HOST: int = 20
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_KEEPALIVE_TIMEOUT: float = 30
+    HTTP_CONNECT_TIMEOUT: float = 10
+    HTTP_READ_TIMEOUT: float = 60
+    HTTP_TOTAL_TIMEOUT: Optional[float] = None
+
+    DEFINITION_CACHE_TTL: float = 30
+    DEFINITION_CACHE_STALE_TTL: float = 300
+    DEFINITION_CACHE_MAXSIZE: int = 1024
+    TEMPLATE_CACHE_MAXSIZE: int = 1024
+    EMBEDDING_CACHE_MAXSIZE: int = 4096
+    # SQLite file for embeddings that survive restarts, disabled when unset
+    EMBEDDING_CACHE_PATH: Optional[str] = None
+    EMBEDDING_CACHE_DISK_MAXSIZE: int = 100000
+    RESULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESULT_CACHE_COMPRESS_THRESHOLD: int = 16384
+    CONNECTION_REGISTRY_TTL: float = 300
+    CONNECTION_REGISTRY_MAXSIZE: int = 1024
+    # Most recently used connections are saved here and prewarmed on startup
+    CONNECTION_PREWARM_FILE: Optional[str] = None
+    CONNECTION_PREWARM_COUNT: int = 20
+    CONNECTION_PREWARM_TIMEOUT: float = 10
+
+    MONGO_EXECUTOR_WORKERS: int = 16
+    MONGO_EXECUTOR_MAX_PENDING: int = 256
+    MONGO_CLIENTS_CAPACITY: int = 100
+    MONGO_CLIENT_IDLE_TIMEOUT: float = 300
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_HEALTH_CHECK_INTERVAL: float = 60
+    MONGO_HEALTH_CHECK_TIMEOUT: float = 5
+
+    # Defaults for calls to REST APIs and Mongo, connections can override them
+    # with a "resilience" object in their credentials
+    UPSTREAM_RETRIES: int = 2
+    UPSTREAM_RETRY_BACKOFF: float = 0.1
+    UPSTREAM_RETRY_MAX_BACKOFF: float = 2
+    UPSTREAM_HEDGE: bool = False
+    # Hedges after the p95 latency of the host when unset
+    UPSTREAM_HEDGE_DELAY: Optional[float] = None
+    UPSTREAM_HEDGE_MIN_DELAY: float = 0.01
+    UPSTREAM_BREAKER_FAILURES: int = 5
+    UPSTREAM_BREAKER_RESET_TIMEOUT: float = 30
+    UPSTREAM_LATENCY_WINDOW: int = 200
+    UPSTREAM_MAXSIZE: int = 1024
+
+    STREAM_BATCH_SIZE: int = 500
+    PASSTHROUGH_CHUNK_SIZE: int = 65536
+
+    # Encodings offered to clients in order of preference, out of zstd, br and gzip
+    COMPRESSION_ENCODINGS: str = "zstd,br,gzip"
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    # Bodies this large are compressed in a thread, 0 disables it
+    COMPRESSION_OFFLOAD_SIZE: int = 1024 * 1024
+    COMPRESSION_GZIP_LEVEL: int = 5
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    COMPRESSION_ZSTD_LEVEL: int = 3
+
+    BATCH_MAX_QUERIES: int = 100
+    BATCH_CONCURRENCY: int = 8
+
+    EMBEDDINGS_URL: str = "https://api.openai.com/v1/embeddings"
+    EMBEDDINGS_MODEL: str = "text-embedding-ada-002"
+    EMBEDDINGS_MAX_BATCH_ITEMS: int = 2048
+    EMBEDDINGS_MAX_BATCH_TOKENS: int = 300000
+    EMBEDDINGS_MAX_ITEM_TOKENS: int = 8191
+    EMBEDDINGS_CONCURRENCY: int = 4
+    EMBEDDINGS_TOKENS_PER_MINUTE: int = 1000000
+    EMBEDDINGS_MAX_RETRIES: int = 5
+
+    EMBEDDINGS_JOB_PAGE_SIZE: int = 5000
+    EMBEDDINGS_JOBS_CONCURRENCY: int = 1
+    EMBEDDINGS_JOBS_MAX_FINISHED: int = 100
+
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    # Longest string and largest container kept in a log record
+    LOG_MAX_FIELD_LENGTH: int = 1024
+    LOG_MAX_ITEMS: int = 20
+    # Share of records below WARNING that are written
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_QUEUE_SIZE: int = 10000
+
     class Config:
         env_file = ".env"
 
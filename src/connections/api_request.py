@@ -1,26 +1,195 @@
+import asyncio
+
 import aiohttp
 
-from fastapi.encoders import jsonable_encoder
 from errors import CustomException, ERR_INTERNAL
+from lib.encoding import dumps, loads
+from lib.compression import with_accept_encoding
+from lib.deadline import time_left, check_deadline, deadline_exceeded, deadline_error
+
+# Upstream headers kept on passthrough responses, hop-by-hop ones are dropped
+PASSTHROUGH_HEADERS = (
+    "content-type",
+    "content-encoding",
+    "content-length",
+    "content-disposition",
+    "cache-control",
+    "etag",
+    "last-modified",
+)
+
 
+class UpstreamStream:
+    """
+    Response of a REST API whose body hasn't been read yet. The body is read in
+    chunks exactly as the API sent it, still compressed, and the connection is
+    released once it's consumed or the client goes away.
+    """
 
-async def make_request(url, headers, method, body={}, params={}):
-    json_compatible_body = jsonable_encoder(body)
-    url = (
-        url + "?" + "&".join([f"{key}={value}" for key, value in params.items()])
-        if len(params) > 0
-        else url
-    )
-    async with aiohttp.ClientSession() as session:
+    def __init__(self, response: aiohttp.ClientResponse, chunk_size: int):
+        self.status_code = response.status
+        self.headers = {
+            name: value
+            for name, value in response.headers.items()
+            if name.lower() in PASSTHROUGH_HEADERS
+        }
+        self.chunk_size = chunk_size
+        self._response = response
+
+    async def iter_chunks(self):
         try:
+            async for chunk in self._response.content.iter_chunked(self.chunk_size):
+                yield chunk
+        finally:
+            # A partially read connection is closed instead of going back to the pool
+            self._response.release()
+
+    async def close(self):
+        # Releases the connection of a body that was never read, does nothing
+        # once iter_chunks has finished
+        self._response.close()
+
+
+class HttpClient:
+    """
+    Shared aiohttp session with a pooled connector. It is created once in the app
+    lifespan so keep-alive connections and resolved DNS entries are reused between
+    requests instead of paying a new handshake on every call.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+        total_timeout: float = None,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout, connect=connect_timeout, sock_read=read_timeout
+        )
+        self._session = None
+        self._raw_session = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            json_serialize=lambda obj: dumps(obj).decode(),
+        )
+        # Shares the pool, but leaves bodies as the API encoded them for passthrough
+        self._raw_session = aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=False,
+            timeout=self.timeout,
+            auto_decompress=False,
+            json_serialize=lambda obj: dumps(obj).decode(),
+        )
+
+    async def close(self):
+        if self._raw_session is not None:
+            await self._raw_session.close()
+            self._raw_session = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def request_timeout(self) -> aiohttp.ClientTimeout:
+        # The deadline of the request bounds the whole call
+        left = time_left()
+        if left is None:
+            return self.timeout
+        check_deadline()
+        total = left if self.timeout.total is None else min(self.timeout.total, left)
+        return aiohttp.ClientTimeout(
+            total=total,
+            connect=self.timeout.connect,
+            sock_read=self.timeout.sock_read,
+            sock_connect=self.timeout.sock_connect,
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise CustomException(500, ERR_INTERNAL, "HTTP client is not started")
+        return self._session
+
+    async def stream_request(
+        self,
+        url,
+        headers,
+        method,
+        body={},
+        accept_encoding: str = None,
+        chunk_size: int = 65536,
+    ) -> UpstreamStream:
+        """
+        Sends the request and returns as soon as the response headers arrive. The
+        API is asked for an encoding the client accepts, since the body reaches
+        the client without being decoded. The deadline only applies until the
+        headers arrive, the body lasts as long as the client reads it.
+        """
+        if self._raw_session is None:
+            raise CustomException(500, ERR_INTERNAL, "HTTP client is not started")
+        headers = {
+            **{
+                name: value
+                for name, value in headers.items()
+                if name.lower() != "accept-encoding"
+            },
+            "Accept-Encoding": accept_encoding or "identity",
+        }
+        try:
+            check_deadline()
+            response = await asyncio.wait_for(
+                self._raw_session.request(
+                    method,
+                    url,
+                    headers=headers,
+                    json=body,
+                ),
+                time_left(),
+            )
+        except Exception as e:
+            if deadline_exceeded(e):
+                raise deadline_error() from e
+            raise CustomException(
+                500,
+                ERR_INTERNAL,
+                f"An error ocurred while trying to make the request: {str(e)}",
+            ) from e
+        return UpstreamStream(response, chunk_size)
+
+    async def make_request(self, url, headers, method, body={}, params={}):
+        url = (
+            url + "?" + "&".join([f"{key}={value}" for key, value in params.items()])
+            if len(params) > 0
+            else url
+        )
+        session = self.session
+        try:
+            # Compressed bodies are decoded by aiohttp while they are read
             async with session.request(
                 method,
                 url,
-                headers=headers,
-                json=json_compatible_body,
+                headers=with_accept_encoding(headers),
+                json=body,
+                timeout=self.request_timeout(),
             ) as response:
                 if response.content_type == "application/json":
-                    json_body = await response.json()
+                    json_body = await response.json(loads=loads)
                 else:
                     json_body = await response.text()
                 result = {
@@ -30,8 +199,10 @@ async def make_request(url, headers, method, body={}, params={}):
                 }
                 return result
         except Exception as e:
+            if deadline_exceeded(e):
+                raise deadline_error() from e
             raise CustomException(
                 500,
                 ERR_INTERNAL,
                 f"An error ocurred while trying to make the request: {str(e)}",
-            )
+            ) from e
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import random
+
+import tiktoken
+
+from connections.api_request import HttpClient
+from errors import CustomException, ERR_INTERNAL
+from lib.batching import pack_batches
+from lib.rate_limit import TokenRateLimiter
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+# Quotas are per API key, so limiters are shared by every client using the same key
+rate_limiters = {}
+
+
+def get_rate_limiter(api_key: str, tokens_per_minute: int) -> TokenRateLimiter:
+    key = hashlib.sha256(api_key.encode()).hexdigest()
+    if key not in rate_limiters:
+        rate_limiters[key] = TokenRateLimiter(tokens_per_minute)
+    return rate_limiters[key]
+
+
+class EmbeddingClient:
+    """
+    Async client for the OpenAI embeddings endpoint. Texts are tokenized off the
+    event loop, truncated to the model limit, packed into batches by item count
+    and token budget, and sent concurrently under a tokens-per-minute limiter.
+    """
+
+    def __init__(
+        self,
+        http_client: HttpClient,
+        api_key: str,
+        url: str = "https://api.openai.com/v1/embeddings",
+        model: str = "text-embedding-ada-002",
+        max_batch_items: int = 2048,
+        max_batch_tokens: int = 300000,
+        max_item_tokens: int = 8191,
+        concurrency: int = 4,
+        tokens_per_minute: int = 1000000,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+    ):
+        self.http_client = http_client
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.max_item_tokens = max_item_tokens
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = get_rate_limiter(api_key, tokens_per_minute)
+
+    def _prepare(self, texts: list):
+        encoding = tiktoken.encoding_for_model(self.model)
+        tokens = encoding.encode_ordinary_batch(texts)
+        inputs = []
+        token_counts = []
+        for text, text_tokens in zip(texts, tokens):
+            if len(text_tokens) > self.max_item_tokens:
+                text_tokens = text_tokens[: self.max_item_tokens]
+                text = encoding.decode(text_tokens)
+            inputs.append(text)
+            token_counts.append(len(text_tokens))
+        return inputs, token_counts
+
+    async def prepare(self, texts: list):
+        return await asyncio.to_thread(self._prepare, texts)
+
+    async def embed(self, texts: list) -> list:
+        embeddings = [None] * len(texts)
+        async for indexes, batch_embeddings in self.embed_batches(texts):
+            for index, embedding in zip(indexes, batch_embeddings):
+                embeddings[index] = embedding
+        return embeddings
+
+    async def embed_batches(self, texts: list):
+        """
+        Yields (indexes, embeddings) for each batch as soon as it completes, so
+        callers can persist results without waiting for the whole input.
+        """
+        inputs, token_counts = await self.prepare(texts)
+        batches = pack_batches(token_counts, self.max_batch_items, self.max_batch_tokens)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(indexes):
+            async with semaphore:
+                batch_tokens = sum(token_counts[i] for i in indexes)
+                embeddings = await self._create(
+                    [inputs[i] for i in indexes], batch_tokens
+                )
+                return indexes, embeddings
+
+        tasks = [asyncio.create_task(run(indexes)) for indexes in batches]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _create(self, inputs: list, tokens: int) -> list:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        body = {"input": inputs, "model": self.model}
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(tokens)
+            try:
+                response = await self.http_client.make_request(
+                    self.url, headers, "POST", body
+                )
+            except CustomException as e:
+                # Connection errors are retried like upstream failures
+                if attempt == self.max_retries:
+                    raise e
+                await asyncio.sleep(self._delay(attempt))
+                continue
+
+            if response["status_code"] == 200:
+                data = sorted(response["body"]["data"], key=lambda item: item["index"])
+                return [item["embedding"] for item in data]
+
+            if (
+                response["status_code"] not in RETRYABLE_STATUS_CODES
+                or attempt == self.max_retries
+            ):
+                raise CustomException(
+                    response["status_code"],
+                    ERR_INTERNAL,
+                    f"Error creating embeddings: {response['body']}",
+                )
+
+            delay = self._delay(attempt, response["headers"].get("Retry-After"))
+            if response["status_code"] == 429:
+                # Every batch sharing the key waits, not just this one
+                self.rate_limiter.penalize(delay)
+            else:
+                await asyncio.sleep(delay)
+
+    def _delay(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Exponential backoff with full jitter
+        return random.uniform(0, self.backoff * 2**attempt)
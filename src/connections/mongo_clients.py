@@ -0,0 +1,292 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pymongo
+from pymongo import monitoring
+
+from lib.log import redact
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Collects connection checkout times of the clients of a manager. pymongo calls
+    it from the thread doing the checkout, so counters are updated under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+
+    def connection_checked_out(self, event):
+        duration = event.duration or 0.0
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_time += duration
+            self.max_checkout_time = max(self.max_checkout_time, duration)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "checkout_time_seconds_total": self.checkout_time,
+                "checkout_time_seconds_max": self.max_checkout_time,
+                "checkout_time_seconds_avg": (
+                    self.checkout_time / self.checkouts if self.checkouts else None
+                ),
+            }
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+class ManagedClient:
+    def __init__(self, connection_string: str, client, now: float):
+        self.connection_string = connection_string
+        self.client = client
+        self.last_used = now
+        self.in_use = 0
+        # Evicted clients still in use are closed when their last lease ends
+        self.retired = False
+
+
+class MongoClientManager:
+    """
+    Keeps one MongoClient per connection string, up to `capacity` clients. The
+    least recently used client is closed when the capacity is reached, and
+    clients idle for `idle_timeout` seconds or failing a health check are closed
+    as well. Clients are leased, so one is never closed while a call uses it.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 100,
+        idle_timeout: float = 300,
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        health_check_timeout: float = 5,
+        client_factory=pymongo.MongoClient,
+        timer=time.monotonic,
+    ):
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.health_check_timeout = health_check_timeout
+        self.client_factory = client_factory
+        self.timer = timer
+        self.pool_metrics = PoolMetrics()
+        self._clients = OrderedDict()
+        self._leases = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.health_check_failures = 0
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def acquire(self, connection_string: str):
+        to_close = []
+        with self._lock:
+            now = self.timer()
+            to_close.extend(self._expire(now))
+            managed = self._lease(connection_string, now)
+        self._close(to_close)
+        if managed is not None:
+            return managed.client
+
+        # The constructor parses the connection string and can resolve SRV
+        # records, so it runs outside the lock not to hold up other lookups
+        logger.info("Opening Mongo client for %s", redact(connection_string))
+        client = self.client_factory(
+            connection_string,
+            maxPoolSize=self.max_pool_size,
+            minPoolSize=self.min_pool_size,
+            event_listeners=[self.pool_metrics],
+        )
+        with self._lock:
+            now = self.timer()
+            managed = self._lease(connection_string, now)
+            if managed is None:
+                self.misses += 1
+                managed = ManagedClient(connection_string, client, now)
+                self._clients[connection_string] = managed
+                while len(self._clients) > self.capacity:
+                    _, evicted = self._clients.popitem(last=False)
+                    self.evictions += 1
+                    to_close.extend(self._retire(evicted))
+                self._start_lease(managed, now)
+            else:
+                # Another caller opened one for the same string in the meantime
+                to_close.append(ManagedClient(connection_string, client, now))
+        self._close(to_close)
+        return managed.client
+
+    def release(self, client):
+        to_close = []
+        with self._lock:
+            managed = self._leases.get(id(client))
+            if managed is None:
+                return
+            managed.in_use -= 1
+            managed.last_used = self.timer()
+            if managed.in_use == 0:
+                del self._leases[id(client)]
+                if managed.retired:
+                    to_close.append(managed)
+        self._close(to_close)
+
+    @contextmanager
+    def client(self, connection_string: str):
+        client = self.acquire(connection_string)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def warm(self, connection_string: str):
+        """
+        Opens the client of a connection string and waits for it to reach the
+        server, so the first request doesn't pay for server discovery.
+        """
+        with self.client(connection_string) as client:
+            with pymongo.timeout(self.health_check_timeout):
+                client.admin.command("ping")
+
+    def check_health(self):
+        """
+        Pings every idle client and closes the ones that don't answer, so the next
+        request reconnects instead of failing. Blocking, meant for a worker thread.
+        """
+        with self._lock:
+            to_close = self._expire(self.timer())
+            idle = [managed for managed in self._clients.values() if managed.in_use == 0]
+        self._close(to_close)
+
+        for managed in idle:
+            try:
+                with pymongo.timeout(self.health_check_timeout):
+                    managed.client.admin.command("ping")
+            except Exception as e:
+                logger.warning(
+                    "Mongo client for %s is unhealthy: %s",
+                    redact(managed.connection_string),
+                    e,
+                )
+                with self._lock:
+                    self.health_check_failures += 1
+                    if self._clients.get(managed.connection_string) is not managed:
+                        continue
+                    del self._clients[managed.connection_string]
+                    to_close = self._retire(managed)
+                self._close(to_close)
+
+    def close(self):
+        with self._lock:
+            to_close = list(self._clients.values())
+            self._clients.clear()
+            self._leases.clear()
+        self._close(to_close)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "capacity": self.capacity,
+                "open_clients": len(self._clients),
+                "leased_clients": len(self._leases),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "health_check_failures": self.health_check_failures,
+            }
+        stats.update(self.pool_metrics.stats())
+        return stats
+
+    def _lease(self, connection_string: str, now: float):
+        # Must be called with the lock held, returns None when there's no client
+        managed = self._clients.get(connection_string)
+        if managed is None:
+            return None
+        self.hits += 1
+        self._clients.move_to_end(connection_string)
+        self._start_lease(managed, now)
+        return managed
+
+    def _start_lease(self, managed: ManagedClient, now: float):
+        # Must be called with the lock held
+        managed.in_use += 1
+        managed.last_used = now
+        self._leases[id(managed.client)] = managed
+
+    def _expire(self, now: float) -> list:
+        # Must be called with the lock held
+        expired = [
+            managed
+            for managed in self._clients.values()
+            if managed.in_use == 0 and now - managed.last_used > self.idle_timeout
+        ]
+        to_close = []
+        for managed in expired:
+            logger.info("Expiring Mongo client for %s", redact(managed.connection_string))
+            del self._clients[managed.connection_string]
+            self.expirations += 1
+            to_close.extend(self._retire(managed))
+        return to_close
+
+    def _retire(self, managed: ManagedClient) -> list:
+        # Must be called with the lock held, returns the clients to close now
+        managed.retired = True
+        if managed.in_use > 0:
+            return []
+        return [managed]
+
+    def _close(self, clients: list):
+        # Closing waits for the monitor threads, so it happens outside the lock
+        for managed in clients:
+            logger.info("Closing Mongo client for %s", redact(managed.connection_string))
+            try:
+                managed.client.close()
+            except Exception as e:
+                logger.warning("Error closing Mongo client: %s", e)
@@ -1,174 +1,267 @@
-import pymongo
+import asyncio
+import itertools
+import logging
 from pymongo import UpdateOne
-from bson.objectid import ObjectId
-
-from cachetools import TLRUCache
-import time
-from connections.api_request import make_request
-from bson import Decimal128
+from configs.settings import settings
+from connections.api_request import HttpClient
 from lib.object_id import replace_objectid_strings
+from connections.mongo_executor import MongoExecutor
+from connections.mongo_clients import MongoClientManager
+from lib.pagination import paginate_find, paginate_pipeline, split_page
+from lib.workers import worker_count, per_worker
 
-INACTIVITY_TIMEOUT = 60 * 5
+logger = logging.getLogger(__name__)
 
+workers = worker_count(settings.WORKERS)
 
-class CustomCache(TLRUCache):
-    def __delitem__(self, key):
-        print(f"Removing {key} from cache")
-        super().__delitem__(key)
+executor = MongoExecutor(
+    max_workers=per_worker(settings.MONGO_EXECUTOR_WORKERS, workers),
+    max_pending=per_worker(settings.MONGO_EXECUTOR_MAX_PENDING, workers),
+)
 
-    def expire(self, time=None):
-        expired_items = list(super().expire(time))
-        for key, _ in expired_items:
-            print(f"Expiring {key} from cache")
-        return expired_items
+# Each connection string opens at most MONGO_MAX_POOL_SIZE connections in total
+clients = MongoClientManager(
+    capacity=settings.MONGO_CLIENTS_CAPACITY,
+    idle_timeout=settings.MONGO_CLIENT_IDLE_TIMEOUT,
+    max_pool_size=per_worker(settings.MONGO_MAX_POOL_SIZE, workers),
+    min_pool_size=per_worker(settings.MONGO_MIN_POOL_SIZE, workers, minimum=0),
+    health_check_timeout=settings.MONGO_HEALTH_CHECK_TIMEOUT,
+)
 
 
-def custom_ttu(_key, _value, now):
-    return now + INACTIVITY_TIMEOUT
+async def run_health_checks(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await executor.run(clients.check_health)
+        except Exception:
+            logger.exception("Error checking Mongo clients")
 
 
-cache = CustomCache(maxsize=20, ttu=custom_ttu, timer=time.monotonic)
+async def warm_client(connection_string: str):
+    return await executor.run(clients.warm, connection_string)
 
 
-def get_mongo_client(connection_string: str):
-    if connection_string in cache:
-        print(f"Cache hit for {connection_string}")
-        return cache[connection_string]
-    print(f"Cache miss for {connection_string}")
-    client = pymongo.MongoClient(connection_string)
-    cache[connection_string] = client
-    return client
+async def execute_query(
+    connection_string: str,
+    collection: str,
+    method: str,
+    filter_body: dict = None,
+    update_body: dict = None,
+):
+    return await executor.run(
+        _execute_query, connection_string, collection, method, filter_body, update_body
+    )
 
 
-async def execute_query(
+def _execute_query(
     connection_string: str,
     collection: str,
     method: str,
     filter_body: dict = None,
     update_body: dict = None,
 ):
-    db = get_mongo_client(connection_string).get_database()[collection]
-
-    if method == "aggregate":
-        res = list(db.aggregate(pipeline=filter_body))
-    elif method == "count":
-        res = db.count_documents(filter_body)
-    elif method == "distinct":
-        res = db.distinct(filter_body)
-    elif method == "find":
-        res = list(db.find(filter_body))
-    elif method == "findOne":
-        res = db.find_one(filter_body)
-    elif method == "findOneAndDelete":
-        res = db.find_one_and_delete(filter_body)
-    elif method == "findOneAndReplace":
-        res = db.find_one_and_replace(filter_body, update_body)
-    elif method == "findOneAndUpdate":
-        res = db.find_one_and_update(filter_body, update_body)
-    elif method == "insertOne":
-        res = db.insert_one(filter_body).inserted_id
-    elif method == "insertMany":
-        res = db.insert_many(filter_body).inserted_ids
-    elif method == "updateOne":
-        modified_count = db.update_one(filter_body, update_body).modified_count
-        res = {"modified_count": modified_count}
-    elif method == "updateMany":
-        modified_count = db.update_many(filter_body, update_body).modified_count
-        res = {"modified_count": modified_count}
-    elif method == "deleteOne":
-        deleted_count = db.delete_one(filter_body).deleted_count
-        res = {"deleted_count": deleted_count}
-    elif method == "deleteMany":
-        deleted_count = db.delete_many(filter_body).deleted_count
-        res = {"deleted_count": deleted_count}
+    with clients.client(connection_string) as client:
+        db = client.get_database()[collection]
+
+        if method == "aggregate":
+            res = list(db.aggregate(pipeline=filter_body))
+        elif method == "count":
+            res = db.count_documents(filter_body)
+        elif method == "distinct":
+            res = db.distinct(filter_body)
+        elif method == "find":
+            res = list(db.find(filter_body))
+        elif method == "findOne":
+            res = db.find_one(filter_body)
+        elif method == "findOneAndDelete":
+            res = db.find_one_and_delete(filter_body)
+        elif method == "findOneAndReplace":
+            res = db.find_one_and_replace(filter_body, update_body)
+        elif method == "findOneAndUpdate":
+            res = db.find_one_and_update(filter_body, update_body)
+        elif method == "insertOne":
+            res = db.insert_one(filter_body).inserted_id
+        elif method == "insertMany":
+            res = db.insert_many(filter_body).inserted_ids
+        elif method == "updateOne":
+            modified_count = db.update_one(filter_body, update_body).modified_count
+            res = {"modified_count": modified_count}
+        elif method == "updateMany":
+            modified_count = db.update_many(filter_body, update_body).modified_count
+            res = {"modified_count": modified_count}
+        elif method == "deleteOne":
+            deleted_count = db.delete_one(filter_body).deleted_count
+            res = {"deleted_count": deleted_count}
+        elif method == "deleteMany":
+            deleted_count = db.delete_many(filter_body).deleted_count
+            res = {"deleted_count": deleted_count}
 
     return parse_response(res)
 
 
-async def get_embeddings(query: str, api_key: str):
-    url = "https://api.openai.com/v1/embeddings"
+async def execute_paginated_query(
+    connection_string: str,
+    collection: str,
+    method: str,
+    filter_body,
+    page_size: int,
+    sort_key: str = "_id",
+    sort_order: str = "asc",
+    cursor: str = None,
+):
+    return await executor.run(
+        _execute_paginated_query,
+        connection_string,
+        collection,
+        method,
+        filter_body,
+        page_size,
+        sort_key,
+        sort_order,
+        cursor,
+    )
+
+
+def _execute_paginated_query(
+    connection_string: str,
+    collection: str,
+    method: str,
+    filter_body,
+    page_size: int,
+    sort_key: str,
+    sort_order: str,
+    cursor: str,
+):
+    if method == "find":
+        filter_body, sort, limit = paginate_find(
+            filter_body, page_size, sort_key, sort_order, cursor
+        )
+    elif method == "aggregate":
+        pipeline = paginate_pipeline(filter_body, page_size, sort_key, sort_order, cursor)
+    else:
+        raise ValueError(f"Method {method} can't be paginated")
+
+    with clients.client(connection_string) as client:
+        db = client.get_database()[collection]
+        if method == "find":
+            documents = list(db.find(filter_body, sort=sort, limit=limit))
+        else:
+            documents = list(db.aggregate(pipeline=pipeline))
+
+    page, next_cursor = split_page(documents, page_size, sort_key, sort_order)
+    return {**parse_response(page), "next_cursor": next_cursor}
+
+
+async def open_cursor(
+    connection_string: str,
+    collection: str,
+    method: str,
+    filter_body: dict = None,
+    batch_size: int = 500,
+):
+    """
+    Opens a cursor and returns an async generator over its batches. The client is
+    leased until the generator is closed, so it isn't closed under the cursor.
+    """
+    client, cursor = await executor.run(
+        _open_cursor, connection_string, collection, method, filter_body, batch_size
+    )
+    return iterate_cursor(client, cursor, batch_size)
+
+
+def _open_cursor(
+    connection_string: str,
+    collection: str,
+    method: str,
+    filter_body: dict = None,
+    batch_size: int = 500,
+):
+    client = clients.acquire(connection_string)
+    try:
+        db = client.get_database()[collection]
+        if method == "aggregate":
+            return client, db.aggregate(pipeline=filter_body, batchSize=batch_size)
+        elif method == "find":
+            return client, db.find(filter_body, batch_size=batch_size)
+        raise ValueError(f"Method {method} does not return a cursor")
+    except Exception:
+        clients.release(client)
+        raise
+
+
+async def iterate_cursor(client, cursor, batch_size: int = 500):
+    # Only one batch of documents is held in memory at a time
+    try:
+        while True:
+            batch = await executor.run(_next_batch, cursor, batch_size)
+            if not batch:
+                break
+            yield batch
+    finally:
+        cursor.close()
+        clients.release(client)
+
+
+def _next_batch(cursor, batch_size: int):
+    return parse_response(list(itertools.islice(cursor, batch_size)))["body"]
+
+
+async def get_embeddings(query: str, api_key: str, http_client: HttpClient):
+    url = settings.EMBEDDINGS_URL
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}",
     }
-    response = await make_request(
-        url, headers, "POST", {"input": query, "model": "text-embedding-ada-002"}
+    response = await http_client.make_request(
+        url, headers, "POST", {"input": query, "model": settings.EMBEDDINGS_MODEL}
     )
     return response
 
 
 async def bulk_update(connection_string: str, collection: str, updates: dict):
-    db = get_mongo_client(connection_string).get_database()[collection]
+    return await executor.run(_bulk_update, connection_string, collection, updates)
+
+
+def _bulk_update(connection_string: str, collection: str, updates: dict):
     operations = []
-    for id, update in updates.items():
+    # updates maps each _id to the fields to set in that document
+    for id, fields in updates.items():
         id = replace_objectid_strings(id)
-        operations.append(UpdateOne({"_id": id}, {"$set": {"embedding": update}}))
-    res = {"data": db.bulk_write(operations).bulk_api_result}
+        operations.append(UpdateOne({"_id": id}, {"$set": fields}))
+    with clients.client(connection_string) as client:
+        db = client.get_database()[collection]
+        res = {"data": db.bulk_write(operations).bulk_api_result}
     return res
 
 
 async def execute_vector_search(
     connection_string: str,
-    api_key: str,
     collection: str,
-    query: str,
+    query_vector: list,
     limit: int,
     num_candidates: int,
     index_field: str = "fastboard_index",
     path: str = "embedding",
 ):
-    db = get_mongo_client(connection_string).get_database()[collection]
-
-    query_vector = await get_embeddings(query, api_key)
-
-    res = list(
-        db.aggregate(
-            [
-                {
-                    "$vectorSearch": {
-                        "queryVector": query_vector["body"]["data"][0]["embedding"],
-                        "path": path,
-                        "limit": limit,
-                        "numCandidates": num_candidates,
-                        "index": index_field,
-                    }
-                },
-                {"$project": {"embedding": 0}},
-            ]
-        )
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "queryVector": query_vector,
+                "path": path,
+                "limit": limit,
+                "numCandidates": num_candidates,
+                "index": index_field,
+            }
+        },
+        {"$project": {"embedding": 0}},
+    ]
+    return await executor.run(
+        _execute_query, connection_string, collection, "aggregate", pipeline
     )
 
-    return parse_response(res)
-
 
 def parse_response(response):
-    if isinstance(response, ObjectId):
-        # response = str(response)
-        response = "ObjectId('" + str(response) + "')"
-    if isinstance(response, Decimal128):
-        response = Decimal128.to_decimal(response)
-
-    if isinstance(response, dict):
-        for k, v in response.items():
-            if isinstance(v, ObjectId):
-                # response[k] = str(v)
-                response[k] = "ObjectId('" + str(v) + "')"
-            if isinstance(v, Decimal128):
-                response[k] = Decimal128.to_decimal(v)
-
-    elif isinstance(response, list):
-        for item in response:
-            if isinstance(item, ObjectId):
-                # response[response.index(item)] = str(item)
-                response[response.index(item)] = "ObjectId('" + str(item) + "')"
-            if isinstance(item, Decimal128):
-                response[response.index(item)] = Decimal128.to_decimal(item)
-            if isinstance(item, dict):
-                for k, v in item.items():
-                    if isinstance(v, ObjectId):
-                        # item[k] = str(v)
-                        item[k] = "ObjectId('" + str(v) + "')"
-                    if isinstance(v, Decimal128):
-                        item[k] = Decimal128.to_decimal(v)
-
+    # BSON values are kept as they are and converted by lib.encoding when the
+    # response is serialized, so results are walked only once
     return {"body": response}
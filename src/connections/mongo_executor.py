@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+
+from errors import CustomException, ERR_INTERNAL
+from lib.deadline import DeadlineExceeded, check_deadline, current_deadline
+
+
+class MongoExecutor:
+    """
+    Bounded thread pool for blocking pymongo calls, so a slow Mongo round trip
+    doesn't block the event loop. At most `max_workers` calls run at a time and at
+    most `max_pending` more wait in the pool queue; further callers wait on the
+    event loop without holding a thread. Calls run under the deadline of the
+    caller as a pymongo timeout, which also sets maxTimeMS on the operations.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._active = 0
+        self._queued = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._run_time = 0.0
+        self.start()
+
+    def start(self):
+        # Called on startup, so the pool is back after a previous shutdown
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="mongo"
+            )
+
+    async def run(self, fn, *args, **kwargs):
+        # Threads don't inherit the context, so the deadline is passed along
+        if self._executor is None:
+            raise CustomException(500, ERR_INTERNAL, "Mongo executor is not started")
+        check_deadline()
+        deadline = current_deadline()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers + self.max_pending)
+
+        async with self._slots:
+            submitted_at = time.perf_counter()
+            with self._lock:
+                self._submitted += 1
+                self._queued += 1
+
+            def call():
+                started_at = time.perf_counter()
+                wait_time = started_at - submitted_at
+                with self._lock:
+                    self._queued -= 1
+                    self._active += 1
+                    self._wait_time += wait_time
+                    self._max_wait_time = max(self._max_wait_time, wait_time)
+                failed = False
+                try:
+                    # Time spent queued counts against the deadline
+                    left = None if deadline is None else deadline.time_left()
+                    if left is not None and left <= 0:
+                        raise DeadlineExceeded()
+                    with pymongo.timeout(left):
+                        return fn(*args, **kwargs)
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    with self._lock:
+                        self._active -= 1
+                        self._run_time += time.perf_counter() - started_at
+                        if failed:
+                            self._failed += 1
+                        else:
+                            self._completed += 1
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, call)
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "active": self._active,
+                "queued": self._queued,
+                "wait_time_seconds_total": self._wait_time,
+                "wait_time_seconds_max": self._max_wait_time,
+                "run_time_seconds_total": self._run_time,
+                "run_time_seconds_avg": self._run_time / finished if finished else 0.0,
+            }
+
+    async def shutdown(self):
+        """
+        Drops the queued calls and waits in a thread for the running ones, so the
+        event loop keeps serving while they finish.
+        """
+        executor, self._executor = self._executor, None
+        # The semaphore belongs to the loop that is stopping
+        self._slots = None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
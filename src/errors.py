@@ -1,3 +1,4 @@
+import logging
 from fastapi import (
     HTTPException,
 )
@@ -10,6 +11,11 @@ ERR_BAD_REQUEST = "A1"
 ERR_UNSUPPORTED_QUERY_TYPE = "A2"
 ERR_QUERY_EXECUTION = "A3"
 ERR_BAD_PARAMETERS = "A4"
+ERR_NOT_FOUND = "A5"
+ERR_UPSTREAM_UNAVAILABLE = "A6"
+ERR_DEADLINE_EXCEEDED = "A7"
+
+logger = logging.getLogger(__name__)
 
 
 class CustomException(HTTPException):
@@ -29,7 +35,12 @@ class CustomException(HTTPException):
     def create_json_response(
         self,
     ):
-        print(f"Error: {self.error_code} - {self.description}")
+        logger.info(
+            "Error: %s - %s",
+            self.error_code,
+            self.description,
+            extra={"status_code": self.status_code},
+        )
         return JSONResponse(
             status_code=self.status_code,
             content={
@@ -52,7 +63,7 @@ def handle_validation_error(_, exc) -> JSONResponse:
         field_name = error["loc"]
         error_messages.append(f"{field_name}: {error['msg']}")
     message = ", ".join(error_messages)
-    print(f"Validation error: {message}")
+    logger.info("Validation error: %s", message)
     return JSONResponse(
         status_code=400,
         content={
@@ -0,0 +1,19 @@
+def pack_batches(token_counts: list, max_items: int, max_tokens: int) -> list:
+    """
+    Groups consecutive items into batches that respect both a maximum number of
+    items and a maximum number of tokens. Returns the indexes of each batch. An item
+    bigger than `max_tokens` gets a batch of its own.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for index, tokens in enumerate(token_counts):
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
@@ -0,0 +1,237 @@
+import asyncio
+import zlib
+
+import brotli
+import zstandard
+
+GZIP = "gzip"
+BROTLI = "br"
+ZSTD = "zstd"
+
+# aiohttp decodes these itself, br with the brotli package
+UPSTREAM_ACCEPT_ENCODING = "gzip, deflate, br"
+
+
+def with_accept_encoding(headers: dict) -> dict:
+    # Headers of the query definition take precedence
+    if any(name.lower() == "accept-encoding" for name in headers):
+        return headers
+    return {**headers, "Accept-Encoding": UPSTREAM_ACCEPT_ENCODING}
+
+
+class GzipCodec:
+    name = GZIP
+
+    def __init__(self, level: int):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level, wbits=31)
+
+    def stream(self):
+        return ZlibStream(zlib.compressobj(self.level, zlib.DEFLATED, 31))
+
+
+class ZlibStream:
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def compress(self, chunk: bytes) -> bytes:
+        # Flushed on every chunk, so the client can decode what it got so far
+        return self._compressor.compress(chunk) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCodec:
+    name = BROTLI
+
+    def __init__(self, quality: int):
+        self.quality = quality
+
+    def compress(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=self.quality)
+
+    def stream(self):
+        return BrotliStream(brotli.Compressor(quality=self.quality))
+
+
+class BrotliStream:
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCodec:
+    name = ZSTD
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def stream(self):
+        return ZstdStream(self._compressor.compressobj())
+
+
+class ZstdStream:
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compressor.compress(chunk) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def available_codecs(
+    preference: list, gzip_level: int = 5, brotli_quality: int = 4, zstd_level: int = 3
+) -> list:
+    """
+    Codecs in order of preference, leaving out unknown names.
+    """
+    factories = {
+        GZIP: lambda: GzipCodec(gzip_level),
+        BROTLI: lambda: BrotliCodec(brotli_quality),
+        ZSTD: lambda: ZstdCodec(zstd_level),
+    }
+    return [factories[name]() for name in preference if name in factories]
+
+
+def negotiate_encoding(accept_encoding: str, codecs: list):
+    """
+    Returns the codec with the highest quality in the Accept-Encoding header, the
+    order of `codecs` breaks ties. None means the response goes uncompressed.
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, *params = [part.strip() for part in coding.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    wildcard = qualities.get("*", 0.0)
+    candidates = [
+        (-qualities.get(codec.name, wildcard), position, codec)
+        for position, codec in enumerate(codecs)
+    ]
+    candidates = [candidate for candidate in candidates if candidate[0] < 0]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda candidate: candidate[:2])[2]
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with the encoding negotiated from Accept-Encoding.
+    Bodies under `minimum_size` and responses that already have an encoding, like
+    REST passthroughs, are sent as they are. Streamed bodies are compressed chunk
+    by chunk, and bodies of `offload_size` or more are compressed in a thread so
+    they don't block the event loop.
+    """
+
+    def __init__(
+        self, app, codecs: list, minimum_size: int = 1024, offload_size: int = 0
+    ):
+        self.app = app
+        self.codecs = codecs
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        codec = negotiate_encoding(accept_encoding, self.codecs)
+        if codec is None:
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, CompressedSend(send, codec, self))
+
+
+class CompressedSend:
+    def __init__(self, send, codec, middleware: CompressionMiddleware):
+        self.send = send
+        self.codec = codec
+        self.middleware = middleware
+        self.start = None
+        self.stream = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.passthrough = any(
+                name.lower() == b"content-encoding" for name, _ in message["headers"]
+            )
+            # Bodies that are already encoded are sent as they are, so their
+            # headers don't wait for the first chunk
+            if self.passthrough:
+                return await self.send(message)
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            return await self._send_start_and(message)
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.stream is not None:
+            chunk = self.stream.compress(body) if body else b""
+            if not more_body:
+                chunk += self.stream.finish()
+            return await self.send({**message, "body": chunk})
+
+        if not more_body:
+            # The whole body is here, small ones aren't worth compressing
+            if len(body) < self.middleware.minimum_size:
+                return await self._send_start_and(message)
+            if self.middleware.offload_size and len(body) >= self.middleware.offload_size:
+                body = await asyncio.to_thread(self.codec.compress, body)
+            else:
+                body = self.codec.compress(body)
+            self._set_headers(content_length=len(body))
+            return await self._send_start_and({**message, "body": body})
+
+        self.stream = self.codec.stream()
+        self._set_headers(content_length=None)
+        await self._send_start_and({**message, "body": self.stream.compress(body)})
+
+    async def _send_start_and(self, message):
+        if self.start is not None:
+            await self.send(self.start)
+            self.start = None
+        await self.send(message)
+
+    def _set_headers(self, content_length):
+        headers = [
+            (name, value)
+            for name, value in self.start["headers"]
+            if name.lower() != b"content-length"
+        ]
+        headers.append((b"content-encoding", self.codec.name.encode()))
+        vary = [value for name, value in headers if name.lower() == b"vary"]
+        if not any(b"accept-encoding" in value.lower() for value in vary):
+            headers.append((b"vary", b"Accept-Encoding"))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        self.start = {**self.start, "headers": headers}
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+ENCRYPTED_CREDENTIALS = ("openai_api_key",)
+
+logger = logging.getLogger(__name__)
+
+
+def connection_id(connection: dict):
+    return connection.get("id", connection.get("_id"))
+
+
+class ResolvedConnection:
+    """
+    A connection with its encrypted credentials decrypted once. Decryption is
+    lazy, so connections that never use an encrypted secret don't pay for it.
+    """
+
+    def __init__(self, connection: dict, now: float, decrypt):
+        self.id = connection_id(connection)
+        self.type = connection.get("type")
+        self.credentials = connection.get("credentials", {})
+        self.variables = connection.get("variables", {})
+        self.resolved_at = now
+        self._decrypt = decrypt
+        self._decrypted = None
+
+    def decrypted_credentials(self) -> dict:
+        if self._decrypted is None:
+            self._decrypted = {
+                **self.credentials,
+                **{
+                    name: self._decrypt(self.credentials[name])
+                    for name in ENCRYPTED_CREDENTIALS
+                    if name in self.credentials
+                },
+            }
+        return self._decrypted
+
+
+class ConnectionRegistry:
+    """
+    Resolved connections by id, kept for `ttl` seconds and up to `maxsize`
+    entries. An entry is resolved again as soon as the credentials it was built
+    from change. The order of use is kept so the most recently used connections
+    can be saved and prewarmed on the next start.
+    """
+
+    def __init__(self, ttl: float, maxsize: int, decrypt, timer=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.decrypt = decrypt
+        self.timer = timer
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, id) -> bool:
+        return id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def resolve(self, connection: dict) -> ResolvedConnection:
+        now = self.timer()
+        id = connection_id(connection)
+        if id is None:
+            return ResolvedConnection(connection, now, self.decrypt)
+
+        resolved = self._entries.get(id)
+        if (
+            resolved is not None
+            and now - resolved.resolved_at < self.ttl
+            and resolved.credentials == connection.get("credentials", {})
+            and resolved.variables == connection.get("variables", {})
+        ):
+            self.hits += 1
+            self._entries.move_to_end(id)
+            return resolved
+
+        self.misses += 1
+        resolved = ResolvedConnection(connection, now, self.decrypt)
+        self._entries[id] = resolved
+        self._entries.move_to_end(id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return resolved
+
+    def invalidate(self, id) -> bool:
+        return self._entries.pop(id, None) is not None
+
+    def clear(self):
+        self._entries.clear()
+
+    def recent(self, count: int) -> list:
+        return list(reversed(self._entries.keys()))[:count]
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def load_recent(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path) as file:
+            ids = json.load(file)
+    except (OSError, ValueError) as e:
+        logger.warning("Couldn't load recent connections from %s: %s", path, e)
+        return []
+    return [id for id in ids if isinstance(id, str)] if isinstance(ids, list) else []
+
+
+def save_recent(path: str, ids: list):
+    # Written to a temporary file first, so a crash never leaves a partial file.
+    # Every worker saves its own list, the temporary file is per process
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "w") as file:
+            json.dump(ids, file)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logger.warning("Couldn't save recent connections to %s: %s", path, e)
@@ -0,0 +1,17 @@
+import hashlib
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def needs_embedding(document: dict, text_hash: str, model: str) -> bool:
+    """
+    A document is embedded again when it has no embedding, or when the embedding
+    was created from another text or by another model.
+    """
+    return not (
+        document.get("has_embedding")
+        and document.get("embedding_hash") == text_hash
+        and document.get("embedding_model") == model
+    )
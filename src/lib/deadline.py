@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from pymongo.errors import PyMongoError
+
+from errors import CustomException, ERR_DEADLINE_EXCEEDED
+from lib.metrics import requests_cancelled
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_HEADER = b"x-request-timeout"
+
+# Timeouts this close to the deadline are taken as caused by it, pymongo ends
+# operations slightly early to leave time for the round trip
+EXPIRY_MARGIN = 0.05
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    def __init__(self):
+        super().__init__("Deadline exceeded")
+
+
+class Deadline:
+    """
+    Point in time by which a request has to be answered. None means no deadline,
+    which is also the case once it is lifted.
+    """
+
+    def __init__(self, timeout: Optional[float], timer=time.monotonic):
+        self.timer = timer
+        self.expires_at = None if timeout is None else timer() + timeout
+
+    def time_left(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - self.timer()
+
+    def lift(self):
+        self.expires_at = None
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def time_left() -> Optional[float]:
+    deadline = _current.get()
+    return None if deadline is None else deadline.time_left()
+
+
+def has_time(seconds: float = 0.0) -> bool:
+    left = time_left()
+    return left is None or left > seconds
+
+
+def check_deadline():
+    if not has_time():
+        raise DeadlineExceeded()
+
+
+def clear_deadline():
+    # Background work started by a request outlives its deadline
+    _current.set(None)
+
+
+@contextmanager
+def deadline_scope(timeout: Optional[float]):
+    """
+    Narrows the current deadline to `timeout` seconds from now within the block.
+    A later deadline than the current one is ignored.
+    """
+    parent = _current.get()
+    deadline = Deadline(timeout) if timeout is not None else None
+    if deadline is None or (
+        parent is not None
+        and parent.expires_at is not None
+        and parent.expires_at <= deadline.expires_at
+    ):
+        yield parent
+        return
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def is_timeout(error: BaseException) -> bool:
+    while error is not None:
+        if isinstance(error, asyncio.TimeoutError):
+            return True
+        if isinstance(error, PyMongoError) and error.timeout:
+            return True
+        error = error.__cause__
+    return False
+
+
+def deadline_exceeded(error: BaseException = None) -> bool:
+    """
+    Whether the current deadline has passed, or `error` is a timeout caused by
+    it rather than by a slow upstream.
+    """
+    cause = error
+    while cause is not None:
+        if isinstance(cause, DeadlineExceeded):
+            return True
+        cause = cause.__cause__
+    left = time_left()
+    if left is None:
+        return False
+    return left <= 0 or (left <= EXPIRY_MARGIN and is_timeout(error))
+
+
+def deadline_error(description: str = "Request exceeded its deadline"):
+    return CustomException(
+        status_code=504, error_code=ERR_DEADLINE_EXCEEDED, description=description
+    )
+
+
+def parse_timeout(value: Optional[str]) -> Optional[float]:
+    # Seconds, anything else is ignored
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    return timeout if timeout > 0 else None
+
+
+class DeadlineMiddleware:
+    """
+    Gives every request a deadline of `default` seconds, or the seconds in its
+    X-Request-Timeout header up to `maximum`. A request still without a response
+    when the deadline passes is cancelled and answered with a 504, and one whose
+    client disconnects is cancelled. Once the response starts the deadline is
+    lifted, streamed bodies run for as long as the client reads them.
+    """
+
+    def __init__(self, app, default: float = None, maximum: float = None):
+        self.app = app
+        self.default = default
+        self.maximum = maximum
+
+    def request_timeout(self, headers) -> Optional[float]:
+        timeout = None
+        for name, value in headers:
+            if name == TIMEOUT_HEADER:
+                timeout = parse_timeout(value.decode("latin-1"))
+        if timeout is None:
+            timeout = self.default
+        if self.maximum is not None:
+            timeout = self.maximum if timeout is None else min(timeout, self.maximum)
+        return timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        deadline = Deadline(self.request_timeout(scope["headers"]))
+        request = RequestWatch(receive, send, deadline)
+
+        token = _current.set(deadline)
+        try:
+            # The task runs with a copy of the context, so it sees the deadline
+            task = asyncio.ensure_future(self.app(scope, request.receive, request.send))
+        finally:
+            _current.reset(token)
+        watcher = asyncio.ensure_future(request.watch_disconnect())
+        try:
+            while not task.done():
+                waiting = {task} if watcher.done() else {task, watcher}
+                timeout = None if request.started else deadline.time_left()
+                await asyncio.wait(
+                    waiting,
+                    timeout=None if timeout is None else max(timeout, 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if task.done() or request.started:
+                    continue
+                if request.disconnected.is_set():
+                    requests_cancelled.inc(reason="disconnect")
+                    logger.info("Client disconnected, cancelling %s", scope["path"])
+                    await cancel(task)
+                    return
+                left = deadline.time_left()
+                if left is not None and left <= 0:
+                    requests_cancelled.inc(reason="deadline")
+                    await cancel(task)
+                    if not request.started:
+                        response = deadline_error().create_json_response()
+                        await response(scope, receive, send)
+                    return
+            task.result()
+        finally:
+            watcher.cancel()
+            if not task.done():
+                task.cancel()
+
+
+async def cancel(task: asyncio.Task):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception("Error while cancelling request")
+
+
+class RequestWatch:
+    """
+    Wraps the receive and send of a request. Once the app has read the whole
+    body, incoming messages are read here to notice a disconnect, and the app
+    gets it when it asks for the next message.
+    """
+
+    def __init__(self, receive, send, deadline: Deadline):
+        self._receive = receive
+        self._send = send
+        self.deadline = deadline
+        self.started = False
+        self.body_read = asyncio.Event()
+        self.disconnected = asyncio.Event()
+
+    async def receive(self):
+        if self.body_read.is_set():
+            await self.disconnected.wait()
+            return {"type": "http.disconnect"}
+        message = await self._receive()
+        if message["type"] == "http.disconnect":
+            self.disconnected.set()
+            self.body_read.set()
+        elif not message.get("more_body", False):
+            self.body_read.set()
+        return message
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.started = True
+            self.deadline.lift()
+        await self._send(message)
+
+    async def watch_disconnect(self):
+        await self.body_read.wait()
+        while not self.disconnected.is_set():
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected.set()
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class DefinitionCache:
+    """
+    LRU cache with TTL for definitions fetched from the dashboards service.
+    Entries older than `ttl` but younger than `ttl + stale_ttl` are still served
+    while a single background task refreshes them (stale-while-revalidate).
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        stale_ttl: float,
+        maxsize: int,
+        should_cache=lambda value: True,
+        timer=time.monotonic,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.should_cache = should_cache
+        self.timer = timer
+        self._entries = OrderedDict()
+        self._refreshing = {}
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key, loader):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = self.timer() - stored_at
+            if age < self.ttl:
+                self._entries.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self._schedule_refresh(key, loader)
+                return value
+
+        value = await loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        if not self.should_cache(value):
+            return
+        self._entries[key] = (value, self.timer())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key) -> bool:
+        refresh = self._refreshing.pop(key, None)
+        if refresh is not None:
+            refresh.cancel()
+        return self._entries.pop(key, None) is not None
+
+    def invalidate_where(self, predicate) -> int:
+        keys = [key for key, (value, _) in self._entries.items() if predicate(key, value)]
+        for key in keys:
+            self.invalidate(key)
+        return len(keys)
+
+    def clear(self):
+        for refresh in self._refreshing.values():
+            refresh.cancel()
+        self._refreshing.clear()
+        self._entries.clear()
+
+    def _schedule_refresh(self, key, loader):
+        if key in self._refreshing:
+            return
+        self._refreshing[key] = asyncio.create_task(self._refresh(key, loader))
+
+    async def _refresh(self, key, loader):
+        try:
+            self.set(key, await loader())
+        except Exception as e:
+            # The stale value keeps being served until it falls out of the window
+            logger.warning("Error refreshing %s: %s", key, e)
+        finally:
+            self._refreshing.pop(key, None)
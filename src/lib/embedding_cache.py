@@ -0,0 +1,127 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+from cachetools import LRUCache
+
+
+def normalize_text(text: str) -> str:
+    # Whitespace and unicode form don't change the meaning of the query
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+
+class EmbeddingCache:
+    """
+    Cache of query embeddings keyed by (model, normalized text). Entries live in an
+    in-memory LRU and, when `path` is set, in a SQLite file that survives restarts.
+    Disk reads and writes run in a worker thread. Once the file holds more than
+    `disk_maxsize` entries, the least recently used ones are dropped in a batch
+    that leaves a tenth of the room free, so most writes don't prune at all.
+    """
+
+    def __init__(self, maxsize: int, path: str = None, disk_maxsize: int = 100000):
+        self._memory = LRUCache(maxsize=maxsize)
+        self.disk_maxsize = disk_maxsize
+        self.prune_batch = max(1, disk_maxsize // 10)
+        # Upper bound of the rows in the file, replaced rows and rows written by
+        # other workers are corrected when it is counted again before pruning
+        self._rows = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        self._lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            # Workers of an instance share the file, WAL lets them read while one writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT, text TEXT, vector BLOB, used_at REAL, "
+                "PRIMARY KEY (model, text))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)"
+            )
+            self._db.commit()
+            self._rows = self._count()
+
+    async def get(self, model: str, text: str):
+        key = (model, normalize_text(text))
+        vector = self._memory.get(key)
+        if vector is not None:
+            self.hits += 1
+            return vector
+        if self._db is not None:
+            vector = await asyncio.to_thread(self._read, key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._memory[key] = vector
+                return vector
+        self.misses += 1
+        return None
+
+    async def set(self, model: str, text: str, vector: list):
+        key = (model, normalize_text(text))
+        self._memory[key] = vector
+        if self._db is not None:
+            await asyncio.to_thread(self._write, key, vector)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
+
+    def _read(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND text = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE embeddings SET used_at = ? WHERE model = ? AND text = ?",
+                (time.time(), *key),
+            )
+            self._db.commit()
+        return array("d", row[0]).tolist()
+
+    def _write(self, key, vector: list):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                (*key, array("d", vector).tobytes(), time.time()),
+            )
+            self._rows += 1
+            if self._rows > self.disk_maxsize:
+                self._prune()
+            self._db.commit()
+
+    def _count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _prune(self):
+        # Must be called with the lock held. The oldest rows are found through
+        # the used_at index, without sorting the table
+        rows = self._count()
+        if rows > self.disk_maxsize:
+            excess = rows - self.disk_maxsize + self.prune_batch
+            self._db.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings "
+                "ORDER BY used_at LIMIT ?)",
+                (excess,),
+            )
+            rows -= excess
+        self._rows = rows
@@ -0,0 +1,55 @@
+import base64
+from collections.abc import Mapping
+from decimal import Decimal
+
+import orjson
+from bson import Binary, Decimal128, ObjectId, json_util
+from fastapi.responses import Response
+
+
+def encode_decimal(value: Decimal):
+    # Same as FastAPI: integral values stay integers, the rest become floats.
+    # NaN and Infinity have no integer form, as floats they're encoded as null
+    if value.is_finite() and value.as_tuple().exponent >= 0:
+        return int(value)
+    return float(value)
+
+
+def default(obj):
+    """
+    Called by orjson for the types it can't serialize natively. Dicts, lists,
+    strings, numbers, datetimes and UUIDs never get here.
+    """
+    if isinstance(obj, ObjectId):
+        return "ObjectId('" + str(obj) + "')"
+    if isinstance(obj, Decimal128):
+        return encode_decimal(obj.to_decimal())
+    if isinstance(obj, Decimal):
+        return encode_decimal(obj)
+    if isinstance(obj, (Binary, bytes)):
+        return base64.b64encode(obj).decode()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    # Other BSON types (Timestamp, Regex, Code, ...) use extended JSON
+    return json_util.default(obj)
+
+
+def dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+loads = orjson.loads
+
+
+class BSONResponse(Response):
+    """
+    JSON response encoded in a single pass straight from BSON values, without
+    going through jsonable_encoder first.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
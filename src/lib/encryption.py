@@ -1,14 +1,20 @@
+from functools import lru_cache
+
 from cryptography.fernet import Fernet
 from configs.settings import settings
 
 
+@lru_cache(maxsize=1)
+def get_fernet(key: str) -> Fernet:
+    # Building a Fernet derives its keys, so one instance is reused per key
+    return Fernet(key.encode())
+
+
 def encrypt(data: str) -> str:
-    key = settings.PRIVATE_KEY.encode()
-    f = Fernet(key)
+    f = get_fernet(settings.PRIVATE_KEY)
     return f.encrypt(data.encode()).decode()
 
 
 def decrypt(data: str) -> str:
-    key = settings.PRIVATE_KEY.encode()
-    f = Fernet(key)
+    f = get_fernet(settings.PRIVATE_KEY)
     return f.decrypt(data.encode()).decode()
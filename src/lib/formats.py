@@ -0,0 +1,93 @@
+import datetime
+
+import msgpack
+from fastapi.responses import Response
+
+from lib.encoding import default, dumps
+
+ROWS_JSON = "application/json"
+COLUMNS_JSON = "application/vnd.fastboard.columns+json"
+ROWS_MSGPACK = "application/msgpack"
+COLUMNS_MSGPACK = "application/vnd.fastboard.columns+msgpack"
+
+ALIASES = {
+    "application/x-msgpack": ROWS_MSGPACK,
+    "application/vnd.msgpack": ROWS_MSGPACK,
+}
+
+SUPPORTED_FORMATS = (ROWS_JSON, COLUMNS_JSON, ROWS_MSGPACK, COLUMNS_MSGPACK)
+
+
+def negotiate_format(accept: str = None) -> str:
+    """
+    Returns the response format with the highest quality in the Accept header
+    that the adapter can produce, or row-oriented JSON.
+    """
+    if not accept:
+        return ROWS_JSON
+    candidates = []
+    for position, media_range in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        media_type = ALIASES.get(media_type.lower(), media_type.lower())
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type in SUPPORTED_FORMATS and quality > 0:
+            candidates.append((-quality, position, media_type))
+    if not candidates:
+        return ROWS_JSON
+    return min(candidates)[2]
+
+
+def to_columns(rows: list):
+    """
+    Turns a list of documents into a dict of columns in a single pass. Fields
+    missing from a document are null in its position. Lists that aren't made of
+    documents are returned as they are.
+    """
+    if not all(isinstance(row, dict) for row in rows):
+        return rows
+    columns = {}
+    for index, row in enumerate(rows):
+        for key, value in row.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * index
+            column.append(value)
+        if len(row) != len(columns):
+            for column in columns.values():
+                if len(column) == index:
+                    column.append(None)
+    return columns
+
+
+def columnar(result):
+    # Only list bodies are converted, the rest of the envelope is kept
+    if not isinstance(result, dict) or not isinstance(result.get("body"), list):
+        return result
+    return {**result, "body": to_columns(result["body"])}
+
+
+def msgpack_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    return default(obj)
+
+
+def packb(obj) -> bytes:
+    return msgpack.packb(obj, default=msgpack_default)
+
+
+def render(result, media_type: str) -> Response:
+    if media_type in (COLUMNS_JSON, COLUMNS_MSGPACK):
+        result = columnar(result)
+    if media_type in (ROWS_MSGPACK, COLUMNS_MSGPACK):
+        content = packb(result)
+    else:
+        content = dumps(result)
+    return Response(content=content, media_type=media_type, headers={"Vary": "Accept"})
@@ -0,0 +1,198 @@
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import urlsplit, urlunsplit
+
+import orjson
+
+# Attributes every LogRecord has, anything else comes from `extra`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+}
+
+
+def truncate(value, max_length: int = 1024, max_items: int = 20, depth: int = 3):
+    """
+    Bounded copy of a value for a log record: long strings are cut, containers
+    keep their first `max_items` items and nesting stops at `depth`. The cost
+    depends on the limits, not on the size of the value.
+    """
+    if isinstance(value, str):
+        if len(value) <= max_length:
+            return value
+        return f"{value[:max_length]}... ({len(value) - max_length} more characters)"
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        if depth == 0:
+            return f"<dict of {len(value)} items>"
+        items = {
+            str(key): truncate(item, max_length, max_items, depth - 1)
+            for key, item in _first(value.items(), max_items)
+        }
+        if len(value) > max_items:
+            items["..."] = f"{len(value) - max_items} more items"
+        return items
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if depth == 0:
+            return f"<{type(value).__name__} of {len(value)} items>"
+        items = [
+            truncate(item, max_length, max_items, depth - 1)
+            for item in _first(value, max_items)
+        ]
+        if len(value) > max_items:
+            items.append(f"... {len(value) - max_items} more items")
+        return items
+    return truncate(repr(value), max_length, max_items, depth)
+
+
+def _first(iterable, count: int) -> list:
+    items = []
+    for item in iterable:
+        if len(items) == count:
+            break
+        items.append(item)
+    return items
+
+
+def redact(url: str) -> str:
+    # Keeps connection strings out of the logs without their password
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return "<invalid url>"
+    if parts.password is None:
+        return url
+    netloc = parts.netloc.replace(f":{parts.password}@", ":***@", 1)
+    return urlunsplit(parts._replace(netloc=netloc))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the `extra` fields of the record next to the
+    standard ones.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return orjson.dumps(entry, default=repr).decode()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps `rate` of the records below `always_level`. Records at or above it,
+    warnings and errors by default, are always kept.
+    """
+
+    def __init__(
+        self, rate: float, always_level: int = logging.WARNING, rng=random.random
+    ):
+        super().__init__()
+        self.rate = rate
+        self.always_level = always_level
+        self.rng = rng
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self.always_level or self.rng() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to a listener thread that formats and writes them, so logging
+    never waits for stdout. Arguments and extra fields are truncated first, and
+    records are dropped and counted when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_length: int, max_items: int):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.max_items = max_items
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        if not isinstance(record.msg, str):
+            record.msg = truncate(record.msg, self.max_length, self.max_items)
+        if record.args:
+            args = record.args if isinstance(record.args, tuple) else (record.args,)
+            record.args = tuple(
+                truncate(arg, self.max_length, self.max_items) for arg in args
+            )
+        record.msg = truncate(record.getMessage(), self.max_length)
+        record.args = None
+        for name, value in list(vars(record).items()):
+            if name not in RECORD_ATTRIBUTES and not name.startswith("_"):
+                setattr(record, name, truncate(value, self.max_length, self.max_items))
+        if record.exc_info:
+            # Tracebacks are formatted here, the frames can't cross threads safely
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "dropped": self.dropped}
+
+
+def setup_logging(
+    level: str = "INFO",
+    json_format: bool = True,
+    max_length: int = 1024,
+    max_items: int = 20,
+    sample_rate: float = 1.0,
+    queue_size: int = 10000,
+    stream=sys.stdout,
+) -> NonBlockingQueueHandler:
+    """
+    Routes the records of the root logger through a queue to a listener thread.
+    Returns the handler, stop it with shutdown_logging().
+    """
+    stream_handler = logging.StreamHandler(stream)
+    if json_format:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        formatter.converter = time.gmtime
+        stream_handler.setFormatter(formatter)
+
+    handler = NonBlockingQueueHandler(queue.Queue(queue_size), max_length, max_items)
+    if sample_rate < 1:
+        handler.addFilter(SamplingFilter(sample_rate))
+    handler.listener = QueueListener(handler.queue, stream_handler)
+    handler.listener.start()
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    return handler
+
+
+def shutdown_logging(handler: NonBlockingQueueHandler):
+    # Writes the records still in the queue before returning
+    logging.getLogger().removeHandler(handler)
+    handler.listener.stop()
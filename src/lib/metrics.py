@@ -0,0 +1,266 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+SIZE_BUCKETS = tuple(4**exponent * 256 for exponent in range(10))
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: tuple, **extra) -> dict:
+        return {**dict(zip(self.labelnames, key)), **extra}
+
+    def header(self) -> list:
+        return [
+            f"# HELP {self.name} {escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self, const_labels: dict = None) -> list:
+        const_labels = const_labels or {}
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self._labels(key, **const_labels))}"
+            f" {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def count(self, **labels) -> int:
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def render(self, const_labels: dict = None) -> list:
+        const_labels = const_labels or {}
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        lines = self.header()
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(
+                    self._labels(key, **const_labels, le=format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self._labels(key, **const_labels))
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Holds the metrics of the process and renders them in the Prometheus text
+    format. Collectors add gauges computed at scrape time from a stats() dict.
+    Constant labels are added to every sample, such as the worker process that
+    answered the scrape.
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.const_labels = {}
+        self._metrics = []
+        self._collectors = []
+
+    def set_labels(self, **labels):
+        self.const_labels.update(labels)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(self.prefix + name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(
+            Histogram(self.prefix + name, documentation, labelnames, buckets)
+        )
+
+    def add_collector(self, name: str, documentation: str, stats):
+        # Every numeric value of stats() becomes a gauge named <prefix><name>_<key>
+        self._collectors.append((self.prefix + name, documentation, stats))
+
+    def clear_collectors(self):
+        self._collectors.clear()
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(self.const_labels))
+        for name, documentation, stats in self._collectors:
+            try:
+                values = stats()
+            except Exception:
+                logger.exception("Error collecting %s metrics", name)
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric_name = f"{name}_{key}"
+                lines.append(f"# HELP {metric_name} {escape(documentation)}: {key}")
+                lines.append(f"# TYPE {metric_name} gauge")
+                labels = format_labels(self.const_labels)
+                lines.append(f"{metric_name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Metric):
+        self._metrics.append(metric)
+        return metric
+
+
+registry = Registry(prefix="adapter_")
+
+stage_duration = registry.histogram(
+    "stage_duration_seconds",
+    "Time spent in each stage of a query execution",
+    ("stage", "type", "method"),
+)
+upstream_responses = registry.counter(
+    "upstream_responses_total",
+    "Responses from REST APIs by status code, and Mongo calls by outcome",
+    ("type", "method", "status"),
+)
+cache_requests = registry.counter(
+    "cache_requests_total",
+    "Cache lookups by cache and result",
+    ("cache", "result"),
+)
+queries_in_flight = registry.gauge(
+    "queries_in_flight",
+    "Query executions currently running",
+    ("type",),
+)
+requests_cancelled = registry.counter(
+    "requests_cancelled_total",
+    "Requests cancelled before their response, by deadline or client disconnect",
+    ("reason",),
+)
+response_size = registry.histogram(
+    "response_size_bytes",
+    "Size of encoded query responses",
+    ("endpoint", "format"),
+    buckets=SIZE_BUCKETS,
+)
@@ -0,0 +1,194 @@
+import base64
+import binascii
+import datetime
+import re
+
+from bson import Binary, Decimal128, MaxKey, MinKey, ObjectId, Regex, Timestamp, json_util
+
+ASCENDING = "asc"
+DESCENDING = "desc"
+
+# $type aliases of the BSON types in the order MongoDB sorts them. Comparisons
+# like $gt only match values of the same type, so values of other types have to
+# be matched by their type
+TYPE_ORDER = (
+    ("minKey",),
+    ("null",),
+    ("number",),
+    ("string", "symbol"),
+    ("object",),
+    ("array",),
+    ("binData",),
+    ("objectId",),
+    ("bool",),
+    ("date",),
+    ("timestamp",),
+    ("regex",),
+    ("maxKey",),
+)
+NULL_RANK = 1
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(document: dict, sort_key: str, sort_order: str) -> str:
+    """
+    Opaque continuation token with the sort key value and _id of the last document
+    of a page. Extended JSON keeps BSON types like ObjectId and datetime intact.
+    """
+    data = {
+        "k": sort_key,
+        "o": sort_order,
+        "v": get_field(document, sort_key),
+        "i": document["_id"],
+    }
+    return base64.urlsafe_b64encode(json_util.dumps(data).encode()).decode()
+
+
+def decode_cursor(token: str, sort_key: str, sort_order: str) -> dict:
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid pagination cursor: {e}")
+    if not isinstance(data, dict) or not {"k", "o", "v", "i"} <= data.keys():
+        raise InvalidCursor("Invalid pagination cursor")
+    if data["k"] != sort_key or data["o"] != sort_order:
+        raise InvalidCursor("Pagination cursor was created for a different sort")
+    return data
+
+
+def get_field(document: dict, key: str):
+    value = document
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def type_rank(value) -> int:
+    # Position of the type of a sort key value in TYPE_ORDER, missing fields sort
+    # as null
+    if isinstance(value, MinKey):
+        return 0
+    if value is None:
+        return NULL_RANK
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float, Decimal128)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, (Binary, bytes)):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime.datetime):
+        return 9
+    if isinstance(value, Timestamp):
+        return 10
+    if isinstance(value, (Regex, re.Pattern)):
+        return 11
+    if isinstance(value, MaxKey):
+        return 12
+    # Arrays sort by one of their elements, which a cursor can't follow
+    raise InvalidCursor(f"Can't paginate on {type(value).__name__} sort key values")
+
+
+def keyset_filter(cursor: dict) -> dict:
+    operator = "$gt" if cursor["o"] == ASCENDING else "$lt"
+    if cursor["k"] == "_id":
+        return {"_id": {operator: cursor["i"]}}
+    key, value = cursor["k"], cursor["v"]
+    rank = type_rank(value)
+    # _id breaks ties between documents with the same sort key value, a null one
+    # also matches documents without the field
+    conditions = [{key: value, "_id": {operator: cursor["i"]}}]
+    if value is not None:
+        conditions.insert(0, {key: {operator: value}})
+    # Documents whose sort key has a type that sorts after this one
+    ranks = range(rank + 1, len(TYPE_ORDER)) if operator == "$gt" else range(rank)
+    aliases = [alias for r in ranks if r != NULL_RANK for alias in TYPE_ORDER[r]]
+    if aliases:
+        conditions.append({key: {"$type": aliases}})
+    if NULL_RANK in ranks:
+        conditions.append({key: None})
+    return {"$or": conditions}
+
+
+def sort_spec(sort_key: str, sort_order: str) -> dict:
+    direction = 1 if sort_order == ASCENDING else -1
+    if sort_key == "_id":
+        return {"_id": direction}
+    return {sort_key: direction, "_id": direction}
+
+
+def paginate_find(
+    filter_body: dict, page_size: int, sort_key: str, sort_order: str, token
+):
+    """
+    Returns the filter, sort and limit for a find. One extra document is requested
+    to know whether there is a next page without a count.
+    """
+    filter_body = filter_body or {}
+    if token is not None:
+        condition = keyset_filter(decode_cursor(token, sort_key, sort_order))
+        filter_body = {"$and": [filter_body, condition]} if filter_body else condition
+    return filter_body, list(sort_spec(sort_key, sort_order).items()), page_size + 1
+
+
+def keeps_sort_fields(stage: dict, sort_key: str) -> bool:
+    """
+    Whether a pipeline stage leaves documents, their _id and their sort key as
+    they are, so a $match on them can run before it.
+    """
+    (name, spec), *_ = stage.items()
+    fields = {"_id", sort_key.split(".")[0]}
+    if name in ("$match", "$sort"):
+        return True
+    if name in ("$addFields", "$set") and isinstance(spec, dict):
+        return not any(field.split(".")[0] in fields for field in spec)
+    if name == "$lookup" and isinstance(spec, dict):
+        return spec.get("as", "").split(".")[0] not in fields
+    return False
+
+
+def paginate_pipeline(
+    pipeline: list, page_size: int, sort_key: str, sort_order: str, token
+) -> list:
+    """
+    Adds the keyset condition, sort and limit of a page to a pipeline. The
+    condition goes before the trailing stages that don't change the sort key,
+    where MongoDB can use an index for it if it ends up first. Stages before it,
+    like a $group, still run in full for every page.
+    """
+    stages = list(pipeline or [])
+    if token is not None:
+        condition = keyset_filter(decode_cursor(token, sort_key, sort_order))
+        position = len(stages)
+        while position > 0 and keeps_sort_fields(stages[position - 1], sort_key):
+            position -= 1
+        stages.insert(position, {"$match": condition})
+    stages.append({"$sort": sort_spec(sort_key, sort_order)})
+    stages.append({"$limit": page_size + 1})
+    return stages
+
+
+def split_page(documents: list, page_size: int, sort_key: str, sort_order: str):
+    """
+    Returns the documents of the page and the token for the next one, or None when
+    this is the last page.
+    """
+    if len(documents) <= page_size:
+        return documents, None
+    page = documents[:page_size]
+    if "_id" not in page[-1]:
+        raise InvalidCursor("Paginated results must include the _id field")
+    if sort_key != "_id":
+        # Fails now for values a cursor can't follow, rather than on the next page
+        type_rank(get_field(page[-1], sort_key))
+    return page, encode_cursor(page[-1], sort_key, sort_order)
@@ -1,4 +1,8 @@
 import ast
+import copy
+import math
+import re
+from cachetools import LRUCache
 
 
 def replace_parameters_in_string(string, parameters, used_parameters):
@@ -29,3 +33,158 @@ def replace_parameters(obj, parameters, used_parameters=set()):
         return new_dict
     else:
         return obj
+
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(.*?)\}\}")
+IMMUTABLE_TYPES = (str, int, float, complex, bool, bytes, type(None))
+LITERAL_NAMES = ("True", "False", "None")
+
+
+def evaluate_literal(string):
+    """
+    Same result as trying `ast.literal_eval` and falling back to the string, but
+    skips the parser for plain words, which can never be a literal.
+    """
+    stripped = string.strip()
+    if stripped[:1].isalpha() and stripped not in LITERAL_NAMES:
+        # Only prefixed string literals such as b'...' or rb"..." start with a letter
+        if "'" not in stripped[:3] and '"' not in stripped[:3]:
+            return string
+    try:
+        return ast.literal_eval(string)
+    except (ValueError, SyntaxError):
+        return string
+
+
+class StringTemplate:
+    """
+    A string split into literal segments and placeholder slots. Strings without
+    placeholders are evaluated once at compile time.
+    """
+
+    def __init__(self, string: str):
+        parts = PLACEHOLDER_PATTERN.split(string)
+        self.literals = parts[0::2]
+        self.names = parts[1::2]
+        self.placeholders = set(self.names)
+        self.value = evaluate_literal(string) if not self.names else None
+        # A string that is exactly one placeholder takes the type of its value
+        self.is_single_slot = len(self.names) == 1 and self.literals == ["", ""]
+
+    def bind(self, parameters: dict):
+        if not self.names:
+            if isinstance(self.value, IMMUTABLE_TYPES):
+                return self.value
+            return copy.deepcopy(self.value)
+
+        if self.is_single_slot and self.names[0] in parameters:
+            value = parameters[self.names[0]]
+            if value is None or type(value) in (int, bool):
+                return value
+            if type(value) is float and math.isfinite(value):
+                return value
+            return evaluate_literal(str(value))
+
+        chunks = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            if name in parameters:
+                chunks.append(str(parameters[name]))
+            else:
+                chunks.append("{{" + name + "}}")
+            chunks.append(literal)
+        return evaluate_literal("".join(chunks))
+
+
+class ListTemplate:
+    def __init__(self, items: list):
+        self.items = [compile_node(item) for item in items]
+        self.placeholders = set().union(*(item.placeholders for item in self.items))
+
+    def bind(self, parameters: dict):
+        return [item.bind(parameters) for item in self.items]
+
+
+class DictTemplate:
+    def __init__(self, obj: dict):
+        self.items = [
+            (compile_node(key), compile_node(value)) for key, value in obj.items()
+        ]
+        self.placeholders = set().union(
+            *(key.placeholders | value.placeholders for key, value in self.items)
+        )
+
+    def bind(self, parameters: dict):
+        return {key.bind(parameters): value.bind(parameters) for key, value in self.items}
+
+
+class ConstantTemplate:
+    placeholders = frozenset()
+
+    def __init__(self, value):
+        self.value = value
+
+    def bind(self, _parameters: dict):
+        return self.value
+
+
+def compile_node(obj):
+    if isinstance(obj, str):
+        return StringTemplate(obj)
+    elif isinstance(obj, list):
+        return ListTemplate(obj)
+    elif isinstance(obj, dict):
+        return DictTemplate(obj)
+    else:
+        return ConstantTemplate(obj)
+
+
+class CompiledTemplate:
+    """
+    Reusable form of an object with {{parameter}} placeholders. Binding produces
+    the same result as `replace_parameters` in a single pass and reports which
+    parameters were used and which placeholders had no value.
+    """
+
+    def __init__(self, obj):
+        self.root = compile_node(obj)
+        self.placeholders = frozenset(self.root.placeholders)
+
+    def bind(self, parameters: dict):
+        used_parameters = self.placeholders & parameters.keys()
+        missing_parameters = self.placeholders - used_parameters
+        return self.root.bind(parameters), set(used_parameters), set(missing_parameters)
+
+
+def compile_template(obj) -> CompiledTemplate:
+    return CompiledTemplate(obj)
+
+
+class TemplateCache:
+    """
+    LRU cache of compiled templates. Lookups by the identity of the source objects
+    are the fast path for cached definitions; sources seen for the first time,
+    like the empty defaults of a definition or the bodies of a preview, are
+    looked up by content so they don't compile again. Identity entries keep a
+    reference to their sources, so an id can't be reused while the entry is alive.
+    """
+
+    def __init__(self, maxsize: int):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._by_content = LRUCache(maxsize=maxsize)
+
+    def get(self, *sources) -> CompiledTemplate:
+        key = tuple(id(source) for source in sources)
+        entry = self._entries.get(key)
+        if entry is not None and all(a is b for a, b in zip(entry[0], sources)):
+            return entry[1]
+        # repr tells apart values that serialize alike, like 1 and "1"
+        content = repr(sources)
+        template = self._by_content.get(content)
+        if template is None:
+            template = compile_template(list(sources))
+            self._by_content[content] = template
+        self._entries[key] = (sources, template)
+        return template
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "templates": len(self._by_content)}
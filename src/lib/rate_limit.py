@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+
+class TokenRateLimiter:
+    """
+    Token bucket for per-minute token quotas. Callers wait until the bucket has
+    enough tokens for their request; a request bigger than the whole quota waits
+    for a full bucket.
+    """
+
+    def __init__(self, tokens_per_minute: int, timer=time.monotonic):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.timer = timer
+        self.tokens = tokens_per_minute
+        self.updated_at = timer()
+        self._lock = None
+
+    def _refill(self):
+        now = self.timer()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self, tokens: int):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        tokens = min(tokens, self.capacity)
+        # The lock keeps waiters in order, so big requests aren't starved
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+    def penalize(self, seconds: float):
+        # Used when the upstream reports a rate limit: drain the bucket for a while
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
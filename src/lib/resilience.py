@@ -0,0 +1,301 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+import aiohttp
+from pymongo.errors import ConnectionFailure
+
+from lib.deadline import deadline_exceeded, has_time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Latencies needed before hedging on the observed p95
+MIN_HEDGE_SAMPLES = 20
+
+
+class CircuitOpen(Exception):
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Upstream {host} is unavailable, retry in {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Whether an error means the upstream couldn't be reached or didn't answer in
+    time, as opposed to an answer rejecting the request. Wrapped errors are
+    checked through their cause.
+    """
+    while error is not None:
+        if isinstance(
+            error, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionFailure)
+        ):
+            return True
+        error = error.__cause__
+    return False
+
+
+def upstream_host(url: str) -> str:
+    # Hosts of a URL or connection string, without credentials
+    try:
+        netloc = urlsplit(url).netloc
+    except ValueError:
+        return "unknown"
+    return netloc.rpartition("@")[2]
+
+
+class ResiliencePolicy:
+    """
+    How calls to an upstream are retried and hedged. Retries and hedges only
+    apply to idempotent calls; `hedge_delay` None hedges after the p95 latency
+    observed for the host.
+    """
+
+    OPTIONS = ("retries", "backoff", "max_backoff", "hedge", "hedge_delay")
+
+    def __init__(
+        self,
+        retries: int = 0,
+        backoff: float = 0.1,
+        max_backoff: float = 2.0,
+        hedge: bool = False,
+        hedge_delay: float = None,
+        hedge_min_delay: float = 0.01,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+
+    def override(self, options: dict) -> "ResiliencePolicy":
+        # Options of a connection, unknown keys are ignored
+        options = {
+            key: value for key, value in (options or {}).items() if key in self.OPTIONS
+        }
+        if not options:
+            return self
+        return ResiliencePolicy(
+            retries=int(options.get("retries", self.retries)),
+            backoff=float(options.get("backoff", self.backoff)),
+            max_backoff=float(options.get("max_backoff", self.max_backoff)),
+            hedge=bool(options.get("hedge", self.hedge)),
+            hedge_delay=options.get("hedge_delay", self.hedge_delay),
+            hedge_min_delay=self.hedge_min_delay,
+        )
+
+    def backoff_delay(self, attempt: int, rng=random.uniform) -> float:
+        # Exponential backoff with full jitter
+        return rng(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. Then a single probe call is let through, which
+    closes the circuit if it succeeds or opens it again if it fails.
+    """
+
+    def __init__(
+        self, failure_threshold: int, reset_timeout: float, timer=time.monotonic
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self.timer() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._probing = False
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self.timer() - self.opened_at))
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opens += 1
+            self.state = OPEN
+            self.opened_at = self.timer()
+
+    def release(self):
+        # A probe that ended without an outcome, like a cancelled call
+        self._probing = False
+
+
+class Upstream:
+    def __init__(self, host: str, breaker: CircuitBreaker, window: int):
+        self.host = host
+        self.breaker = breaker
+        self.latencies = deque(maxlen=window)
+
+    def hedge_delay(self, policy: ResiliencePolicy):
+        if policy.hedge_delay is not None:
+            return max(policy.hedge_min_delay, float(policy.hedge_delay))
+        if len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        p95 = ordered[int(0.95 * (len(ordered) - 1))]
+        return max(policy.hedge_min_delay, p95)
+
+
+class UpstreamRegistry:
+    """
+    Circuit breakers and recent latencies by upstream host, for up to `maxsize`
+    hosts. Calls go through call(), which applies the breaker of the host and the
+    retries and hedging of a policy.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        window: int = 200,
+        maxsize: int = 1024,
+        timer=time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.window = window
+        self.maxsize = maxsize
+        self.timer = timer
+        self._upstreams = OrderedDict()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejections = 0
+
+    def get(self, host: str) -> Upstream:
+        upstream = self._upstreams.get(host)
+        if upstream is None:
+            breaker = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout, self.timer
+            )
+            upstream = Upstream(host, breaker, self.window)
+            self._upstreams[host] = upstream
+            while len(self._upstreams) > self.maxsize:
+                self._upstreams.popitem(last=False)
+        self._upstreams.move_to_end(host)
+        return upstream
+
+    async def call(
+        self,
+        host: str,
+        fn,
+        policy: ResiliencePolicy,
+        idempotent: bool = True,
+        hedge: bool = True,
+        is_failure=None,
+    ):
+        """
+        Calls `fn`, a function returning a new awaitable on every call. Transient
+        errors and results for which `is_failure` is true count against the
+        breaker and are retried while the deadline leaves time for it, the last
+        result or error is returned as is.
+        """
+        upstream = self.get(host)
+        attempts = policy.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if not upstream.breaker.allow():
+                self.rejections += 1
+                raise CircuitOpen(host, upstream.breaker.retry_after())
+
+            started_at = time.perf_counter()
+            delay = None
+            if idempotent and hedge and policy.hedge:
+                delay = upstream.hedge_delay(policy)
+            try:
+                result = await (fn() if delay is None else self._hedged(fn, delay))
+            except asyncio.CancelledError:
+                upstream.breaker.release()
+                raise
+            except Exception as e:
+                if deadline_exceeded(e):
+                    # The request ran out of time, which says nothing of the upstream
+                    upstream.breaker.release()
+                    raise
+                if not is_transient(e):
+                    # The upstream answered, the request itself was wrong
+                    upstream.breaker.record_success()
+                    raise
+                upstream.breaker.record_failure()
+                delay = policy.backoff_delay(attempt)
+                if attempt == attempts - 1 or not has_time(delay):
+                    raise
+            else:
+                if is_failure is None or not is_failure(result):
+                    upstream.breaker.record_success()
+                    upstream.latencies.append(time.perf_counter() - started_at)
+                    return result
+                upstream.breaker.record_failure()
+                delay = policy.backoff_delay(attempt)
+                if attempt == attempts - 1 or not has_time(delay):
+                    return result
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def _hedged(self, fn, delay: float):
+        # A second call starts if the first takes longer than `delay`, the first
+        # one to succeed wins and the other is cancelled
+        tasks = [asyncio.ensure_future(fn())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            self.hedges += 1
+            tasks.append(asyncio.ensure_future(fn()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        states = [upstream.breaker.state for upstream in self._upstreams.values()]
+        return {
+            "upstreams": len(states),
+            "open_circuits": sum(state != CLOSED for state in states),
+            "circuit_opens": sum(u.breaker.opens for u in self._upstreams.values()),
+            "rejections": self.rejections,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
@@ -0,0 +1,104 @@
+import json
+import pickle
+import time
+import zlib
+from collections import OrderedDict
+
+
+def result_key(query_id: str, parameters: dict) -> str:
+    # Parameters are serialized with sorted keys so equal bindings share an entry
+    canonical = json.dumps(parameters, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{query_id}:{canonical}"
+
+
+class ResultCache:
+    """
+    Byte-bounded cache of query results with a TTL per entry. Results are stored
+    pickled, so callers always get their own copy, and compressed with zlib once
+    they are larger than `compress_threshold` bytes. The least recently used
+    entries are evicted when the cache goes over `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        compress_threshold: int = 16384,
+        compress_level: int = 1,
+        timer=time.monotonic,
+    ):
+        self.max_bytes = max_bytes
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.timer = timer
+        # key -> (payload, compressed, expires_at, tags)
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries and self._entries[key][2] > self.timer()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[2] <= self.timer():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        payload, compressed, _, _ = entry
+        if compressed:
+            payload = zlib.decompress(payload)
+        return pickle.loads(payload)
+
+    def set(self, key, value, ttl: float, tags=()):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        compressed = len(payload) > self.compress_threshold
+        if compressed:
+            payload = zlib.compress(payload, self.compress_level)
+        if len(payload) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (payload, compressed, self.timer() + ttl, frozenset(tags))
+        self.size += len(payload)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def bypass(self):
+        self.bypasses += 1
+
+    def invalidate(self, tag) -> int:
+        keys = [key for key, entry in self._entries.items() if tag in entry[3]]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else None,
+        }
+
+    def _remove(self, key):
+        payload = self._entries.pop(key)[0]
+        self.size -= len(payload)
@@ -0,0 +1,54 @@
+import asyncio
+
+
+class Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one task. Every waiter gets
+    the result or the exception of the shared call, and the call is cancelled
+    once all of its waiters are gone. Results are shared, not copied.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key, fn):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            # A cancelled waiter must not cancel the call the others are waiting on
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self._forget(key, flight)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
+
+    def _forget(self, key, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
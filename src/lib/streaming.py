@@ -0,0 +1,57 @@
+from lib.encoding import dumps
+
+NDJSON = "ndjson"
+JSON = "json"
+# REST API bodies sent to the client as they come, with the API's status and headers
+RAW = "raw"
+
+MEDIA_TYPES = {
+    NDJSON: "application/x-ndjson",
+    JSON: "application/json",
+}
+
+
+def get_stream_format(accept: str = None, stream: str = None):
+    """
+    Returns the streaming format requested through the `stream` query flag or the
+    Accept header, or None when the client expects a regular response.
+    """
+    if stream is not None:
+        stream = stream.lower()
+        if stream in ("ndjson", "jsonl"):
+            return NDJSON
+        if stream in ("json", "true", "1"):
+            return JSON
+        if stream in ("raw", "passthrough"):
+            return RAW
+        return None
+    if accept and any(
+        media_type.split(";")[0].strip() in ("application/x-ndjson", "application/jsonl")
+        for media_type in accept.split(",")
+    ):
+        return NDJSON
+    return None
+
+
+async def encode_ndjson(batches):
+    async for batch in batches:
+        yield b"".join(dumps(item) + b"\n" for item in batch)
+
+
+async def encode_json_array(batches):
+    # Keeps the {"body": [...]} envelope of regular responses
+    yield b'{"body":['
+    first = True
+    async for batch in batches:
+        if not batch:
+            continue
+        chunk = b",".join(dumps(item) for item in batch)
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]}"
+
+
+def encode_stream(batches, stream_format: str):
+    if stream_format == NDJSON:
+        return encode_ndjson(batches)
+    return encode_json_array(batches)
@@ -0,0 +1,16 @@
+import os
+
+
+def worker_count(configured: int) -> int:
+    # 0 means one worker per CPU
+    if configured > 0:
+        return configured
+    return os.cpu_count() or 1
+
+
+def per_worker(total: int, workers: int, minimum: int = 1) -> int:
+    """
+    Share of an instance-wide limit for one worker process, so pools and caches
+    stay within the limit however many workers are running.
+    """
+    return max(minimum, total // workers)
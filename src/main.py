@@ -1,16 +1,197 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 from configs.settings import settings
-from routers.adapter import AdapterRouter
+from connections.api_request import HttpClient
+from connections.mongo_connection import (
+    executor as mongo_executor,
+    clients as mongo_clients,
+    run_health_checks,
+)
+from lib.definition_cache import DefinitionCache
+from lib.embedding_cache import EmbeddingCache
+from lib.result_cache import ResultCache
+from lib.single_flight import SingleFlight
+from lib.connection_registry import ConnectionRegistry, load_recent, save_recent
+from lib.resilience import UpstreamRegistry
+from lib.encryption import decrypt
+from services.jobs import JobManager
+from routers.adapter import AdapterRouter, create_query_service
+from routers.metrics import MetricsRouter
+from lib.metrics import registry as metrics
+from lib.log import setup_logging, shutdown_logging
+from lib.workers import worker_count, per_worker
+from lib.compression import CompressionMiddleware, available_codecs
+from lib.deadline import DeadlineMiddleware
 from fastapi.exceptions import RequestValidationError
 from errors import CustomException, handle_validation_error, handle_custom_exception
 
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+async def prewarm_connections(app: FastAPI):
+    # Startup waits for the prewarm, so the worker only reports ready afterwards
+    connection_ids = load_recent(settings.CONNECTION_PREWARM_FILE)
+    connection_ids = connection_ids[: settings.CONNECTION_PREWARM_COUNT]
+    if not connection_ids:
+        return
+    service = create_query_service(app.state)
+    try:
+        ready = await asyncio.wait_for(
+            service.prewarm_connections(connection_ids),
+            settings.CONNECTION_PREWARM_TIMEOUT,
+        )
+        logger.info("Prewarmed %d of %d connections", ready, len(connection_ids))
+    except asyncio.TimeoutError:
+        logger.warning("Connection prewarm timed out")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_handler = setup_logging(
+        level=settings.LOG_LEVEL,
+        json_format=settings.LOG_JSON,
+        max_length=settings.LOG_MAX_FIELD_LENGTH,
+        max_items=settings.LOG_MAX_ITEMS,
+        sample_rate=settings.LOG_SAMPLE_RATE,
+        queue_size=settings.LOG_QUEUE_SIZE,
+    )
+    workers = worker_count(settings.WORKERS)
+    mongo_executor.start()
+    if workers > 1:
+        # Every worker keeps its own metrics, the label tells their series apart
+        metrics.set_labels(worker=os.getpid())
+    app.state.http_client = HttpClient(
+        limit=per_worker(settings.HTTP_POOL_SIZE, workers),
+        limit_per_host=per_worker(settings.HTTP_POOL_SIZE_PER_HOST, workers),
+        dns_cache_ttl=settings.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+        connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+        read_timeout=settings.HTTP_READ_TIMEOUT,
+        total_timeout=settings.HTTP_TOTAL_TIMEOUT,
+    )
+    await app.state.http_client.start()
+    app.state.definition_cache = DefinitionCache(
+        ttl=settings.DEFINITION_CACHE_TTL,
+        stale_ttl=settings.DEFINITION_CACHE_STALE_TTL,
+        maxsize=settings.DEFINITION_CACHE_MAXSIZE,
+        should_cache=lambda response: response["status_code"] == 200,
+    )
+    app.state.embedding_cache = EmbeddingCache(
+        maxsize=per_worker(settings.EMBEDDING_CACHE_MAXSIZE, workers),
+        path=settings.EMBEDDING_CACHE_PATH,
+        disk_maxsize=settings.EMBEDDING_CACHE_DISK_MAXSIZE,
+    )
+    app.state.result_cache = ResultCache(
+        max_bytes=per_worker(settings.RESULT_CACHE_MAX_BYTES, workers),
+        compress_threshold=settings.RESULT_CACHE_COMPRESS_THRESHOLD,
+    )
+    app.state.single_flight = SingleFlight()
+    app.state.connection_registry = ConnectionRegistry(
+        ttl=settings.CONNECTION_REGISTRY_TTL,
+        maxsize=settings.CONNECTION_REGISTRY_MAXSIZE,
+        decrypt=decrypt,
+    )
+    app.state.upstreams = UpstreamRegistry(
+        failure_threshold=settings.UPSTREAM_BREAKER_FAILURES,
+        reset_timeout=settings.UPSTREAM_BREAKER_RESET_TIMEOUT,
+        window=settings.UPSTREAM_LATENCY_WINDOW,
+        maxsize=settings.UPSTREAM_MAXSIZE,
+    )
+    app.state.jobs = JobManager(
+        concurrency=settings.EMBEDDINGS_JOBS_CONCURRENCY,
+        max_finished=settings.EMBEDDINGS_JOBS_MAX_FINISHED,
+    )
+    metrics.add_collector("result_cache", "Result cache", app.state.result_cache.stats)
+    metrics.add_collector(
+        "embedding_cache", "Query embedding cache", app.state.embedding_cache.stats
+    )
+    metrics.add_collector(
+        "single_flight", "Coalesced executions", app.state.single_flight.stats
+    )
+    metrics.add_collector(
+        "connections", "Connection registry", app.state.connection_registry.stats
+    )
+    metrics.add_collector("mongo_clients", "Mongo client manager", mongo_clients.stats)
+    metrics.add_collector("mongo_executor", "Mongo thread pool", mongo_executor.stats)
+    metrics.add_collector("logging", "Log queue", log_handler.stats)
+    metrics.add_collector(
+        "upstreams", "Upstream circuit breakers", app.state.upstreams.stats
+    )
+    health_checks = asyncio.create_task(
+        run_health_checks(settings.MONGO_HEALTH_CHECK_INTERVAL)
+    )
+    if settings.CONNECTION_PREWARM_FILE:
+        await prewarm_connections(app)
+    yield
+    health_checks.cancel()
+    metrics.clear_collectors()
+    await app.state.jobs.shutdown()
+    if settings.CONNECTION_PREWARM_FILE:
+        save_recent(
+            settings.CONNECTION_PREWARM_FILE,
+            app.state.connection_registry.recent(settings.CONNECTION_PREWARM_COUNT),
+        )
+    app.state.definition_cache.clear()
+    app.state.embedding_cache.close()
+    app.state.result_cache.clear()
+    await app.state.http_client.close()
+    await mongo_executor.shutdown()
+    mongo_clients.close()
+    shutdown_logging(log_handler)
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(AdapterRouter)
+app.include_router(MetricsRouter)
+app.add_middleware(
+    DeadlineMiddleware,
+    default=settings.REQUEST_TIMEOUT,
+    maximum=settings.REQUEST_MAX_TIMEOUT,
+)
+# The last middleware added runs first. Compression holds the response start
+# back until the first chunk of the body, so deadlines are tracked inside it to
+# see the start as soon as the app sends it
+app.add_middleware(
+    CompressionMiddleware,
+    codecs=available_codecs(
+        [name.strip() for name in settings.COMPRESSION_ENCODINGS.split(",")],
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+        zstd_level=settings.COMPRESSION_ZSTD_LEVEL,
+    ),
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    offload_size=settings.COMPRESSION_OFFLOAD_SIZE,
+)
 app.add_exception_handler(RequestValidationError, handle_validation_error)
 app.add_exception_handler(CustomException, handle_custom_exception)
 
 
+def serve():
+    """
+    Runs the server with WORKERS processes. With more than one, uvicorn
+    supervises them: SIGHUP replaces the workers and SIGTERM drains in-flight
+    requests for up to SERVER_GRACEFUL_SHUTDOWN_TIMEOUT seconds before stopping.
+    """
+    workers = worker_count(settings.WORKERS)
+    uvicorn.run(
+        # Workers import the app themselves, so it's passed by name
+        "main:app" if workers > 1 else app,
+        host=settings.APP_HOST,
+        port=settings.APP_PORT,
+        workers=workers,
+        loop=settings.SERVER_LOOP,
+        http=settings.SERVER_HTTP,
+        backlog=settings.SERVER_BACKLOG,
+        timeout_keep_alive=settings.SERVER_KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_SHUTDOWN_TIMEOUT,
+        limit_concurrency=settings.SERVER_LIMIT_CONCURRENCY,
+        limit_max_requests=settings.SERVER_MAX_REQUESTS,
+    )
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host=settings.APP_HOST, port=settings.APP_PORT)
+    serve()
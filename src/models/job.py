@@ -0,0 +1,96 @@
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class EmbeddingJob:
+    def __init__(
+        self,
+        query_id: str,
+        index_field: str,
+        checkpoint: dict = None,
+        incremental: bool = False,
+    ):
+        self.id = uuid.uuid4().hex
+        self.query_id = query_id
+        self.index_field = index_field
+        self.incremental = incremental
+        self.status = QUEUED
+        self.error = None
+        self.total = None
+        # The checkpoint holds the pagination cursor after the last written page
+        checkpoint = checkpoint or {}
+        self.cursor = checkpoint.get("cursor")
+        self.checkpoint_processed = checkpoint.get("processed", 0)
+        self.checkpoint_skipped = checkpoint.get("skipped", 0)
+        self.processed = self.checkpoint_processed
+        self.skipped = self.checkpoint_skipped
+        self.resumed_from = self.processed
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+
+    def reset(self):
+        # Resuming keeps the checkpoint and starts a new run from it
+        self.status = QUEUED
+        self.error = None
+        # Work done after the checkpoint is redone, so it isn't counted twice
+        self.processed = self.checkpoint_processed
+        self.skipped = self.checkpoint_skipped
+        self.resumed_from = self.processed
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (COMPLETED, FAILED, CANCELLED)
+
+    def save_checkpoint(self, cursor: str, processed: int, skipped: int):
+        self.cursor = cursor
+        self.checkpoint_processed = processed
+        self.checkpoint_skipped = skipped
+        self.processed = processed
+        self.skipped = skipped
+
+    def checkpoint(self) -> dict:
+        return {
+            "job_id": self.id,
+            "cursor": self.cursor,
+            "processed": self.checkpoint_processed,
+            "skipped": self.checkpoint_skipped,
+        }
+
+    def to_dict(self) -> dict:
+        elapsed = None
+        throughput = None
+        eta = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            done_in_run = self.processed - self.resumed_from
+            if elapsed > 0:
+                throughput = done_in_run / elapsed
+            if throughput and self.total is not None and not self.finished:
+                eta = max(self.total - self.processed, 0) / throughput
+        return {
+            "id": self.id,
+            "query_id": self.query_id,
+            "index_field": self.index_field,
+            "incremental": self.incremental,
+            "status": self.status,
+            "error": self.error,
+            "total": self.total,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": elapsed,
+            "documents_per_second": throughput,
+            "eta_seconds": eta,
+        }
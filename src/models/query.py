@@ -4,6 +4,12 @@ class Query:
         self.credentials = credentials
         self.variables = variables
         self.parameters = parameters
+        # Set for saved queries, previews have no id and aren't cached
+        self.id = None
+        self.connection_id = None
+        self.cache_ttl = None
+        # Seconds the query may run, on top of the deadline of the request
+        self.timeout = None
 
 
 class ApiQuery(Query):
@@ -36,12 +42,14 @@ class MongoQuery(Query):
         collection: str,
         filter_body: dict,
         update_body: dict,
+        pagination: dict = None,
     ):
         super().__init__(type, credentials, variables, parameters)
         self.method = method
         self.collection = collection
         self.filter_body = filter_body
         self.update_body = update_body
+        self.pagination = pagination
 
 
 class VectorSearchQuery(Query):
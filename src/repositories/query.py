@@ -1,48 +1,235 @@
-from connections.api_request import make_request
-from connections.mongo_connection import execute_query, execute_vector_search, bulk_update
+from connections.api_request import HttpClient, UpstreamStream
+from lib.definition_cache import DefinitionCache
+from lib.embedding_cache import EmbeddingCache
+from lib.result_cache import ResultCache, result_key
+from lib.connection_registry import ConnectionRegistry, ResolvedConnection
+from lib.encryption import decrypt
+from connections.mongo_connection import (
+    execute_query,
+    execute_vector_search,
+    bulk_update,
+    execute_paginated_query,
+    open_cursor,
+    warm_client,
+    get_embeddings,
+)
+from lib.pagination import InvalidCursor
 from models.query import Query, ApiQuery, MongoQuery, VectorSearchQuery
-from lib.parameters import replace_parameters
+from lib.parameters import TemplateCache
 from errors import (
     CustomException,
     ERR_UNSUPPORTED_QUERY_TYPE,
     ERR_BAD_PARAMETERS,
     ERR_INTERNAL,
+    ERR_UPSTREAM_UNAVAILABLE,
 )
-import re
 from configs.settings import settings
+from lib.metrics import stage_duration, upstream_responses, cache_requests
 from lib.object_id import replace_objectid_strings
+from lib.deadline import deadline_exceeded, deadline_error
+from lib.resilience import (
+    CircuitOpen,
+    ResiliencePolicy,
+    UpstreamRegistry,
+    is_transient,
+    upstream_host,
+)
+
+templates = TemplateCache(maxsize=settings.TEMPLATE_CACHE_MAXSIZE)
+
+default_policy = ResiliencePolicy(
+    retries=settings.UPSTREAM_RETRIES,
+    backoff=settings.UPSTREAM_RETRY_BACKOFF,
+    max_backoff=settings.UPSTREAM_RETRY_MAX_BACKOFF,
+    hedge=settings.UPSTREAM_HEDGE,
+    hedge_delay=settings.UPSTREAM_HEDGE_DELAY,
+    hedge_min_delay=settings.UPSTREAM_HEDGE_MIN_DELAY,
+)
+
+CURSOR_METHODS = ("find", "aggregate")
+READ_ONLY_METHODS = ("find", "findOne", "aggregate", "count", "distinct")
+# Aggregation stages that write their results to a collection
+WRITE_STAGES = ("$out", "$merge")
+
+
+def writes_output(pipeline) -> bool:
+    # Pipelines saved as text are searched for the stage names
+    if isinstance(pipeline, str):
+        return any(stage in pipeline for stage in WRITE_STAGES)
+    if isinstance(pipeline, dict):
+        pipeline = [pipeline]
+    return any(
+        isinstance(stage, dict) and any(name in WRITE_STAGES for name in stage)
+        for stage in pipeline
+    )
+
+
+def is_read_only(query: Query) -> bool:
+    if query.type == "REST":
+        return query.method.upper() == "GET"
+    if query.type == "MONGO":
+        if query.method == "aggregate" and writes_output(query.filter_body):
+            return False
+        return query.method in READ_ONLY_METHODS
+    return query.type == "VECTOR_SEARCH"
+
+
+def is_failed_response(response) -> bool:
+    # REST answers worth retrying, the API is overloaded or failing
+    status = response["status_code"]
+    return status >= 500 or status == 429
+
+
+def query_key(name: str, query: Query) -> str:
+    # Identifies the results of a query from its name and bound parameters
+    return result_key(
+        name,
+        {
+            "parameters": {**query.variables, **query.parameters},
+            "pagination": getattr(query, "pagination", None),
+        },
+    )
 
 
 class QueryRepository:
     url: str
     version: str
+    http_client: HttpClient
+    definition_cache: DefinitionCache
+    embedding_cache: EmbeddingCache
+    result_cache: ResultCache
+    connection_registry: ConnectionRegistry
+    upstreams: UpstreamRegistry
 
-    def __init__(self, url: str, version: str):
+    def __init__(
+        self,
+        url: str,
+        version: str,
+        http_client: HttpClient,
+        definition_cache: DefinitionCache = None,
+        embedding_cache: EmbeddingCache = None,
+        result_cache: ResultCache = None,
+        connection_registry: ConnectionRegistry = None,
+        upstreams: UpstreamRegistry = None,
+    ):
         self.url = url
         self.version = version
+        self.http_client = http_client
+        self.definition_cache = definition_cache
+        self.embedding_cache = embedding_cache
+        self.result_cache = result_cache
+        self.connection_registry = connection_registry
+        self.upstreams = upstreams
 
-    async def get_by_id(self, query_id: str):
+    async def get_by_id(self, query_id: str, cached: bool = True):
         url = self.url + f"/v{self.version}/queries/{query_id}"
-        query_response = await make_request(
-            url=url, headers={"api_key": settings.API_KEY}, method="GET"
-        )
-        return query_response
+
+        async def fetch_query():
+            return await self.http_client.make_request(
+                url=url, headers={"api_key": settings.API_KEY}, method="GET"
+            )
+
+        if self.definition_cache is None or not cached:
+            return await fetch_query()
+        return await self.definition_cache.get(f"query:{query_id}", fetch_query)
 
     async def get_connection_by_id(self, connection_id: str):
         url = self.url + f"/v{self.version}/connections/{connection_id}"
-        connection_response = await make_request(
-            url=url, headers={"api_key": settings.API_KEY}, method="GET"
+
+        async def fetch_connection():
+            return await self.http_client.make_request(
+                url=url, headers={"api_key": settings.API_KEY}, method="GET"
+            )
+
+        if self.definition_cache is None:
+            return await fetch_connection()
+        return await self.definition_cache.get(
+            f"connection:{connection_id}", fetch_connection
         )
-        return connection_response
 
     async def update_query(self, query_id: str, data: dict):
         url = self.url + f"/v{self.version}/queries/{query_id}"
-        query_response = await make_request(
+        query_response = await self.http_client.make_request(
             url=url, headers={"api_key": settings.API_KEY}, method="PATCH", body=data
         )
+        self.invalidate_query(query_id)
         return query_response
 
+    def invalidate_query(self, query_id: str) -> bool:
+        invalidated_results = self.invalidate_results(f"query:{query_id}")
+        if self.definition_cache is None:
+            return invalidated_results
+        invalidated = self.definition_cache.invalidate(f"query:{query_id}")
+        return invalidated or invalidated_results
+
+    def resolve_connection(self, connection: dict) -> ResolvedConnection:
+        if self.connection_registry is None:
+            return ResolvedConnection(connection, 0, decrypt)
+        return self.connection_registry.resolve(connection)
+
+    async def warm_connection(self, connection: ResolvedConnection):
+        if connection.type == "MONGO":
+            await warm_client(connection.credentials["main_url"])
+
+    def invalidate_connection(self, connection_id: str) -> bool:
+        invalidated_results = self.invalidate_results(f"connection:{connection_id}")
+        invalidated_resolved = (
+            self.connection_registry is not None
+            and self.connection_registry.invalidate(connection_id)
+        )
+        if self.definition_cache is None:
+            return invalidated_results or invalidated_resolved
+
+        # Query definitions embed their connection, so they are dropped as well
+        def uses_connection(key, value):
+            connection = value["body"].get("connection", {})
+            return key.startswith("query:") and connection_id in (
+                connection.get("id"),
+                connection.get("_id"),
+            )
+
+        invalidated_queries = self.definition_cache.invalidate_where(uses_connection)
+        invalidated = self.definition_cache.invalidate(f"connection:{connection_id}")
+        return (
+            invalidated
+            or invalidated_queries > 0
+            or invalidated_results
+            or invalidated_resolved
+        )
+
+    def invalidate_results(self, tag: str) -> bool:
+        if self.result_cache is None:
+            return False
+        return self.result_cache.invalidate(tag) > 0
+
     async def execute_query(self, query: Query):
+        # Only saved queries with a cache_ttl in their metadata are cached
+        if self.result_cache is None or query.id is None or not query.cache_ttl:
+            return await self._execute_query(query)
+        if not is_read_only(query):
+            self.result_cache.bypass()
+            cache_requests.inc(cache="result", result="bypass")
+            return await self._execute_query(query)
+
+        key = query_key(query.id, query)
+        response = self.result_cache.get(key)
+        if response is not None:
+            cache_requests.inc(cache="result", result="hit")
+            return response
+        cache_requests.inc(cache="result", result="miss")
+
+        response = await self._execute_query(query)
+        # Failed upstream calls are not cached
+        if query.type != "REST" or response["status_code"] < 400:
+            self.result_cache.set(
+                key,
+                response,
+                ttl=query.cache_ttl,
+                tags=(f"query:{query.id}", f"connection:{query.connection_id}"),
+            )
+        return response
+
+    async def _execute_query(self, query: Query):
         if query.type == "REST":
             return await self.execute_api_query(query)
         if query.type == "MONGO":
@@ -57,28 +244,11 @@ class QueryRepository:
             description=f"Unsupported query type: {query.type}",
         )
 
-    async def execute_api_query(self, query: ApiQuery):
+    def _bind_parameters(self, query: Query, *sources):
         parameters = {**query.variables, **query.parameters}
-        used_parameters = set()
-
-        # Fill header parameters
-        headers = {}
-        for key, value in query.headers.items():
-            replaced_key = replace_parameters(key, parameters, used_parameters)
-            replaced_value = replace_parameters(value, parameters, used_parameters)
-            headers[replaced_key] = replaced_value
-
-        # Fill body parameters
-        body = {}
-        for key, value in query.body.items():
-            replaced_key = replace_parameters(key, parameters, used_parameters)
-            replaced_value = replace_parameters(value, parameters, used_parameters)
-            body[replaced_key] = replaced_value
-
-        # Fill path parameters
-        path = replace_parameters(query.path, parameters, used_parameters)
-
-        url = query.credentials["main_url"] + path
+        with stage_duration.time(stage="bind", type=query.type, method=query.method):
+            template = templates.get(*sources)
+            values, used_parameters, missing_parameters = template.bind(parameters)
 
         # Validate that all parameters were used
         unused_parameters = set(parameters.keys()) - used_parameters
@@ -92,19 +262,6 @@ class QueryRepository:
             )
 
         # Validate that all placeholders were replaced
-        all_placeholders = re.findall(r"\{\{(.*?)\}\}", path)
-        all_placeholders += [
-            match
-            for k, v in headers.items()
-            for match in re.findall(r"\{\{(.*?)\}\}", k + v)
-        ]
-        all_placeholders += [
-            match
-            for k, v in body.items()
-            for match in re.findall(r"\{\{(.*?)\}\}", k + str(v))
-        ]
-
-        missing_parameters = set(all_placeholders) - set(parameters.keys())
         if "token" in missing_parameters:
             missing_parameters.remove("token")
         if missing_parameters:
@@ -114,56 +271,125 @@ class QueryRepository:
                 description=f"Missing parameters in input: {missing_parameters}",
             )
 
-        response = await make_request(
-            url=url, headers=headers, method=query.method, body=body
+        return values
+
+    async def execute_api_query(self, query: ApiQuery):
+        path, headers, body = self._bind_parameters(
+            query, query.path, query.headers, query.body
         )
-        return response
+        url = query.credentials["main_url"] + path
 
-    async def execute_mongo_query(self, query: MongoQuery):
-        parameters = {**query.variables, **query.parameters}
-        used_parameters = set()
+        return await self._upstream(
+            query,
+            lambda: self.http_client.make_request(
+                url=url, headers=headers, method=query.method, body=body
+            ),
+        )
 
-        # Fill filter parameters
-        filter_body = replace_parameters(query.filter_body, parameters, used_parameters)
+    async def stream_api_query(
+        self, query: ApiQuery, accept_encoding: str = None, chunk_size: int = 65536
+    ) -> UpstreamStream:
+        # Passthrough responses skip the result cache, their body is never decoded
+        path, headers, body = self._bind_parameters(
+            query, query.path, query.headers, query.body
+        )
+        url = query.credentials["main_url"] + path
 
-        # Fill update parameters
-        update_body = replace_parameters(query.update_body, parameters, used_parameters)
+        return await self._upstream(
+            query,
+            lambda: self.http_client.stream_request(
+                url=url,
+                headers=headers,
+                method=query.method,
+                body=body,
+                accept_encoding=accept_encoding,
+                chunk_size=chunk_size,
+            ),
+            stream=True,
+        )
 
-        # Validate that all parameters were used
-        unused_parameters = set(parameters.keys()) - used_parameters
-        if "token" in unused_parameters:
-            unused_parameters.remove("token")
-        if unused_parameters:
+    async def _upstream(self, query: Query, call, stream: bool = False):
+        # Times the call to the REST API or Mongo and counts its outcome
+        labels = {"type": query.type, "method": query.method}
+        try:
+            with stage_duration.time(stage="upstream", **labels):
+                response = await self._resilient(query, call, stream)
+        except Exception:
+            upstream_responses.inc(status="error", **labels)
+            raise
+        if query.type != "REST":
+            status = "ok"
+        elif isinstance(response, UpstreamStream):
+            # Timed until the headers arrive, the body is still to come
+            status = response.status_code
+        else:
+            status = response["status_code"]
+        upstream_responses.inc(status=status, **labels)
+        return response
+
+    def resilience_policy(self, query: Query) -> ResiliencePolicy:
+        return default_policy.override(query.credentials.get("resilience"))
+
+    async def _resilient(self, query: Query, call, stream: bool):
+        """
+        Calls the upstream through the circuit breaker of its host. Read-only calls
+        are retried and hedged as the connection's policy says, streams are only
+        retried until they start since their responses can't be discarded. Calls
+        cut short by the request deadline are answered with a 504.
+        """
+        host = upstream_host(query.credentials["main_url"])
+        try:
+            if self.upstreams is None:
+                return await call()
+            return await self.upstreams.call(
+                host,
+                call,
+                self.resilience_policy(query),
+                idempotent=is_read_only(query),
+                hedge=not stream,
+                is_failure=(
+                    is_failed_response if query.type == "REST" and not stream else None
+                ),
+            )
+        except CircuitOpen as e:
             raise CustomException(
-                status_code=400,
-                error_code=ERR_BAD_PARAMETERS,
-                description=f"Unused parameters in input: {unused_parameters}",
+                status_code=503,
+                error_code=ERR_UPSTREAM_UNAVAILABLE,
+                description=str(e),
             )
+        except Exception as e:
+            if deadline_exceeded(e):
+                raise deadline_error(f"Query to {host} exceeded its deadline") from e
+            if self.upstreams is None or not is_transient(e):
+                raise
+            raise CustomException(
+                status_code=503,
+                error_code=ERR_UPSTREAM_UNAVAILABLE,
+                description=f"Upstream {host} is unavailable: {e}",
+            ) from e
 
-        # Validate that all placeholders were replaced
-        all_placeholders = re.findall(
-            r"\{\{(.*?)\}\}", str(filter_body) + str(update_body)
+    async def execute_mongo_query(self, query: MongoQuery):
+        filter_body, update_body = self._bind_parameters(
+            query, query.filter_body, query.update_body
         )
-        missing_parameters = set(all_placeholders) - set(parameters.keys())
-        if "token" in missing_parameters:
-            missing_parameters.remove("token")
-        if missing_parameters:
-            raise CustomException(
-                status_code=400,
-                error_code=ERR_BAD_PARAMETERS,
-                description=f"Missing parameters in input: {missing_parameters}",
-            )
+        if query.pagination is not None:
+            return await self.execute_paginated_mongo_query(query, filter_body)
 
         try:
-            response = await execute_query(
-                connection_string=query.credentials["main_url"],
-                collection=query.collection,
-                method=query.method,
-                filter_body=replace_objectid_strings(filter_body),
-                update_body=replace_objectid_strings(update_body),
+            response = await self._upstream(
+                query,
+                lambda: execute_query(
+                    connection_string=query.credentials["main_url"],
+                    collection=query.collection,
+                    method=query.method,
+                    filter_body=replace_objectid_strings(filter_body),
+                    update_body=replace_objectid_strings(update_body),
+                ),
             )
 
             return response
+        except CustomException:
+            raise
         except Exception as e:
             raise CustomException(
                 status_code=500,
@@ -171,47 +397,106 @@ class QueryRepository:
                 description=f"Error while executing query: {str(e)}",
             )
 
-    async def execute_vector_search_query(self, query: VectorSearchQuery):
-        parameters = {**query.variables, **query.parameters}
-        used_parameters = set()
-
-        # Fill query parameters
-        query_text = replace_parameters(query.query, parameters, used_parameters)
+    async def execute_paginated_mongo_query(self, query: MongoQuery, filter_body):
+        if query.method not in CURSOR_METHODS:
+            raise CustomException(
+                status_code=400,
+                error_code=ERR_BAD_PARAMETERS,
+                description=f"Method {query.method} can't be paginated",
+            )
 
-        # Validate that all parameters were used
-        unused_parameters = set(parameters.keys()) - used_parameters
-        if "token" in unused_parameters:
-            unused_parameters.remove("token")
-        if unused_parameters:
+        try:
+            return await self._upstream(
+                query,
+                lambda: execute_paginated_query(
+                    connection_string=query.credentials["main_url"],
+                    collection=query.collection,
+                    method=query.method,
+                    filter_body=replace_objectid_strings(filter_body),
+                    page_size=query.pagination["page_size"],
+                    sort_key=query.pagination["sort_key"],
+                    sort_order=query.pagination["sort_order"],
+                    cursor=query.pagination["cursor"],
+                ),
+            )
+        except InvalidCursor as e:
             raise CustomException(
                 status_code=400,
                 error_code=ERR_BAD_PARAMETERS,
-                description=f"Unused parameters in input: {unused_parameters}",
+                description=str(e),
+            )
+        except CustomException:
+            raise
+        except Exception as e:
+            raise CustomException(
+                status_code=500,
+                error_code=ERR_INTERNAL,
+                description=f"Error while executing query: {str(e)}",
             )
 
-        # Validate that all placeholders were replaced
-        all_placeholders = re.findall(r"\{\{(.*?)\}\}", query_text)
-        missing_parameters = set(all_placeholders) - set(parameters.keys())
-        if "token" in missing_parameters:
-            missing_parameters.remove("token")
-        if missing_parameters:
+    async def stream_mongo_query(self, query: MongoQuery, batch_size: int):
+        filter_body, _ = self._bind_parameters(
+            query, query.filter_body, query.update_body
+        )
+        if query.method not in CURSOR_METHODS:
             raise CustomException(
                 status_code=400,
                 error_code=ERR_BAD_PARAMETERS,
-                description=f"Missing parameters in input: {missing_parameters}",
+                description=f"Method {query.method} can't be streamed",
+            )
+
+        # The first batch is fetched before answering, so that errors in the query
+        # are still reported with a proper status code
+        try:
+            batches = await self._upstream(
+                query,
+                lambda: open_cursor(
+                    connection_string=query.credentials["main_url"],
+                    collection=query.collection,
+                    method=query.method,
+                    filter_body=replace_objectid_strings(filter_body),
+                    batch_size=batch_size,
+                ),
+                stream=True,
+            )
+            first_batch = await anext(batches, [])
+        except CustomException:
+            raise
+        except Exception as e:
+            raise CustomException(
+                status_code=500,
+                error_code=ERR_INTERNAL,
+                description=f"Error while executing query: {str(e)}",
             )
 
+        async def stream():
+            yield first_batch
+            async for batch in batches:
+                yield batch
+
+        return stream()
+
+    async def execute_vector_search_query(self, query: VectorSearchQuery):
+        (query_text,) = self._bind_parameters(query, query.query)
+
         try:
-            response = await execute_vector_search(
-                connection_string=query.credentials["main_url"],
-                api_key=query.credentials["openai_api_key"],
-                collection=query.collection,
-                query=query_text,
-                limit=query.limit,
-                num_candidates=query.num_candidates,
+            query_vector = await self.get_query_vector(
+                query_text, query.credentials["openai_api_key"]
+            )
+            response = await self._upstream(
+                query,
+                lambda: execute_vector_search(
+                    connection_string=query.credentials["main_url"],
+                    collection=query.collection,
+                    query_vector=query_vector,
+                    limit=query.limit,
+                    num_candidates=query.num_candidates,
+                ),
             )
 
             return response
+        except CustomException:
+            raise
         except Exception as e:
             raise CustomException(
                 status_code=500,
@@ -219,20 +504,73 @@ class QueryRepository:
                 description=f"Error while executing query: {str(e)}",
             )
 
-    async def get_all_documents_field(
+    async def get_query_vector(self, text: str, api_key: str) -> list:
+        # Repeated searches are answered from the embedding cache
+        model = settings.EMBEDDINGS_MODEL
+        if self.embedding_cache is not None:
+            query_vector = await self.embedding_cache.get(model, text)
+            if query_vector is not None:
+                cache_requests.inc(cache="embedding", result="hit")
+                return query_vector
+            cache_requests.inc(cache="embedding", result="miss")
+
+        with stage_duration.time(
+            stage="embedding", type="VECTOR_SEARCH", method="vectorSearch"
+        ):
+            response = await get_embeddings(text, api_key, self.http_client)
+        query_vector = response["body"]["data"][0]["embedding"]
+        if self.embedding_cache is not None:
+            await self.embedding_cache.set(model, text, query_vector)
+        return query_vector
+
+    async def count_documents_field(
         self, connection_string: str, collection: str, field: str
     ):
         try:
-            # we filter the documents to only get the field
             response = await execute_query(
+                connection_string=connection_string,
+                collection=collection,
+                method="count",
+                filter_body={field: {"$exists": True}},
+            )
+            return response["body"]
+        except Exception as e:
+            raise CustomException(
+                status_code=500,
+                error_code=ERR_INTERNAL,
+                description=f"Error while executing query: {str(e)}",
+            )
+
+    async def get_documents_field_page(
+        self,
+        connection_string: str,
+        collection: str,
+        field: str,
+        page_size: int,
+        cursor: str = None,
+    ):
+        try:
+            # we filter the documents to only get the field
+            return await execute_paginated_query(
                 connection_string=connection_string,
                 collection=collection,
                 method="aggregate",
                 # filter body to only obtain _id and the field
-                filter_body=[{"$project": {"_id": 1, field: 1}}],
-                update_body={},
+                filter_body=[
+                    {"$match": {field: {"$exists": True}}},
+                    {
+                        "$project": {
+                            "_id": 1,
+                            field: 1,
+                            "embedding_hash": 1,
+                            "embedding_model": 1,
+                            "has_embedding": {"$gt": ["$embedding", None]},
+                        }
+                    },
+                ],
+                page_size=page_size,
+                cursor=cursor,
             )
-            return response
         except Exception as e:
             raise CustomException(
                 status_code=500,
@@ -243,7 +581,7 @@ class QueryRepository:
     async def patch_all_documents_field(
         self, connection_string: str, collection: str, values: dict
     ):
-        # values is a dictionary with the _id as key and the field value as value
+        # values is a dictionary with the _id as key and the fields to set as value
         try:
             response = await bulk_update(
                 connection_string=connection_string,
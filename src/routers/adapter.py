@@ -1,41 +1,176 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from repositories.query import QueryRepository
 from configs.settings import settings
 from services.query import QueryService
-from schemas.query import ExecuteQueryRequest, PreviewQueryRequest
+from services.jobs import JobManager
+from models.query import Query
+from schemas.query import ExecuteQueryRequest, PreviewQueryRequest, BatchExecuteRequest
+from lib.streaming import get_stream_format, encode_stream, MEDIA_TYPES, NDJSON, RAW
+from lib.encoding import BSONResponse
+from lib.formats import negotiate_format, render
+from lib.metrics import stage_duration, response_size
+from connections.mongo_connection import clients as mongo_clients
 
 
 AdapterRouter = APIRouter(prefix="/v1/adapter", tags=["adapter"])
 
 
-def get_query_service():
-    repository = QueryRepository(url=settings.DASHBOARDS_SERVICE_URL, version="1")
-    service = QueryService(repository)
-    return service
+def create_query_service(state) -> QueryService:
+    repository = QueryRepository(
+        url=settings.DASHBOARDS_SERVICE_URL,
+        version="1",
+        http_client=state.http_client,
+        definition_cache=state.definition_cache,
+        embedding_cache=state.embedding_cache,
+        result_cache=state.result_cache,
+        connection_registry=state.connection_registry,
+        upstreams=state.upstreams,
+    )
+    return QueryService(repository, state.single_flight)
 
 
-@AdapterRouter.post("/embeddings/{query_id}")
+def get_query_service(request: Request):
+    return create_query_service(request.app.state)
+
+
+def respond(result, accept: str, endpoint: str, query: Query):
+    media_type = negotiate_format(accept)
+    with stage_duration.time(stage="encode", type=query.type, method=query.method):
+        response = render(result, media_type)
+    response_size.observe(len(response.body), endpoint=endpoint, format=media_type)
+    return response
+
+
+def get_job_manager(request: Request):
+    return request.app.state.jobs
+
+
+@AdapterRouter.post("/embeddings/{query_id}", status_code=202)
 async def create_embeddings(
     query_id: str,
     index_field: str,
+    resume: bool = False,
+    incremental: bool = False,
+    service: QueryService = Depends(get_query_service),
+    jobs: JobManager = Depends(get_job_manager),
+):
+    return await service.create_embeddings(
+        query_id, index_field, jobs, resume, incremental
+    )
+
+
+@AdapterRouter.get("/embeddings/jobs/{job_id}")
+async def get_embeddings_job(job_id: str, jobs: JobManager = Depends(get_job_manager)):
+    return jobs.get(job_id).to_dict()
+
+
+@AdapterRouter.delete("/embeddings/jobs/{job_id}")
+async def cancel_embeddings_job(job_id: str, jobs: JobManager = Depends(get_job_manager)):
+    return (await jobs.cancel(job_id)).to_dict()
+
+
+@AdapterRouter.post("/embeddings/jobs/{job_id}/resume", status_code=202)
+async def resume_embeddings_job(
+    job_id: str,
+    service: QueryService = Depends(get_query_service),
+    jobs: JobManager = Depends(get_job_manager),
+):
+    return jobs.resume(job_id, service.run_embeddings_job).to_dict()
+
+
+@AdapterRouter.post("/execute:batch", response_class=BSONResponse)
+async def execute_batch(
+    batch: BatchExecuteRequest,
+    request: Request,
+    stream: str = None,
     service: QueryService = Depends(get_query_service),
 ):
-    return await service.create_embeddings(query_id, index_field)
+    results = service.execute_batch(batch.queries, settings.BATCH_CONCURRENCY)
+    if get_stream_format(request.headers.get("accept"), stream) == NDJSON:
+        # One line per query, in completion order
+        batches = ([result] async for result in results)
+        return StreamingResponse(
+            encode_stream(batches, NDJSON), media_type=MEDIA_TYPES[NDJSON]
+        )
+    items = [result async for result in results]
+    results = {"results": sorted(items, key=lambda item: item["index"])}
+    # The queries of a batch are encoded together
+    with stage_duration.time(stage="encode", type="BATCH", method=""):
+        response = BSONResponse(results)
+    response_size.observe(
+        len(response.body), endpoint="batch", format=response.media_type
+    )
+    return response
 
 
-@AdapterRouter.post("/execute/{query_id}")
+@AdapterRouter.post("/execute/{query_id}", response_class=BSONResponse)
 async def execute_query(
     query_id: str,
     parameters: ExecuteQueryRequest,
+    request: Request,
+    stream: str = None,
     service: QueryService = Depends(get_query_service),
 ):
-    return await service.execute_query(query_id, parameters)
+    accept = request.headers.get("accept")
+    stream_format = get_stream_format(accept, stream)
+    query = await service.build_query(query_id, parameters)
+    # Mongo cursors are streamed as batches and REST bodies passed through as they
+    # come, other queries get a regular response
+    if stream_format is None or not service.can_stream(query, stream_format):
+        return respond(await service.run_query(query), accept, "execute", query)
+    if stream_format == RAW:
+        upstream = await service.stream_api_query(
+            query, request.headers.get("accept-encoding")
+        )
+        # The body may never be read if the client goes away before it starts
+        return StreamingResponse(
+            upstream.iter_chunks(),
+            status_code=upstream.status_code,
+            headers=upstream.headers,
+            background=BackgroundTask(upstream.close),
+        )
+    batches = await service.stream_query(query)
+    return StreamingResponse(
+        encode_stream(batches, stream_format), media_type=MEDIA_TYPES[stream_format]
+    )
 
 
-@AdapterRouter.post("/{connection_id}/preview")
+@AdapterRouter.post("/{connection_id}/preview", response_class=BSONResponse)
 async def preview_query(
     connection_id: str,
     query: PreviewQueryRequest,
+    request: Request,
+    service: QueryService = Depends(get_query_service),
+):
+    preview = await service.build_preview_query(connection_id, query)
+    result = await service.run_preview(connection_id, query, preview)
+    return respond(result, request.headers.get("accept"), "preview", preview)
+
+
+@AdapterRouter.delete("/cache/queries/{query_id}")
+async def invalidate_query(
+    query_id: str,
     service: QueryService = Depends(get_query_service),
 ):
-    return await service.preview_query(connection_id, query)
+    return {"invalidated": service.repository.invalidate_query(query_id)}
+
+
+@AdapterRouter.delete("/cache/connections/{connection_id}")
+async def invalidate_connection(
+    connection_id: str,
+    service: QueryService = Depends(get_query_service),
+):
+    return {"invalidated": service.repository.invalidate_connection(connection_id)}
+
+
+@AdapterRouter.get("/cache/stats")
+async def get_cache_stats(request: Request):
+    return {
+        "results": request.app.state.result_cache.stats(),
+        "embeddings": request.app.state.embedding_cache.stats(),
+        "single_flight": request.app.state.single_flight.stats(),
+        "mongo_clients": mongo_clients.stats(),
+        "connections": request.app.state.connection_registry.stats(),
+    }
@@ -1,9 +1,26 @@
-from pydantic import BaseModel
-from typing import Union
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional, Union
+from configs.settings import settings
+
+
+class Pagination(BaseModel):
+    page_size: int = Field(gt=0, le=10000)
+    sort_key: str = "_id"
+    sort_order: Literal["asc", "desc"] = "asc"
+    cursor: Optional[str] = None
 
 
 class ExecuteQueryRequest(BaseModel):
     parameters: dict
+    pagination: Optional[Pagination] = None
+
+
+class BatchQuery(ExecuteQueryRequest):
+    query_id: str
+
+
+class BatchExecuteRequest(BaseModel):
+    queries: List[BatchQuery] = Field(min_length=1, max_length=settings.BATCH_MAX_QUERIES)
 
 
 class ApiMetadata(BaseModel):
@@ -32,4 +49,5 @@ class MongoVectorSearchMetadata(BaseModel):
 
 class PreviewQueryRequest(BaseModel):
     parameters: dict
+    pagination: Optional[Pagination] = None
     connection_metadata: Union[ApiMetadata, MongoMetadata, MongoVectorSearchMetadata]
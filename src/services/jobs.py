@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+
+from errors import CustomException, ERR_NOT_FOUND, ERR_BAD_REQUEST
+from models.job import EmbeddingJob, RUNNING, COMPLETED, FAILED, CANCELLED
+from lib.deadline import clear_deadline
+
+logger = logging.getLogger(__name__)
+
+
+class JobManager:
+    """
+    Runs jobs as background tasks. At most `concurrency` jobs run at a time and the
+    rest wait queued, so background work can't take over the worker. Only the
+    latest `max_finished` finished jobs are kept for status queries.
+    """
+
+    def __init__(self, concurrency: int, max_finished: int = 100):
+        self.concurrency = concurrency
+        self.max_finished = max_finished
+        self.jobs = {}
+        self._slots = None
+
+    def submit(self, job: EmbeddingJob, run):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, run))
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> EmbeddingJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise CustomException(
+                status_code=404,
+                error_code=ERR_NOT_FOUND,
+                description=f"Job {job_id} not found",
+            )
+        return job
+
+    async def cancel(self, job_id: str) -> EmbeddingJob:
+        job = self.get(job_id)
+        if not job.finished:
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        return job
+
+    def resume(self, job_id: str, run) -> EmbeddingJob:
+        job = self.get(job_id)
+        if job.status not in (FAILED, CANCELLED):
+            raise CustomException(
+                status_code=400,
+                error_code=ERR_BAD_REQUEST,
+                description=f"Job {job_id} can't be resumed while {job.status}",
+            )
+        job.reset()
+        return self.submit(job, run)
+
+    async def shutdown(self):
+        tasks = [job.task for job in self.jobs.values() if not job.finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: EmbeddingJob, run):
+        # Jobs are started by a request but aren't bound by its deadline
+        clear_deadline()
+        try:
+            async with self._slots:
+                job.status = RUNNING
+                job.started_at = time.time()
+                await run(job)
+                job.status = COMPLETED
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            logger.exception("Job %s failed", job.id)
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        finished = sorted(
+            (job for job in self.jobs.values() if job.finished),
+            key=lambda job: job.finished_at,
+        )
+        for job in finished[: max(len(finished) - self.max_finished, 0)]:
+            del self.jobs[job.id]
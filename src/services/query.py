@@ -1,22 +1,121 @@
 from repositories.query import QueryRepository
-from errors import CustomException, ERR_UNSUPPORTED_QUERY_TYPE, ERR_BAD_PARAMETERS
-from models.query import ApiQuery, MongoQuery, VectorSearchQuery
-from schemas.query import ExecuteQueryRequest, PreviewQueryRequest
-from lib.encryption import decrypt
-from openai import OpenAI
-import tiktoken
+import asyncio
+import logging
+from errors import (
+    CustomException,
+    ERR_UNSUPPORTED_QUERY_TYPE,
+    ERR_BAD_PARAMETERS,
+    ERR_INTERNAL,
+)
+from models.query import Query, ApiQuery, MongoQuery, VectorSearchQuery
+from repositories.query import CURSOR_METHODS, is_read_only, query_key
+from lib.single_flight import SingleFlight
+from lib.streaming import RAW
+from lib.deadline import (
+    clear_deadline,
+    deadline_error,
+    deadline_exceeded,
+    deadline_scope,
+    parse_timeout,
+    time_left,
+)
+from configs.settings import settings
+from schemas.query import ExecuteQueryRequest, PreviewQueryRequest, BatchQuery
+from connections.embeddings import EmbeddingClient
+from models.job import EmbeddingJob
+from lib.content_hash import content_hash, needs_embedding
+from services.jobs import JobManager
+from typing import List, Optional, Union
+import time
+from lib.metrics import stage_duration, queries_in_flight
+
+logger = logging.getLogger(__name__)
+
+
+def get_pagination(request: Union[ExecuteQueryRequest, PreviewQueryRequest]):
+    if request.pagination is None:
+        return None
+    return request.pagination.model_dump()
+
+
+def shared_timeout() -> Optional[float]:
+    if settings.REQUEST_MAX_TIMEOUT is not None:
+        return settings.REQUEST_MAX_TIMEOUT
+    return settings.REQUEST_TIMEOUT
 
 
 class QueryService:
-    def __init__(self, repository: QueryRepository):
+    def __init__(self, repository: QueryRepository, single_flight: SingleFlight = None):
         self.repository = repository
+        self.single_flight = single_flight
 
     async def execute_query(
         self,
         query_id: str,
         parameters: ExecuteQueryRequest,
     ):
+        new_query = await self.build_query(query_id, parameters)
+        return await self.run_query(new_query)
+
+    async def run_query(self, query: Query):
+        res = await self.coalesce(query, query.id)
+        # Only the status is logged, results can be arbitrarily large
+        logger.debug(
+            "Executed query %s",
+            query.id,
+            extra={"type": query.type, "status_code": res.get("status_code")},
+        )
+        return res
+
+    async def coalesce(self, query: Query, name: str):
+        """
+        Identical read-only executions running at the same time share a single
+        upstream call. Queries without a name run on their own. The shared call
+        isn't bound by the deadline of the request that started it but by the
+        longest deadline a request can have, every request stops waiting for it
+        at its own deadline instead.
+        """
+        with queries_in_flight.track(type=query.type), deadline_scope(query.timeout):
+            if self.single_flight is None or name is None or not is_read_only(query):
+                return await self.repository.execute_query(query)
+            flight = self.single_flight.do(
+                query_key(name, query), lambda: self.run_shared(query)
+            )
+            try:
+                return await asyncio.wait_for(flight, time_left())
+            except asyncio.TimeoutError as e:
+                if not deadline_exceeded(e):
+                    raise
+                raise deadline_error("Query exceeded its deadline") from e
+
+    async def run_shared(self, query: Query):
+        # The call runs in a task of its own, so this only replaces its deadline.
+        # No request may wait longer than the maximum timeout, and the timeout of
+        # the query is the same for every request sharing it
+        clear_deadline()
+        with deadline_scope(shared_timeout()), deadline_scope(query.timeout):
+            return await self.repository.execute_query(query)
+
+    async def build_query(self, query_id: str, parameters: ExecuteQueryRequest) -> Query:
+        query = await self.get_definition(query_id)
+        return self.make_query(query_id, query, parameters)
+
+    async def get_definition(self, query_id: str) -> dict:
+        started_at = time.perf_counter()
         query = await self.repository.get_by_id(query_id)
+        # The type and method are only known once the definition is loaded
+        type, method = "", ""
+        if query["status_code"] == 200:
+            type = query["body"]["connection"].get("type", "")
+            method = query["body"]["metadata"].get("method", "")
+        stage_duration.observe(
+            time.perf_counter() - started_at, stage="definition", type=type, method=method
+        )
+        return query
+
+    def make_query(
+        self, query_id: str, query: dict, parameters: ExecuteQueryRequest
+    ) -> Query:
         if query["status_code"] != 200:
             error = query["body"]["error"]
             raise CustomException(
@@ -25,9 +124,10 @@ class QueryService:
                 description=error["description"],
             )
 
-        type = query["body"]["connection"]["type"]
-        credentials = query["body"]["connection"]["credentials"]
-        variables = query["body"]["connection"]["variables"]
+        connection = self.repository.resolve_connection(query["body"]["connection"])
+        type = connection.type
+        credentials = connection.credentials
+        variables = connection.variables
 
         if type == "REST":
             body = (
@@ -53,7 +153,10 @@ class QueryService:
         elif type == "MONGO":
             method = query["body"]["metadata"]["method"]
             if method == "vectorSearch":
-                credentials["openai_api_key"] = decrypt(credentials["openai_api_key"])
+                with stage_duration.time(
+                    stage="decrypt", type="VECTOR_SEARCH", method=method
+                ):
+                    credentials = connection.decrypted_credentials()
                 new_query = VectorSearchQuery(
                     type="VECTOR_SEARCH",
                     credentials=credentials,
@@ -77,6 +180,7 @@ class QueryService:
                     collection=query["body"]["metadata"]["collection"],
                     filter_body=query["body"]["metadata"]["filter_body"],
                     update_body=query["body"]["metadata"]["update_body"],
+                    pagination=get_pagination(parameters),
                 )
         else:
             raise CustomException(
@@ -84,12 +188,123 @@ class QueryService:
                 error_code=ERR_UNSUPPORTED_QUERY_TYPE,
                 description=f"Unsupported query type: {type}",
             )
-        res = await self.repository.execute_query(new_query)
-        print(f"res: {res}")
-        return res
+        new_query.id = query_id
+        new_query.connection_id = connection.id
+        new_query.cache_ttl = query["body"]["metadata"].get("cache_ttl")
+        new_query.timeout = parse_timeout(query["body"]["metadata"].get("timeout"))
+        return new_query
 
-    async def preview_query(self, connection_id: str, query: PreviewQueryRequest):
+    async def execute_batch(self, queries: List[BatchQuery], concurrency: int):
+        """
+        Runs the queries of a batch concurrently and yields the result or error of
+        each one as soon as it completes. Every definition is fetched once.
+        """
+        query_ids = list(dict.fromkeys(query.query_id for query in queries))
+        responses = await asyncio.gather(
+            *(self.get_definition(query_id) for query_id in query_ids),
+            return_exceptions=True,
+        )
+        definitions = dict(zip(query_ids, responses))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index: int, item: BatchQuery):
+            result = {"index": index, "query_id": item.query_id}
+            async with semaphore:
+                try:
+                    definition = definitions[item.query_id]
+                    if isinstance(definition, Exception):
+                        raise definition
+                    query = self.make_query(item.query_id, definition, item)
+                    return {
+                        **result,
+                        "status_code": 200,
+                        "result": await self.run_query(query),
+                    }
+                except CustomException as e:
+                    error = {"code": e.error_code, "description": e.description}
+                    return {**result, "status_code": e.status_code, "error": error}
+                except Exception as e:
+                    error = {"code": ERR_INTERNAL, "description": str(e)}
+                    return {**result, "status_code": 500, "error": error}
+
+        tasks = [
+            asyncio.create_task(run(index, item)) for index, item in enumerate(queries)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def prewarm_connections(self, connection_ids: list) -> int:
+        """
+        Loads, decrypts and connects the given connections ahead of the first
+        request. Returns how many of them are ready.
+        """
+
+        async def prewarm(connection_id: str) -> bool:
+            try:
+                response = await self.repository.get_connection_by_id(connection_id)
+                if response["status_code"] != 200:
+                    return False
+                connection = self.repository.resolve_connection(
+                    {"id": connection_id, **response["body"]}
+                )
+                connection.decrypted_credentials()
+                await self.repository.warm_connection(connection)
+                return True
+            except Exception as e:
+                logger.warning("Couldn't prewarm connection %s: %s", connection_id, e)
+                return False
+
+        ready = await asyncio.gather(*(prewarm(id) for id in connection_ids))
+        return sum(ready)
+
+    def can_stream(self, query: Query, stream_format: str = None) -> bool:
+        if stream_format == RAW:
+            return query.type == "REST"
+        # Pages are already bounded, so paginated queries are answered at once
+        return (
+            query.type == "MONGO"
+            and query.method in CURSOR_METHODS
+            and query.pagination is None
+        )
+
+    async def stream_query(self, query: MongoQuery):
+        # The timeout of the query covers opening the stream, not reading it
+        with deadline_scope(query.timeout):
+            return await self.repository.stream_mongo_query(
+                query, batch_size=settings.STREAM_BATCH_SIZE
+            )
+
+    async def stream_api_query(self, query: ApiQuery, accept_encoding: str = None):
+        with deadline_scope(query.timeout):
+            return await self.repository.stream_api_query(
+                query, accept_encoding, chunk_size=settings.PASSTHROUGH_CHUNK_SIZE
+            )
+
+    async def get_connection(self, connection_id: str, method: str) -> dict:
+        started_at = time.perf_counter()
         connection = await self.repository.get_connection_by_id(connection_id)
+        type = ""
+        if connection["status_code"] == 200:
+            type = connection["body"].get("type", "")
+        stage_duration.observe(
+            time.perf_counter() - started_at, stage="connection", type=type, method=method
+        )
+        return connection
+
+    async def preview_query(self, connection_id: str, query: PreviewQueryRequest):
+        new_query = await self.build_preview_query(connection_id, query)
+        return await self.run_preview(connection_id, query, new_query)
+
+    async def build_preview_query(
+        self, connection_id: str, query: PreviewQueryRequest
+    ) -> Query:
+        connection = await self.get_connection(
+            connection_id, query.connection_metadata.method
+        )
         if connection["status_code"] != 200:
             error = connection["body"]["error"]
             raise CustomException(
@@ -98,9 +313,12 @@ class QueryService:
                 description=error["description"],
             )
 
-        type = connection["body"]["type"]
-        credentials = connection["body"]["credentials"]
-        variables = connection["body"]["variables"]
+        connection = self.repository.resolve_connection(
+            {"id": connection_id, **connection["body"]}
+        )
+        type = connection.type
+        credentials = connection.credentials
+        variables = connection.variables
 
         if type == "REST":
             try:
@@ -125,7 +343,10 @@ class QueryService:
             method = query.connection_metadata.method
             if method == "vectorSearch":
                 try:
-                    credentials["openai_api_key"] = decrypt(credentials["openai_api_key"])
+                    with stage_duration.time(
+                        stage="decrypt", type="VECTOR_SEARCH", method=method
+                    ):
+                        credentials = connection.decrypted_credentials()
                     new_query = VectorSearchQuery(
                         type="VECTOR_SEARCH",
                         credentials=credentials,
@@ -156,6 +377,7 @@ class QueryService:
                         collection=query.connection_metadata.collection,
                         filter_body=query.connection_metadata.filter_body,
                         update_body=query.connection_metadata.update_body,
+                        pagination=get_pagination(query),
                     )
                 except Exception as e:
                     raise CustomException(
@@ -170,9 +392,37 @@ class QueryService:
                 description=f"Unsupported query type: {type}",
             )
 
-        return await self.repository.execute_query(new_query)
+        return new_query
+
+    async def run_preview(
+        self, connection_id: str, request: PreviewQueryRequest, query: Query
+    ):
+        # Previews are identified by their connection and the whole request
+        name = f"preview:{connection_id}:{request.connection_metadata.model_dump_json()}"
+        return await self.coalesce(query, name)
+
+    async def create_embeddings(
+        self,
+        query_id: str,
+        index_field: str,
+        jobs: JobManager,
+        resume: bool = False,
+        incremental: bool = False,
+    ):
+        # The query is validated before the job is created, so errors are reported
+        # right away instead of in the job status
+        query = await self.get_vector_search_query(query_id)
+
+        checkpoint = None
+        saved_checkpoint = query["body"]["metadata"].get("embeddings_checkpoint")
+        if resume and saved_checkpoint and saved_checkpoint["index_field"] == index_field:
+            checkpoint = saved_checkpoint
 
-    async def create_embeddings(self, query_id: str, index_field: str):
+        job = EmbeddingJob(query_id, index_field, checkpoint, incremental)
+        jobs.submit(job, self.run_embeddings_job)
+        return job.to_dict()
+
+    async def get_vector_search_query(self, query_id: str):
         query = await self.repository.get_by_id(query_id)
         if query["status_code"] != 200:
             error = query["body"]["error"]
@@ -183,100 +433,140 @@ class QueryService:
             )
 
         type = query["body"]["connection"]["type"]
-        credentials = query["body"]["connection"]["credentials"]
+        if type != "MONGO":
+            raise CustomException(
+                status_code=400,
+                error_code=ERR_UNSUPPORTED_QUERY_TYPE,
+                description=f"Unsupported query type: {type}",
+            )
+        method = query["body"]["metadata"]["method"]
+        if method != "vectorSearch":
+            raise CustomException(
+                status_code=400,
+                error_code=ERR_UNSUPPORTED_QUERY_TYPE,
+                description=f"Unsupported query method: {method}",
+            )
+        return query
 
-        if type == "MONGO":
-            method = query["body"]["metadata"]["method"]
-            if method == "vectorSearch":
-                credentials["openai_api_key"] = decrypt(credentials["openai_api_key"])
-                model = "text-embedding-ada-002"
-                openai_client = OpenAI(api_key=credentials["openai_api_key"])
+    async def run_embeddings_job(self, job: EmbeddingJob):
+        query = await self.get_vector_search_query(job.query_id)
+        index_field = job.index_field
+        collection = query["body"]["metadata"]["collection"]
+        connection = self.repository.resolve_connection(query["body"]["connection"])
+        credentials = connection.decrypted_credentials()
+        embedding_client = EmbeddingClient(
+            http_client=self.repository.http_client,
+            api_key=credentials["openai_api_key"],
+            url=settings.EMBEDDINGS_URL,
+            model=settings.EMBEDDINGS_MODEL,
+            max_batch_items=settings.EMBEDDINGS_MAX_BATCH_ITEMS,
+            max_batch_tokens=settings.EMBEDDINGS_MAX_BATCH_TOKENS,
+            max_item_tokens=settings.EMBEDDINGS_MAX_ITEM_TOKENS,
+            concurrency=settings.EMBEDDINGS_CONCURRENCY,
+            tokens_per_minute=settings.EMBEDDINGS_TOKENS_PER_MINUTE,
+            max_retries=settings.EMBEDDINGS_MAX_RETRIES,
+        )
 
-                # get all the documents in the collection
-                documents = await self.repository.get_all_documents_field(
-                    connection_string=credentials["main_url"],
-                    collection=query["body"]["metadata"]["collection"],
-                    field=index_field,
-                )
+        job.total = await self.repository.count_documents_field(
+            connection_string=credentials["main_url"],
+            collection=collection,
+            field=index_field,
+        )
 
-                # for each document, get the embeddings for the index_field
-                update_dict = {}
-                # we filter out the documents that don't have the index_field or are empty
-                documents["body"] = [
-                    document
-                    for document in documents["body"]
-                    if index_field in document and document[index_field]
-                ]
-                query_texts = [
-                    document[index_field].strip() for document in documents["body"]
-                ]
-                enc = tiktoken.encoding_for_model(model)
-                tokens = [len(enc.encode(text)) for text in query_texts]
-                total_tokens = sum(tokens)
-                print(f"Total tokens: {total_tokens}")
-                # The input parameter may not take a list longer than 2048 elements
-                # (chunks of text).
-                # The total number of tokens across all list elements of the input
-                # parameter cannot exceed 1,000,000. (Because the rate limit is
-                # 1,000,000 tokens per minute.)
-                # Each individual array element (chunk of text) cannot be more
-                # than 8191 tokens.
-                if total_tokens > 1000000:
-                    print("Total tokens > 1M")
-                    batch_size = 2048
-                    n_batches = len(query_texts) // batch_size + 1
-                    embeddings = []
-                    print(f"n_batches: {n_batches}")
-                    for i in range(n_batches):
-                        print(f"Batch {i}")
-                        batch = query_texts[i * batch_size : (i + 1) * batch_size]
-                        embeddings_response = openai_client.embeddings.create(
-                            input=batch, model=model
-                        )
-                        embeddings_usage = embeddings_response.usage
-                        print(embeddings_usage)
-                        print(embeddings_usage)
-                        embeddings += embeddings_response.data
-                    for i, document in enumerate(documents["body"]):
-                        id = document["_id"]
-                        update_dict[id] = embeddings[i].embedding
-                else:
-                    print("Total tokens <= 1M")
-                    embeddings_response = openai_client.embeddings.create(
-                        input=query_texts, model=model
-                    )
-                    embeddings_usage = embeddings_response.usage
-                    print(embeddings_usage)
-                    embeddings = embeddings_response.data
-                    for i, document in enumerate(documents["body"]):
-                        id = document["_id"]
-                        update_dict[id] = embeddings[i].embedding
-
-                # update the document with the new field "embedding"
-                response = await self.repository.patch_all_documents_field(
+        while True:
+            # Documents are read one page at a time, ordered by _id
+            page = await self.repository.get_documents_field_page(
+                connection_string=credentials["main_url"],
+                collection=collection,
+                field=index_field,
+                page_size=settings.EMBEDDINGS_JOB_PAGE_SIZE,
+                cursor=job.cursor,
+            )
+
+            # we filter out the documents that don't have the index_field or are empty
+            documents = []
+            query_texts = []
+            text_hashes = []
+            skipped = 0
+            for document in page["body"]:
+                if index_field not in document or not document[index_field]:
+                    continue
+                text = document[index_field].strip()
+                text_hash = content_hash(text)
+                # in incremental mode, documents embedded from the same text are skipped
+                if job.incremental and not needs_embedding(
+                    document, text_hash, embedding_client.model
+                ):
+                    skipped += 1
+                    continue
+                documents.append(document)
+                query_texts.append(text)
+                text_hashes.append(text_hash)
+
+            # processed counts every document of the page, like total and the
+            # checkpoint, the ones that need no embedding are done already
+            job.processed += len(page["body"]) - len(documents)
+
+            # every batch is written as soon as its embeddings are ready
+            async for indexes, embeddings in embedding_client.embed_batches(query_texts):
+                await self.repository.patch_all_documents_field(
                     connection_string=credentials["main_url"],
-                    collection=query["body"]["metadata"]["collection"],
-                    values=update_dict,
+                    collection=collection,
+                    values={
+                        documents[i]["_id"]: {
+                            "embedding": embedding,
+                            "embedding_hash": text_hashes[i],
+                            "embedding_model": embedding_client.model,
+                        }
+                        for i, embedding in zip(indexes, embeddings)
+                    },
                 )
+                job.processed += len(indexes)
 
-                metadata = query["body"]["metadata"]
-                metadata["embeddings_created"] = True
-                metadata["index_field"] = index_field
-                response = await self.repository.update_query(
-                    query_id, {"metadata": metadata, "user_id": query["body"]["user_id"]}
-                )
+            # the checkpoint moves forward once the whole page is written
+            job.save_checkpoint(
+                page["next_cursor"],
+                job.checkpoint_processed + len(page["body"]),
+                job.checkpoint_skipped + skipped,
+            )
+            if job.cursor is None:
+                break
+            await self.save_embeddings_checkpoint(job)
 
-                return response
+        await self.update_query_metadata(
+            job.query_id,
+            {
+                "embeddings_created": True,
+                "index_field": index_field,
+                "embeddings_checkpoint": None,
+            },
+        )
 
-            else:
-                raise CustomException(
-                    status_code=400,
-                    error_code=ERR_UNSUPPORTED_QUERY_TYPE,
-                    description=f"Unsupported query method: {method}",
-                )
-        else:
+    async def save_embeddings_checkpoint(self, job: EmbeddingJob):
+        # Persisted in the query, so a job lost in a crash can be resumed elsewhere
+        await self.update_query_metadata(
+            job.query_id,
+            {
+                "embeddings_checkpoint": {
+                    **job.checkpoint(),
+                    "index_field": job.index_field,
+                    "incremental": job.incremental,
+                }
+            },
+        )
+
+    async def update_query_metadata(self, query_id: str, fields: dict):
+        # The query is read again right before writing, so edits made to its
+        # metadata while a job runs aren't overwritten
+        query = await self.repository.get_by_id(query_id, cached=False)
+        if query["status_code"] != 200:
+            error = query["body"]["error"]
             raise CustomException(
-                status_code=400,
-                error_code=ERR_UNSUPPORTED_QUERY_TYPE,
-                description=f"Unsupported query type: {type}",
+                status_code=query["status_code"],
+                error_code=error["code"],
+                description=error["description"],
             )
+        metadata = {**query["body"]["metadata"], **fields}
+        await self.repository.update_query(
+            query_id, {"metadata": metadata, "user_id": query["body"]["user_id"]}
+        )
@@ -0,0 +1,11 @@
+import os
+
+# Required settings, so modules that read them can be imported in tests
+for name, value in {
+    "APP_HOST": "0.0.0.0",
+    "APP_PORT": "8080",
+    "DASHBOARDS_SERVICE_URL": "http://dashboards",
+    "API_KEY": "api-key",
+    "PRIVATE_KEY": "private-key",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.connections.api_request import HttpClient
+
+BODY = b'{"pokemon": ["pikachu", "charmander"]}' * 1000
+
+
+async def pokemon(request):
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        return web.Response(
+            body=gzip.compress(BODY),
+            headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+                "Set-Cookie": "session=1",
+            },
+        )
+    return web.Response(body=BODY, content_type="application/json")
+
+
+def stream(accept_encoding):
+    async def run():
+        app = web.Application()
+        app.router.add_get("/pokemon", pokemon)
+        async with TestServer(app) as server:
+            client = HttpClient()
+            await client.start()
+            try:
+                upstream = await client.stream_request(
+                    url=str(server.make_url("/pokemon")),
+                    headers={"accept-encoding": "br"},
+                    method="GET",
+                    body=None,
+                    accept_encoding=accept_encoding,
+                    chunk_size=1024,
+                )
+                chunks = [chunk async for chunk in upstream.iter_chunks()]
+                return upstream, chunks
+            finally:
+                await client.close()
+
+    return asyncio.run(run())
+
+
+def test_passthrough_keeps_upstream_encoding():
+    upstream, chunks = stream("gzip")
+    assert upstream.status_code == 200
+    assert upstream.headers["Content-Encoding"] == "gzip"
+    assert "Set-Cookie" not in upstream.headers
+    assert gzip.decompress(b"".join(chunks)) == BODY
+
+
+def test_passthrough_asks_for_identity_by_default():
+    upstream, chunks = stream(None)
+    assert "Content-Encoding" not in upstream.headers
+    assert b"".join(chunks) == BODY
+
+
+async def endless(request):
+    response = web.StreamResponse()
+    await response.prepare(request)
+    await response.write(BODY)
+    await asyncio.sleep(10)
+    return response
+
+
+def test_unread_streams_release_their_connection():
+    async def run():
+        app = web.Application()
+        app.router.add_get("/pokemon", endless)
+        app.router.add_get("/pokemon/all", pokemon)
+        async with TestServer(app) as server:
+            # A single connection, the second request needs the first one back
+            client = HttpClient(limit=1, limit_per_host=1)
+            await client.start()
+            url = str(server.make_url("/pokemon"))
+            try:
+                first = await client.stream_request(url=url, headers={}, method="GET")
+                await first.close()
+                second = await asyncio.wait_for(
+                    client.stream_request(url=url + "/all", headers={}, method="GET"), 1
+                )
+                return b"".join([chunk async for chunk in second.iter_chunks()])
+            finally:
+                await client.close()
+
+    assert asyncio.run(run()) == BODY
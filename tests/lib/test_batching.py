@@ -0,0 +1,20 @@
+from src.lib.batching import pack_batches
+
+
+def test_batches_are_limited_by_item_count():
+    assert pack_batches([1] * 5, max_items=2, max_tokens=100) == [[0, 1], [2, 3], [4]]
+
+
+def test_batches_are_limited_by_tokens():
+    assert pack_batches([40, 40, 40, 10], max_items=10, max_tokens=90) == [
+        [0, 1],
+        [2, 3],
+    ]
+
+
+def test_oversized_item_gets_its_own_batch():
+    assert pack_batches([10, 500, 10], max_items=10, max_tokens=100) == [[0], [1], [2]]
+
+
+def test_no_items_no_batches():
+    assert pack_batches([], max_items=10, max_tokens=100) == []
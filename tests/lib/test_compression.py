@@ -0,0 +1,167 @@
+import asyncio
+import zlib
+
+import brotli
+import zstandard
+
+from src.lib.compression import (
+    CompressionMiddleware,
+    GzipCodec,
+    available_codecs,
+    negotiate_encoding,
+    with_accept_encoding,
+)
+from src.lib.deadline import DeadlineMiddleware
+
+BODY = b'{"pokemon": "pikachu"}' * 200
+
+
+class FakeCodec:
+    def __init__(self, name):
+        self.name = name
+
+
+def test_negotiation_prefers_quality_then_server_order():
+    codecs = [FakeCodec("zstd"), FakeCodec("br"), FakeCodec("gzip")]
+    assert negotiate_encoding("gzip, br", codecs).name == "br"
+    assert negotiate_encoding("gzip;q=1, br;q=0.5", codecs).name == "gzip"
+    assert negotiate_encoding("*", codecs).name == "zstd"
+    assert negotiate_encoding("br;q=0, *;q=0.1", codecs[1:]).name == "gzip"
+    assert negotiate_encoding("identity", codecs) is None
+    assert negotiate_encoding(None, codecs) is None
+
+
+def test_unavailable_codecs_are_skipped():
+    codecs = available_codecs(["unknown", "gzip"])
+    assert [codec.name for codec in codecs] == ["gzip"]
+
+
+def test_default_encodings_are_all_available():
+    codecs = available_codecs(["zstd", "br", "gzip"])
+    assert [codec.name for codec in codecs] == ["zstd", "br", "gzip"]
+    zstd, br, _ = codecs
+    assert zstandard.ZstdDecompressor().decompress(zstd.compress(BODY)) == BODY
+    assert brotli.decompress(br.compress(BODY)) == BODY
+
+
+def test_query_headers_keep_their_accept_encoding():
+    assert with_accept_encoding({"accept-encoding": "identity"}) == {
+        "accept-encoding": "identity"
+    }
+    assert "gzip" in with_accept_encoding({})["Accept-Encoding"]
+
+
+def run(app, accept_encoding="gzip"):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "headers": [(b"accept-encoding", accept_encoding.encode())],
+    }
+    middleware = CompressionMiddleware(app, [GzipCodec(5)], minimum_size=100)
+    asyncio.run(middleware(scope, receive, send))
+    return dict(messages[0]["headers"]), b"".join(m.get("body", b"") for m in messages)
+
+
+def response(*chunks, headers=()):
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json"), *headers],
+            }
+        )
+        for position, chunk in enumerate(chunks):
+            more_body = position < len(chunks) - 1
+            await send(
+                {"type": "http.response.body", "body": chunk, "more_body": more_body}
+            )
+
+    return app
+
+
+def test_large_bodies_are_compressed():
+    headers, body = run(response(BODY))
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"content-length"] == str(len(body)).encode()
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert zlib.decompress(body, 31) == BODY
+
+
+def test_small_bodies_are_not_compressed():
+    headers, body = run(response(b"{}"))
+    assert b"content-encoding" not in headers
+    assert body == b"{}"
+
+
+def test_streamed_bodies_are_compressed_by_chunk():
+    headers, body = run(response(BODY, BODY, b""))
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    assert zlib.decompress(body, 31) == BODY * 2
+
+
+def test_encoded_responses_pass_through():
+    compressed = zlib.compress(BODY, 5, wbits=31)
+    headers, body = run(response(compressed, headers=[(b"content-encoding", b"gzip")]))
+    assert body == compressed
+
+
+def slow_stream(delay):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        # A slow upstream, the first chunk takes longer than the deadline
+        await asyncio.sleep(delay)
+        await send({"type": "http.response.body", "body": BODY, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    return app
+
+
+def test_started_streams_outlive_the_deadline_behind_compression():
+    messages = []
+    received = []
+
+    async def receive():
+        received.append(1)
+        if len(received) == 1:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # The client stays connected
+        await asyncio.sleep(10)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+    # Same order as the app, deadlines are tracked inside compression
+    app = DeadlineMiddleware(slow_stream(0.1), default=0.05)
+    middleware = CompressionMiddleware(app, [GzipCodec(5)], minimum_size=100)
+    asyncio.run(middleware(scope, receive, send))
+    assert messages[0]["status"] == 200
+    body = b"".join(m.get("body", b"") for m in messages)
+    assert zlib.decompress(body, 31) == BODY
+
+
+def test_encoded_bodies_send_their_headers_right_away():
+    sent = []
+
+    async def app(scope, receive, send):
+        headers = [(b"content-encoding", b"br")]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        assert sent[0]["type"] == "http.response.start"
+        await send({"type": "http.response.body", "body": b"compressed"})
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    middleware = CompressionMiddleware(app, [GzipCodec(5)], minimum_size=1)
+    asyncio.run(middleware(scope, None, send))
+    assert sent[1]["body"] == b"compressed"
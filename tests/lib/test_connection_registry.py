@@ -0,0 +1,60 @@
+from src.lib.connection_registry import ConnectionRegistry, load_recent, save_recent
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def connection(id, api_key="secret"):
+    return {
+        "id": id,
+        "type": "MONGO",
+        "credentials": {"main_url": "mongodb://db", "openai_api_key": api_key},
+        "variables": {},
+    }
+
+
+def test_credentials_are_decrypted_once():
+    calls = []
+
+    def decrypt(value):
+        calls.append(value)
+        return value.upper()
+
+    registry = ConnectionRegistry(ttl=60, maxsize=10, decrypt=decrypt)
+    for _ in range(3):
+        credentials = registry.resolve(connection("c1")).decrypted_credentials()
+    assert credentials["openai_api_key"] == "SECRET"
+    assert calls == ["secret"]
+
+
+def test_changed_credentials_are_resolved_again():
+    registry = ConnectionRegistry(ttl=60, maxsize=10, decrypt=str.upper)
+    registry.resolve(connection("c1"))
+    resolved = registry.resolve(connection("c1", api_key="rotated"))
+    assert resolved.decrypted_credentials()["openai_api_key"] == "ROTATED"
+    assert registry.stats()["misses"] == 2
+
+
+def test_entries_expire_and_can_be_invalidated():
+    timer = FakeTimer()
+    registry = ConnectionRegistry(ttl=10, maxsize=10, decrypt=str.upper, timer=timer)
+    first = registry.resolve(connection("c1"))
+    timer.now = 11
+    assert registry.resolve(connection("c1")) is not first
+    assert registry.invalidate("c1")
+    assert "c1" not in registry
+
+
+def test_recent_connections_survive_restart(tmp_path):
+    registry = ConnectionRegistry(ttl=60, maxsize=10, decrypt=str.upper)
+    for id in ("c1", "c2", "c3", "c1"):
+        registry.resolve(connection(id))
+    path = str(tmp_path / "connections.json")
+    save_recent(path, registry.recent(2))
+    assert load_recent(path) == ["c1", "c3"]
+    assert load_recent(str(tmp_path / "missing.json")) == []
@@ -0,0 +1,40 @@
+from src.lib.content_hash import content_hash, needs_embedding
+
+MODEL = "text-embedding-ada-002"
+
+
+def test_content_hash_depends_on_text():
+    assert content_hash("ditto") == content_hash("ditto")
+    assert content_hash("ditto") != content_hash("eevee")
+
+
+def test_unchanged_document_is_skipped():
+    document = {
+        "has_embedding": True,
+        "embedding_hash": content_hash("ditto"),
+        "embedding_model": MODEL,
+    }
+    assert not needs_embedding(document, content_hash("ditto"), MODEL)
+
+
+def test_changed_text_needs_embedding():
+    document = {
+        "has_embedding": True,
+        "embedding_hash": content_hash("ditto"),
+        "embedding_model": MODEL,
+    }
+    assert needs_embedding(document, content_hash("eevee"), MODEL)
+
+
+def test_other_model_needs_embedding():
+    document = {
+        "has_embedding": True,
+        "embedding_hash": content_hash("ditto"),
+        "embedding_model": "other-model",
+    }
+    assert needs_embedding(document, content_hash("ditto"), MODEL)
+
+
+def test_missing_embedding_needs_embedding():
+    document = {"embedding_hash": content_hash("ditto"), "embedding_model": MODEL}
+    assert needs_embedding(document, content_hash("ditto"), MODEL)
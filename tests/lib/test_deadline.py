@@ -0,0 +1,136 @@
+import asyncio
+
+from src.lib.deadline import (
+    DeadlineExceeded,
+    DeadlineMiddleware,
+    deadline_exceeded,
+    deadline_scope,
+    parse_timeout,
+    time_left,
+)
+
+
+def test_scope_narrows_the_deadline():
+    assert time_left() is None
+    with deadline_scope(10):
+        assert 9 < time_left() <= 10
+        with deadline_scope(1):
+            assert time_left() <= 1
+        with deadline_scope(100):
+            assert time_left() <= 10
+        with deadline_scope(None):
+            assert time_left() <= 10
+    assert time_left() is None
+
+
+def test_timeouts_count_as_exceeded_only_near_the_deadline():
+    try:
+        raise ValueError("wrapped") from DeadlineExceeded()
+    except ValueError as e:
+        assert deadline_exceeded(e)
+    assert not deadline_exceeded(asyncio.TimeoutError())
+    with deadline_scope(10):
+        assert not deadline_exceeded(asyncio.TimeoutError())
+    with deadline_scope(0.01):
+        assert deadline_exceeded(asyncio.TimeoutError())
+        assert not deadline_exceeded(ValueError())
+
+
+def test_invalid_timeouts_are_ignored():
+    assert parse_timeout("1.5") == 1.5
+    assert parse_timeout(2) == 2
+    assert parse_timeout("soon") is None
+    assert parse_timeout("-1") is None
+    assert parse_timeout(None) is None
+
+
+def test_header_timeout_is_capped():
+    middleware = DeadlineMiddleware(None, default=60, maximum=300)
+    assert middleware.request_timeout([]) == 60
+    assert middleware.request_timeout([(b"x-request-timeout", b"5")]) == 5
+    assert middleware.request_timeout([(b"x-request-timeout", b"900")]) == 300
+    assert DeadlineMiddleware(None).request_timeout([]) is None
+
+
+def run(app, timeout=1.0, disconnect_after=None):
+    messages = []
+    received = []
+
+    async def receive():
+        received.append(1)
+        if disconnect_after is not None:
+            await asyncio.sleep(disconnect_after)
+            return {"type": "http.disconnect"}
+        if len(received) == 1:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # The client stays connected
+        await asyncio.sleep(10)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "path": "/", "headers": []}
+    middleware = DeadlineMiddleware(app, default=timeout)
+    asyncio.run(middleware(scope, receive, send))
+    return messages
+
+
+def response(*chunks, delay=0.0, seen=None):
+    async def app(scope, receive, send):
+        await receive()
+        if seen is not None:
+            seen.append(time_left())
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if seen is not None:
+                seen.append("cancelled")
+            raise
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            if seen is not None:
+                seen.append(time_left())
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    return app
+
+
+def test_the_app_sees_the_deadline():
+    seen = []
+    messages = run(response(b"pikachu", seen=seen), timeout=5)
+    assert messages[0]["status"] == 200
+    assert 4 < seen[0] <= 5
+    # Lifted once the response started
+    assert seen[1] is None
+
+
+def test_late_requests_are_cancelled_with_a_504():
+    seen = []
+    messages = run(response(delay=1, seen=seen), timeout=0.05)
+    assert seen[-1] == "cancelled"
+    assert messages[0]["status"] == 504
+    assert b"A7" in messages[1]["body"]
+
+
+def test_started_responses_are_not_cut():
+    messages = run(response(b"a", b"b", delay=0.03), timeout=0.05)
+    assert messages[0]["status"] == 200
+    assert b"".join(m.get("body", b"") for m in messages[1:]) == b"ab"
+
+
+def test_disconnected_requests_are_cancelled():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append((await receive())["type"])
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            seen.append("cancelled")
+            raise
+
+    messages = run(app, timeout=5, disconnect_after=0.01)
+    assert seen == ["http.disconnect", "cancelled"]
+    assert messages == []
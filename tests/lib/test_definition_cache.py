@@ -0,0 +1,95 @@
+import asyncio
+from src.lib.definition_cache import DefinitionCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def make_loader(values):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return values[len(calls) - 1]
+
+    return loader, calls
+
+
+def test_fresh_entry_is_served_from_cache():
+    async def run():
+        cache = DefinitionCache(ttl=10, stale_ttl=0, maxsize=10, timer=FakeTimer())
+        loader, calls = make_loader(["first", "second"])
+        assert await cache.get("key", loader) == "first"
+        assert await cache.get("key", loader) == "first"
+        return calls
+
+    assert len(asyncio.run(run())) == 1
+
+
+def test_expired_entry_is_reloaded():
+    async def run():
+        timer = FakeTimer()
+        cache = DefinitionCache(ttl=10, stale_ttl=0, maxsize=10, timer=timer)
+        loader, _ = make_loader(["first", "second"])
+        await cache.get("key", loader)
+        timer.now = 11
+        return await cache.get("key", loader)
+
+    assert asyncio.run(run()) == "second"
+
+
+def test_stale_entry_is_served_while_revalidating():
+    async def run():
+        timer = FakeTimer()
+        cache = DefinitionCache(ttl=10, stale_ttl=10, maxsize=10, timer=timer)
+        loader, _ = make_loader(["first", "second"])
+        await cache.get("key", loader)
+        timer.now = 15
+        stale = await cache.get("key", loader)
+        await asyncio.sleep(0)
+        return stale, await cache.get("key", loader)
+
+    assert asyncio.run(run()) == ("first", "second")
+
+
+def test_least_recently_used_entry_is_evicted():
+    async def run():
+        cache = DefinitionCache(ttl=10, stale_ttl=0, maxsize=2, timer=FakeTimer())
+        for key in ["a", "b", "c"]:
+            await cache.get(key, make_loader([key])[0])
+        return cache
+
+    cache = asyncio.run(run())
+    assert "a" not in cache
+    assert "b" in cache and "c" in cache
+
+
+def test_uncacheable_values_are_not_stored():
+    async def run():
+        cache = DefinitionCache(
+            ttl=10,
+            stale_ttl=0,
+            maxsize=10,
+            should_cache=lambda value: value != "error",
+            timer=FakeTimer(),
+        )
+        await cache.get("key", make_loader(["error"])[0])
+        return cache
+
+    assert "key" not in asyncio.run(run())
+
+
+def test_invalidate_removes_entry():
+    async def run():
+        cache = DefinitionCache(ttl=10, stale_ttl=0, maxsize=10, timer=FakeTimer())
+        await cache.get("key", make_loader(["first"])[0])
+        return cache.invalidate("key"), cache
+
+    invalidated, cache = asyncio.run(run())
+    assert invalidated
+    assert "key" not in cache
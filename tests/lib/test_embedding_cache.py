@@ -0,0 +1,81 @@
+import asyncio
+
+from src.lib.embedding_cache import EmbeddingCache
+
+MODEL = "text-embedding-ada-002"
+
+
+def test_normalized_text_hits_cache():
+    async def run():
+        cache = EmbeddingCache(maxsize=10)
+        await cache.set(MODEL, "pokemon  types", [0.1, 0.2])
+        assert await cache.get(MODEL, " pokemon types\n") == [0.1, 0.2]
+        assert await cache.get("other-model", "pokemon types") is None
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    async def run():
+        cache = EmbeddingCache(maxsize=2)
+        await cache.set(MODEL, "ditto", [1.0])
+        await cache.set(MODEL, "eevee", [2.0])
+        await cache.get(MODEL, "ditto")
+        await cache.set(MODEL, "pikachu", [3.0])
+        return await cache.get(MODEL, "ditto"), await cache.get(MODEL, "eevee")
+
+    assert asyncio.run(run()) == ([1.0], None)
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+
+    async def run():
+        cache = EmbeddingCache(maxsize=10, path=path)
+        await cache.set(MODEL, "ditto", [0.25, -0.5])
+        cache.close()
+
+        restarted = EmbeddingCache(maxsize=10, path=path)
+        vector = await restarted.get(MODEL, "ditto")
+        stats = restarted.stats()
+        restarted.close()
+        return vector, stats
+
+    vector, stats = asyncio.run(run())
+    assert vector == [0.25, -0.5]
+    assert stats["disk_hits"] == 1
+
+
+def test_disk_tier_prunes_least_recently_used_in_batches(tmp_path):
+    cache = EmbeddingCache(
+        maxsize=1, path=str(tmp_path / "embeddings.sqlite"), disk_maxsize=100
+    )
+    statements = []
+    cache._db.set_trace_callback(statements.append)
+
+    async def run():
+        await cache.set(MODEL, "mew", [0.0])
+        sizes = []
+        for index in range(300):
+            # mew is pushed out of memory, so reading it from disk keeps it
+            # recently used there
+            await cache.set(MODEL, "ditto", [1.0])
+            await cache.get(MODEL, "mew")
+            await cache.set(MODEL, f"pokemon {index}", [float(index)])
+            sizes.append(cache._count())
+        return sizes, await cache.get(MODEL, "mew")
+
+    sizes, mew = asyncio.run(run())
+    assert max(sizes) <= 100
+    assert mew == [0.0]
+    deletes = [sql for sql in statements if sql.startswith("DELETE")]
+    # A tenth of the room is freed each time, not a row per write
+    assert 0 < len(deletes) <= 30
+    plan = cache._db.execute(
+        "EXPLAIN QUERY PLAN SELECT rowid FROM embeddings ORDER BY used_at LIMIT 1"
+    ).fetchall()
+    assert "embeddings_used_at" in str(plan)
+    cache.close()
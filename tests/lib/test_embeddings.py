@@ -0,0 +1,108 @@
+import asyncio
+
+from errors import CustomException
+from src.connections.embeddings import EmbeddingClient
+
+
+class WordClient(EmbeddingClient):
+    # The encoding of the model is downloaded on first use, words stand in for
+    # its tokens
+    def _prepare(self, texts: list):
+        return texts, [len(text.split()) for text in texts]
+
+
+class FakeHttpClient:
+    """
+    Answers every request with the next of `responses`, or with one embedding
+    per input when they run out. An exception in `responses` is raised.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def make_request(self, url, headers, method, body={}, params={}):
+        self.requests.append({"url": url, "headers": headers, "method": method, **body})
+        await asyncio.sleep(0)
+        if self.responses:
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        data = [
+            {"index": index, "embedding": [len(text)]}
+            for index, text in enumerate(body["input"])
+        ]
+        # The API doesn't promise to answer in input order
+        return {"status_code": 200, "body": {"data": data[::-1]}, "headers": {}}
+
+
+def client(http_client, api_key, **options) -> WordClient:
+    return WordClient(http_client, api_key, url="http://embeddings", backoff=0, **options)
+
+
+def test_request_shape_and_order_of_embeddings():
+    http_client = FakeHttpClient()
+    embeddings = asyncio.run(
+        client(http_client, "shape", model="small").embed(["pikachu", "ditto"])
+    )
+    assert embeddings == [[7], [5]]
+    assert http_client.requests == [
+        {
+            "url": "http://embeddings",
+            "headers": {
+                "Content-Type": "application/json",
+                "Authorization": "Bearer shape",
+            },
+            "method": "POST",
+            "input": ["pikachu", "ditto"],
+            "model": "small",
+        }
+    ]
+
+
+def test_texts_are_sent_in_batches():
+    http_client = FakeHttpClient()
+    texts = ["a", "b c", "d", "e f g", "h"]
+    embeddings = asyncio.run(
+        client(http_client, "batches", max_batch_items=2, max_batch_tokens=3).embed(texts)
+    )
+    assert embeddings == [[len(text)] for text in texts]
+    assert len(http_client.requests) > 2
+    for request in http_client.requests:
+        assert len(request["input"]) <= 2
+        assert sum(len(text.split()) for text in request["input"]) <= 3
+    sent = sorted(text for request in http_client.requests for text in request["input"])
+    assert sent == sorted(texts)
+
+
+def test_rate_limited_and_failed_requests_are_retried():
+    http_client = FakeHttpClient(
+        {"status_code": 429, "body": "slow down", "headers": {"Retry-After": "0"}},
+        CustomException(503, "A0", "connection refused"),
+        {"status_code": 503, "body": "unavailable", "headers": {}},
+    )
+    embeddings = asyncio.run(client(http_client, "retries").embed(["mew"]))
+    assert embeddings == [[3]]
+    assert len(http_client.requests) == 4
+
+
+def test_errors_are_raised_with_the_status_of_the_api():
+    async def run(http_client, **options):
+        try:
+            await client(http_client, "errors", **options).embed(["mew"])
+        except CustomException as e:
+            return e.status_code, e.description
+
+    bad_request = FakeHttpClient({"status_code": 400, "body": "bad input", "headers": {}})
+    assert asyncio.run(run(bad_request)) == (
+        400,
+        "Error creating embeddings: bad input",
+    )
+    assert len(bad_request.requests) == 1
+
+    unavailable = FakeHttpClient(
+        *[{"status_code": 503, "body": "down", "headers": {}}] * 2
+    )
+    assert asyncio.run(run(unavailable, max_retries=1))[0] == 503
+    assert len(unavailable.requests) == 2
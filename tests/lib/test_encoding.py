@@ -0,0 +1,48 @@
+import datetime
+import json
+
+from bson import Binary, Decimal128, ObjectId
+
+from src.lib.encoding import dumps
+
+OID = ObjectId("66a0f1c2b3d4e5f6a7b8c9d0")
+
+
+def test_nested_bson_values_are_converted():
+    document = {
+        "_id": OID,
+        "price": Decimal128("10.5"),
+        "stock": Decimal128("3"),
+        "owner": {"ref": OID, "tags": [OID, {"deep": Decimal128("1.25")}]},
+        "created_at": datetime.datetime(2024, 7, 1, 12, 30),
+        "data": Binary(b"pokemon"),
+    }
+    assert json.loads(dumps({"body": [document]})) == {
+        "body": [
+            {
+                "_id": "ObjectId('66a0f1c2b3d4e5f6a7b8c9d0')",
+                "price": 10.5,
+                "stock": 3,
+                "owner": {
+                    "ref": "ObjectId('66a0f1c2b3d4e5f6a7b8c9d0')",
+                    "tags": ["ObjectId('66a0f1c2b3d4e5f6a7b8c9d0')", {"deep": 1.25}],
+                },
+                "created_at": "2024-07-01T12:30:00",
+                "data": "cG9rZW1vbg==",
+            }
+        ]
+    }
+
+
+def test_top_level_values_are_converted():
+    assert json.loads(dumps(OID)) == "ObjectId('66a0f1c2b3d4e5f6a7b8c9d0')"
+    assert json.loads(dumps([OID, OID])) == ["ObjectId('66a0f1c2b3d4e5f6a7b8c9d0')"] * 2
+
+
+def test_non_finite_decimals_are_encoded_as_null():
+    document = {
+        "a": Decimal128("NaN"),
+        "b": Decimal128("Infinity"),
+        "c": Decimal128("-Infinity"),
+    }
+    assert json.loads(dumps(document)) == {"a": None, "b": None, "c": None}
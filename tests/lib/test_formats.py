@@ -0,0 +1,64 @@
+import datetime
+import json
+
+import msgpack
+from bson import ObjectId
+
+from src.lib.formats import (
+    COLUMNS_JSON,
+    COLUMNS_MSGPACK,
+    ROWS_JSON,
+    ROWS_MSGPACK,
+    negotiate_format,
+    render,
+    to_columns,
+)
+
+
+def test_negotiate_format():
+    assert negotiate_format(None) == ROWS_JSON
+    assert negotiate_format("*/*") == ROWS_JSON
+    assert negotiate_format(COLUMNS_JSON) == COLUMNS_JSON
+    assert negotiate_format(f"{ROWS_JSON};q=0.5, {COLUMNS_JSON}") == COLUMNS_JSON
+    assert negotiate_format("text/csv") == ROWS_JSON
+
+
+def test_to_columns_fills_missing_fields():
+    rows = [{"a": 1, "b": 2}, {"a": 3}, {"c": 4}]
+    assert to_columns(rows) == {
+        "a": [1, 3, None],
+        "b": [2, None, None],
+        "c": [None, None, 4],
+    }
+
+
+def test_to_columns_keeps_scalar_lists():
+    assert to_columns([1, 2, 3]) == [1, 2, 3]
+
+
+def test_render_columns_json():
+    oid = ObjectId("66a0f1c2b3d4e5f6a7b8c9d0")
+    response = render({"body": [{"_id": oid, "n": 1}]}, COLUMNS_JSON)
+    assert response.media_type == COLUMNS_JSON
+    assert json.loads(response.body) == {
+        "body": {"_id": ["ObjectId('66a0f1c2b3d4e5f6a7b8c9d0')"], "n": [1]}
+    }
+
+
+def test_render_msgpack():
+    assert negotiate_format("application/x-msgpack") == ROWS_MSGPACK
+    response = render({"body": [{"n": 1}, {"n": 2}]}, COLUMNS_MSGPACK)
+    assert response.media_type == COLUMNS_MSGPACK
+    assert msgpack.unpackb(response.body) == {"body": {"n": [1, 2]}}
+
+
+def test_render_msgpack_rows_with_bson_values():
+    oid = ObjectId("66a0f1c2b3d4e5f6a7b8c9d0")
+    document = {"_id": oid, "at": datetime.datetime(2024, 7, 1, 12, 30)}
+    response = render({"body": [document]}, negotiate_format(ROWS_MSGPACK))
+    assert response.media_type == ROWS_MSGPACK
+    assert msgpack.unpackb(response.body) == {
+        "body": [
+            {"_id": "ObjectId('66a0f1c2b3d4e5f6a7b8c9d0')", "at": "2024-07-01T12:30:00"}
+        ]
+    }
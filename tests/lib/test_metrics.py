@@ -0,0 +1,56 @@
+from src.lib.metrics import Registry
+
+
+def test_counter_renders_labels():
+    registry = Registry(prefix="test_")
+    counter = registry.counter("calls_total", "Calls", ("status",))
+    counter.inc(status=200)
+    counter.inc(2, status=200)
+    counter.inc(status='say "hi"')
+    text = registry.render()
+    assert "# TYPE test_calls_total counter" in text
+    assert 'test_calls_total{status="200"} 3' in text
+    assert 'test_calls_total{status="say \\"hi\\""} 1' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("latency", "Latency", ("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, stage="bind")
+    histogram.observe(0.5, stage="bind")
+    histogram.observe(5, stage="bind")
+    text = registry.render()
+    assert 'latency_bucket{stage="bind",le="0.1"} 1' in text
+    assert 'latency_bucket{stage="bind",le="1"} 2' in text
+    assert 'latency_bucket{stage="bind",le="+Inf"} 3' in text
+    assert 'latency_count{stage="bind"} 3' in text
+    assert 'latency_sum{stage="bind"} 5.55' in text
+
+
+def test_gauge_tracks_in_flight():
+    registry = Registry()
+    gauge = registry.gauge("in_flight", "In flight", ("type",))
+    with gauge.track(type="MONGO"):
+        assert gauge.get(type="MONGO") == 1
+    assert gauge.get(type="MONGO") == 0
+
+
+def test_collectors_export_numeric_stats():
+    registry = Registry(prefix="test_")
+    registry.add_collector("cache", "Cache", lambda: {"hits": 3, "ratio": None})
+    text = registry.render()
+    assert "test_cache_hits 3" in text
+    assert "ratio" not in text
+
+
+def test_constant_labels_are_added_to_every_sample():
+    registry = Registry()
+    registry.counter("calls_total", "Calls", ("status",)).inc(status=200)
+    registry.histogram("latency", "Latency", buckets=(1,)).observe(0.5)
+    registry.add_collector("cache", "Cache", lambda: {"hits": 3})
+    registry.set_labels(worker=42)
+    text = registry.render()
+    assert 'calls_total{status="200",worker="42"} 1' in text
+    assert 'latency_bucket{worker="42",le="1"} 1' in text
+    assert 'latency_count{worker="42"} 1' in text
+    assert 'cache_hits{worker="42"} 3' in text
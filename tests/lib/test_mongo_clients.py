@@ -0,0 +1,88 @@
+from src.connections.mongo_clients import MongoClientManager
+
+
+class FakeClient:
+    def __init__(self, connection_string, **options):
+        self.connection_string = connection_string
+        self.options = options
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_clients_are_reused_with_pool_options():
+    manager = MongoClientManager(
+        max_pool_size=10, min_pool_size=2, client_factory=FakeClient
+    )
+    with manager.client("mongodb://a") as first:
+        pass
+    with manager.client("mongodb://a") as second:
+        pass
+    assert first is second
+    assert first.options["maxPoolSize"] == 10
+    assert first.options["minPoolSize"] == 2
+    assert manager.stats()["hits"] == 1
+
+
+def test_evicted_clients_are_closed():
+    manager = MongoClientManager(capacity=1, client_factory=FakeClient)
+    with manager.client("mongodb://a") as first:
+        pass
+    with manager.client("mongodb://b"):
+        pass
+    assert first.closed
+    assert len(manager) == 1
+
+
+def test_clients_in_use_are_closed_after_release():
+    manager = MongoClientManager(capacity=1, client_factory=FakeClient)
+    first = manager.acquire("mongodb://a")
+    with manager.client("mongodb://b"):
+        pass
+    assert not first.closed
+    manager.release(first)
+    assert first.closed
+
+
+def test_idle_clients_expire():
+    timer = FakeTimer()
+    manager = MongoClientManager(idle_timeout=10, client_factory=FakeClient, timer=timer)
+    with manager.client("mongodb://a") as first:
+        pass
+    timer.now = 11
+    with manager.client("mongodb://b"):
+        pass
+    assert first.closed
+    assert manager.stats()["expirations"] == 1
+
+
+def test_clients_are_built_outside_the_lock():
+    built = []
+
+    def factory(connection_string, **options):
+        client = FakeClient(connection_string, **options)
+        built.append(client)
+        # Another lookup of the same string while the first client is built
+        if len(built) == 1:
+            assert not manager._lock.locked()
+            with manager.client(connection_string) as other:
+                assert other is built[1]
+        return client
+
+    manager = MongoClientManager(client_factory=factory)
+    with manager.client("mongodb://a") as client:
+        pass
+    # The client inserted first is kept, the other one is closed
+    assert client is built[1]
+    assert built[0].closed and not built[1].closed
+    assert len(manager) == 1
+    assert manager.stats()["misses"] == 1
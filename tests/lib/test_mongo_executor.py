@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import pytest
+from pymongo import _csot
+
+from errors import CustomException
+from lib.deadline import DeadlineExceeded, deadline_scope
+from src.connections.mongo_executor import MongoExecutor
+
+
+def run(executor, fn, timeout=None):
+    async def call():
+        with deadline_scope(timeout):
+            return await executor.run(fn)
+
+    return asyncio.run(call())
+
+
+def test_calls_run_in_a_thread_with_the_deadline_as_pymongo_timeout():
+    executor = MongoExecutor(max_workers=1, max_pending=1)
+    thread, timeout = run(
+        executor, lambda: (threading.current_thread().name, _csot.get_timeout()), 5
+    )
+    assert thread.startswith("mongo")
+    assert 4 < timeout <= 5
+    assert run(executor, _csot.get_timeout) is None
+    assert executor.stats()["completed"] == 2
+
+
+def test_expired_deadlines_are_not_run():
+    calls = []
+    executor = MongoExecutor(max_workers=1, max_pending=1)
+
+    async def call():
+        with deadline_scope(0.01):
+            await asyncio.sleep(0.02)
+            return await executor.run(lambda: calls.append(1))
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(call())
+    assert calls == []
+
+
+def test_errors_are_counted_as_failed():
+    def fail():
+        raise ValueError("bad pipeline")
+
+    executor = MongoExecutor(max_workers=1, max_pending=1)
+    with pytest.raises(ValueError):
+        run(executor, fail)
+    assert executor.stats()["failed"] == 1
+
+
+def test_executor_starts_again_after_shutdown():
+    executor = MongoExecutor(max_workers=1, max_pending=1)
+
+    async def stopped():
+        try:
+            await executor.run(lambda: "ditto")
+        except CustomException as e:
+            return e.status_code
+
+    assert run(executor, lambda: "pikachu") == "pikachu"
+    asyncio.run(executor.shutdown())
+    assert asyncio.run(stopped()) == 500
+    executor.start()
+    assert run(executor, lambda: "ditto") == "ditto"
+    asyncio.run(executor.shutdown())
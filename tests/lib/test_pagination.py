@@ -0,0 +1,155 @@
+import pytest
+from bson import ObjectId
+from src.lib.pagination import (
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+    paginate_find,
+    paginate_pipeline,
+    split_page,
+)
+
+ID = ObjectId("5f6c6f6e6e656374696f6f6e")
+
+
+def test_cursor_round_trip_keeps_bson_types():
+    token = encode_cursor({"_id": ID, "price": 10}, "price", "asc")
+    cursor = decode_cursor(token, "price", "asc")
+    assert cursor["v"] == 10
+    assert cursor["i"] == ID
+
+
+def test_cursor_for_a_different_sort_is_rejected():
+    token = encode_cursor({"_id": ID, "price": 10}, "price", "asc")
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token, "price", "desc")
+
+
+def test_garbage_cursor_is_rejected():
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not-a-cursor", "_id", "asc")
+
+
+def test_first_page_of_find_only_sorts_and_limits():
+    filter_body, sort, limit = paginate_find({"a": 1}, 10, "_id", "asc", None)
+    assert filter_body == {"a": 1}
+    assert sort == [("_id", 1)]
+    assert limit == 11
+
+
+def test_next_page_of_find_breaks_ties_with_id():
+    token = encode_cursor({"_id": ID, "price": 10}, "price", "desc")
+    filter_body, sort, _ = paginate_find({"a": 1}, 10, "price", "desc", token)
+    assert filter_body == {
+        "$and": [
+            {"a": 1},
+            {
+                "$or": [
+                    {"price": {"$lt": 10}},
+                    {"price": 10, "_id": {"$lt": ID}},
+                    {"price": {"$type": ["minKey"]}},
+                    {"price": None},
+                ]
+            },
+        ]
+    }
+    assert sort == [("price", -1), ("_id", -1)]
+
+
+def test_pipeline_pagination_matches_the_cursor_as_early_as_possible():
+    token = encode_cursor({"_id": ID}, "_id", "asc")
+    pipeline = [{"$match": {"a": 1}}, {"$set": {"b": 2}}]
+    assert paginate_pipeline(pipeline, 5, "_id", "asc", token) == [
+        {"$match": {"_id": {"$gt": ID}}},
+        {"$match": {"a": 1}},
+        {"$set": {"b": 2}},
+        {"$sort": {"_id": 1}},
+        {"$limit": 6},
+    ]
+    assert pipeline == [{"$match": {"a": 1}}, {"$set": {"b": 2}}]
+
+
+def test_pipeline_pagination_keeps_the_cursor_after_stages_changing_the_sort_key():
+    token = encode_cursor({"_id": ID}, "_id", "asc")
+    pipeline = [{"$group": {"_id": "$a"}}, {"$lookup": {"from": "b", "as": "_id"}}]
+    stages = paginate_pipeline(pipeline, 5, "_id", "asc", token)
+    assert stages[2] == {"$match": {"_id": {"$gt": ID}}}
+
+
+def test_split_page_returns_next_cursor_only_when_there_are_more_documents():
+    documents = [{"_id": i} for i in range(3)]
+    assert split_page(documents, 3, "_id", "asc") == (documents, None)
+    page, token = split_page(documents, 2, "_id", "asc")
+    assert page == documents[:2]
+    assert decode_cursor(token, "_id", "asc")["i"] == 1
+
+
+def rank(value) -> int:
+    # Sort order of the types used below: null, numbers, strings
+    return {type(None): 1, int: 2, float: 2, str: 3}[type(value)]
+
+
+TYPE_RANKS = {"number": 2, "string": 3}
+
+
+def matches(document: dict, condition: dict) -> bool:
+    # Enough of MongoDB's query semantics to run the keyset conditions
+    for key, expected in condition.items():
+        if key == "$or":
+            if not any(matches(document, branch) for branch in expected):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(document, branch) for branch in expected):
+                return False
+            continue
+        value = document.get(key)
+        if not isinstance(expected, dict):
+            # A null also matches a missing field
+            if rank(value) != rank(expected) or value != expected:
+                return False
+            continue
+        for operator, argument in expected.items():
+            if operator == "$type":
+                types = [TYPE_RANKS.get(alias) for alias in argument]
+                if key not in document or rank(value) not in types:
+                    return False
+            elif argument is None or value is None or rank(value) != rank(argument):
+                # Comparisons only match values of the same type
+                return False
+            elif operator == "$gt" and not value > argument:
+                return False
+            elif operator == "$lt" and not value < argument:
+                return False
+    return True
+
+
+def walk(documents: list, sort_order: str, page_size: int = 3) -> list:
+    def sort_value(document):
+        value = document.get("v")
+        return (rank(value), 0 if value is None else value, document["_id"])
+
+    ids, token = [], None
+    while True:
+        condition, _, limit = paginate_find({}, page_size, "v", sort_order, token)
+        found = [document for document in documents if matches(document, condition)]
+        found.sort(key=sort_value, reverse=sort_order == "desc")
+        page, token = split_page(found[:limit], page_size, "v", sort_order)
+        ids.extend(document["_id"] for document in page)
+        if token is None:
+            return ids
+
+
+def test_pagination_goes_through_null_missing_and_mixed_sort_values():
+    values = [None, 1, 2, None, 4, 5, None, 7, 8, None, "a", 3.5]
+    documents = [{"_id": i, "v": value} for i, value in enumerate(values)]
+    documents += [{"_id": 20}, {"_id": 21}]
+    ascending = walk(documents, "asc")
+    assert ascending == [0, 3, 6, 9, 20, 21, 1, 2, 11, 4, 5, 7, 8, 10]
+    assert walk(documents, "desc") == ascending[::-1]
+
+
+def test_array_sort_values_are_rejected():
+    documents = [{"_id": i, "v": [i]} for i in range(3)]
+    with pytest.raises(InvalidCursor):
+        split_page(documents, 2, "v", "asc")
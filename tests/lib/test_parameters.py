@@ -1,4 +1,4 @@
-from src.lib.parameters import replace_parameters
+from src.lib.parameters import replace_parameters, compile_template, TemplateCache
 
 
 def test_replace_string_parameters_on_string():
@@ -76,3 +76,65 @@ def test_mixed_parameters_on_nested_dicts():
         "is_cool": True,
         "moves": ["transform", "struggle"],
     }
+
+
+def test_compiled_template_matches_replace_parameters():
+    parameters = {
+        "name": "ditto",
+        "type": "normal",
+        "number": 25,
+        "ratio": 0.5,
+        "some_key": "key",
+        "some_dict": {"key": "value"},
+        "is_cool": True,
+        "number_in_string": "25",
+    }
+    template = {
+        "{{name}}": {
+            "type": "{{type}}",
+            "health": "{{number}}",
+            "ratio": "{{ratio}}",
+            "health_in_string": "something/{{number}}",
+            "{{some_key}}": "{{some_dict}}",
+            "from_string": "{{number_in_string}}",
+        },
+        "is_cool": "{{is_cool}}",
+        "static": ["[1, 2]", "plain", 3, None],
+    }
+    value, _, _ = compile_template(template).bind(parameters)
+    assert value == replace_parameters(template, parameters)
+
+
+def test_compiled_template_reports_used_and_missing_parameters():
+    parameters = {"name": "ditto", "unused": 1}
+    template = {"path": "pokemon/{{name}}/{{type}}"}
+    value, used, missing = compile_template(template).bind(parameters)
+    assert value == {"path": "pokemon/ditto/{{type}}"}
+    assert used == {"name"}
+    assert missing == {"type"}
+
+
+def test_compiled_template_static_values_are_not_shared():
+    template = compile_template({"pipeline": "[{'$match': {}}]"})
+    first, _, _ = template.bind({})
+    first["pipeline"].append({"$limit": 1})
+    second, _, _ = template.bind({})
+    assert second == {"pipeline": [{"$match": {}}]}
+
+
+def test_template_cache_reuses_template_for_same_sources():
+    cache = TemplateCache(maxsize=10)
+    filter_body = {"name": "{{name}}"}
+    update_body = {}
+    assert cache.get(filter_body, update_body) is cache.get(filter_body, update_body)
+    assert cache.get(filter_body, {"n": 1}) is not cache.get(filter_body, {"n": "1"})
+
+
+def test_template_cache_reuses_templates_of_new_objects_with_the_same_content():
+    cache = TemplateCache(maxsize=10)
+    path = "/pokemon/{{name}}"
+    # Definitions without a body or headers get new empty dicts on every call
+    template = cache.get(path, {}, {})
+    assert cache.get(path, {}, {}) is template
+    assert cache.get("/pokemon/{{name}}", dict(), dict()) is template
+    assert cache.stats()["templates"] == 1
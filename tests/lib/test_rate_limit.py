@@ -0,0 +1,31 @@
+import asyncio
+from src.lib.rate_limit import TokenRateLimiter
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_acquire_within_quota_does_not_wait():
+    limiter = TokenRateLimiter(tokens_per_minute=600, timer=FakeTimer())
+    asyncio.run(limiter.acquire(600))
+    assert limiter.tokens == 0
+
+
+def test_tokens_are_refilled_over_time():
+    timer = FakeTimer()
+    limiter = TokenRateLimiter(tokens_per_minute=600, timer=timer)
+    asyncio.run(limiter.acquire(600))
+    timer.now = 30
+    limiter._refill()
+    assert limiter.tokens == 300
+
+
+def test_penalize_empties_the_bucket():
+    limiter = TokenRateLimiter(tokens_per_minute=600, timer=FakeTimer())
+    limiter.penalize(2)
+    assert limiter.tokens == -20
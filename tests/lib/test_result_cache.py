@@ -0,0 +1,61 @@
+from src.lib.result_cache import ResultCache, result_key
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_result_key_ignores_parameter_order():
+    assert result_key("q1", {"a": 1, "b": 2}) == result_key("q1", {"b": 2, "a": 1})
+    assert result_key("q1", {"a": 1}) != result_key("q2", {"a": 1})
+
+
+def test_entries_expire_after_ttl():
+    timer = FakeTimer()
+    cache = ResultCache(max_bytes=10000, timer=timer)
+    cache.set("key", {"body": [1, 2]}, ttl=10)
+    assert cache.get("key") == {"body": [1, 2]}
+    timer.now = 11
+    assert cache.get("key") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cached_values_are_copies():
+    cache = ResultCache(max_bytes=10000)
+    cache.set("key", {"body": [1]}, ttl=10)
+    cache.get("key")["body"].append(2)
+    assert cache.get("key") == {"body": [1]}
+
+
+def test_large_values_are_compressed():
+    cache = ResultCache(max_bytes=100000, compress_threshold=100)
+    value = {"body": ["pokemon"] * 1000}
+    cache.set("key", value, ttl=10)
+    assert cache.size < 1000
+    assert cache.get("key") == value
+
+
+def test_least_recently_used_is_evicted_over_max_bytes():
+    cache = ResultCache(max_bytes=200)
+    cache.set("a", "x" * 80, ttl=10)
+    cache.set("b", "y" * 80, ttl=10)
+    cache.get("a")
+    cache.set("c", "z" * 80, ttl=10)
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.size <= 200
+
+
+def test_invalidate_by_tag():
+    cache = ResultCache(max_bytes=10000)
+    cache.set("a", 1, ttl=10, tags=("query:q1", "connection:c1"))
+    cache.set("b", 2, ttl=10, tags=("query:q2", "connection:c1"))
+    cache.set("c", 3, ttl=10, tags=("query:q3", "connection:c2"))
+    assert cache.invalidate("query:q1") == 1
+    assert cache.invalidate("connection:c1") == 1
+    assert len(cache) == 1
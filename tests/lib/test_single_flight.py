@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from src.lib.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "pokemon"
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        return results, flight
+
+    results, flight = asyncio.run(run())
+    assert results == ["pokemon"] * 5
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 4
+    assert len(flight) == 0
+
+
+def test_errors_reach_every_waiter():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(
+            flight.do("key", fetch), flight.do("key", fetch), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_call_survives_while_a_waiter_remains():
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "ditto"
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("key", fetch))
+        second = asyncio.create_task(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "ditto"
+
+
+def test_call_is_cancelled_when_all_waiters_leave():
+    cancelled = []
+
+    async def fetch():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def run():
+        flight = SingleFlight()
+        waiter = asyncio.create_task(flight.do("key", fetch))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        return flight
+
+    flight = asyncio.run(run())
+    assert cancelled == [1]
+    assert len(flight) == 0
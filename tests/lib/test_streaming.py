@@ -0,0 +1,46 @@
+import asyncio
+import json
+from src.lib.streaming import get_stream_format, encode_stream, NDJSON, JSON, RAW
+
+
+async def batches():
+    yield [{"a": 1}, {"a": 2}]
+    yield []
+    yield [{"a": 3}]
+
+
+def collect(stream_format):
+    async def run():
+        return b"".join(
+            [chunk async for chunk in encode_stream(batches(), stream_format)]
+        )
+
+    return asyncio.run(run())
+
+
+def test_stream_flag_takes_precedence_over_accept_header():
+    assert get_stream_format("application/x-ndjson", "json") == JSON
+    assert get_stream_format("application/json", "ndjson") == NDJSON
+
+
+def test_ndjson_accept_header_enables_streaming():
+    assert get_stream_format("text/html, application/x-ndjson;q=0.9") == NDJSON
+
+
+def test_regular_requests_are_not_streamed():
+    assert get_stream_format("application/json") is None
+    assert get_stream_format(None, None) is None
+
+
+def test_ndjson_stream_has_one_document_per_line():
+    lines = collect(NDJSON).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [{"a": 1}, {"a": 2}, {"a": 3}]
+
+
+def test_json_stream_keeps_body_envelope():
+    assert json.loads(collect(JSON)) == {"body": [{"a": 1}, {"a": 2}, {"a": 3}]}
+
+
+def test_raw_flag_requests_passthrough():
+    assert get_stream_format("application/json", "raw") == RAW
+    assert get_stream_format(None, "passthrough") == RAW
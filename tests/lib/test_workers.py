@@ -0,0 +1,14 @@
+import os
+
+from src.lib.workers import per_worker, worker_count
+
+
+def test_worker_count_defaults_to_cpus():
+    assert worker_count(4) == 4
+    assert worker_count(0) == (os.cpu_count() or 1)
+
+
+def test_per_worker_splits_limits():
+    assert per_worker(100, 4) == 25
+    assert per_worker(3, 4) == 1
+    assert per_worker(0, 4, minimum=0) == 0
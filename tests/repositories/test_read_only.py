@@ -0,0 +1,30 @@
+from src.models.query import MongoQuery
+from src.repositories.query import is_read_only
+
+
+def mongo_query(method: str, filter_body) -> MongoQuery:
+    return MongoQuery(
+        type="MONGO",
+        credentials={"main_url": "mongodb://db"},
+        variables={},
+        parameters={},
+        method=method,
+        collection="pokemon",
+        filter_body=filter_body,
+        update_body={},
+    )
+
+
+def test_aggregations_are_read_only_unless_they_write_their_output():
+    match = {"$match": {"type": "{{type}}"}}
+    assert is_read_only(mongo_query("aggregate", [match, {"$sort": {"name": 1}}]))
+    assert not is_read_only(mongo_query("aggregate", [match, {"$out": "fire_pokemon"}]))
+    assert not is_read_only(
+        mongo_query("aggregate", [match, {"$merge": {"into": "fire_pokemon"}}])
+    )
+    assert not is_read_only(mongo_query("aggregate", '[{"$out": "fire_pokemon"}]'))
+
+
+def test_write_methods_are_not_read_only():
+    assert is_read_only(mongo_query("find", {"$out": "not a stage"}))
+    assert not is_read_only(mongo_query("updateMany", {}))
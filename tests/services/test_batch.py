@@ -0,0 +1,135 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.exceptions import RequestValidationError
+from fastapi.testclient import TestClient
+
+from src.configs.settings import settings
+from src.errors import CustomException, handle_custom_exception, handle_validation_error
+from src.repositories.query import QueryRepository
+from src.routers.adapter import AdapterRouter, get_query_service
+from src.schemas.query import BatchQuery
+from src.services.query import QueryService
+
+NOT_FOUND = {
+    "status_code": 404,
+    "body": {"error": {"code": "A5", "description": "Query not found"}},
+}
+
+
+def definition(path: str) -> dict:
+    return {
+        "status_code": 200,
+        "body": {
+            "connection": {"id": "pokeapi", "type": "REST", "credentials": {}},
+            "metadata": {"method": "GET", "path": path, "headers": {}, "body": {}},
+        },
+    }
+
+
+class FakeRepository(QueryRepository):
+    """
+    Serves the definitions of `queries` and answers each execution with its
+    parameters after `delay` seconds, so they complete out of order.
+    """
+
+    def __init__(self, queries: dict):
+        super().__init__(url="http://dashboards", version="1", http_client=None)
+        self.queries = queries
+        self.fetched = []
+
+    async def get_by_id(self, query_id: str, cached: bool = True):
+        self.fetched.append(query_id)
+        return self.queries.get(query_id, NOT_FOUND)
+
+    async def execute_query(self, query):
+        await asyncio.sleep(query.parameters.get("delay", 0))
+        return {"status_code": 200, "body": {"path": query.path, **query.parameters}}
+
+
+def fake_repository() -> FakeRepository:
+    return FakeRepository(
+        {"pikachu": definition("/pikachu"), "ditto": definition("/ditto")}
+    )
+
+
+def batch(*items) -> list:
+    return [
+        BatchQuery(query_id=query_id, parameters=parameters)
+        for query_id, parameters in items
+    ]
+
+
+async def collect(service: QueryService, queries: list) -> list:
+    return [result async for result in service.execute_batch(queries, concurrency=8)]
+
+
+def test_results_are_yielded_as_they_complete():
+    service = QueryService(fake_repository())
+    queries = batch(("pikachu", {"delay": 0.05}), ("ditto", {"delay": 0}))
+    results = asyncio.run(collect(service, queries))
+    assert [result["index"] for result in results] == [1, 0]
+    assert results[1]["result"]["body"] == {"path": "/pikachu", "delay": 0.05}
+
+
+def test_definitions_are_fetched_once_per_query():
+    repository = fake_repository()
+    queries = batch(
+        ("pikachu", {"n": 1}), ("ditto", {"n": 2}), ("pikachu", {"n": 3}), ("ditto", {})
+    )
+    results = asyncio.run(collect(QueryService(repository), queries))
+    assert sorted(repository.fetched) == ["ditto", "pikachu"]
+    assert all(result["status_code"] == 200 for result in results)
+
+
+def test_failed_queries_get_an_error_of_their_own():
+    service = QueryService(fake_repository())
+    queries = batch(("pikachu", {}), ("missingno", {}), ("ditto", {}))
+    results = {
+        result["index"]: result for result in asyncio.run(collect(service, queries))
+    }
+    assert results[1] == {
+        "index": 1,
+        "query_id": "missingno",
+        "status_code": 404,
+        "error": {"code": "A5", "description": "Query not found"},
+    }
+    assert results[0]["status_code"] == results[2]["status_code"] == 200
+
+
+def client(repository: FakeRepository) -> TestClient:
+    app = FastAPI()
+    app.include_router(AdapterRouter)
+    app.add_exception_handler(RequestValidationError, handle_validation_error)
+    app.add_exception_handler(CustomException, handle_custom_exception)
+    app.dependency_overrides[get_query_service] = lambda: QueryService(repository)
+    return TestClient(app)
+
+
+def test_batch_route_answers_in_request_order():
+    queries = [
+        {"query_id": "pikachu", "parameters": {"delay": 0.05}},
+        {"query_id": "missingno", "parameters": {}},
+        {"query_id": "ditto", "parameters": {"delay": 0}},
+    ]
+    response = client(fake_repository()).post(
+        "/v1/adapter/execute:batch", json={"queries": queries}
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["query_id"] for result in results] == ["pikachu", "missingno", "ditto"]
+    assert [result["status_code"] for result in results] == [200, 404, 200]
+    assert results[2]["result"]["body"] == {"path": "/ditto", "delay": 0}
+
+
+def test_batch_route_rejects_too_many_queries():
+    repository = fake_repository()
+    queries = [{"query_id": "pikachu", "parameters": {}}] * (
+        settings.BATCH_MAX_QUERIES + 1
+    )
+    response = client(repository).post(
+        "/v1/adapter/execute:batch", json={"queries": queries}
+    )
+    assert response.status_code == 400
+    assert response.json()["error"]["code"] == "A1"
+    assert repository.fetched == []
@@ -0,0 +1,103 @@
+import asyncio
+
+from configs.settings import settings
+from lib.deadline import deadline_scope, time_left
+from src.lib.single_flight import SingleFlight
+from src.models.query import ApiQuery
+from src.repositories.query import QueryRepository
+from src.services.query import QueryService
+
+
+class SlowRepository(QueryRepository):
+    """
+    Answers every execution after `delay` seconds and records the time left
+    before the deadline the call saw.
+    """
+
+    def __init__(self, delay: float):
+        super().__init__(url="http://dashboards", version="1", http_client=None)
+        self.delay = delay
+        self.seen = []
+
+    async def execute_query(self, query):
+        self.seen.append(time_left())
+        await asyncio.sleep(self.delay)
+        return {"status_code": 200, "body": {"name": "snorlax"}}
+
+
+def api_query(timeout: float = None) -> ApiQuery:
+    query = ApiQuery(
+        type="REST",
+        credentials={"url": "https://pokeapi.co"},
+        variables={},
+        method="GET",
+        parameters={},
+        path="/pokemon/snorlax",
+        headers={},
+        body={},
+    )
+    query.timeout = timeout
+    return query
+
+
+async def execute(service: QueryService, timeout: float = None):
+    with deadline_scope(timeout):
+        return await service.coalesce(api_query(), "snorlax")
+
+
+def test_waiters_are_not_bound_by_the_first_deadline(monkeypatch):
+    monkeypatch.setattr(settings, "REQUEST_MAX_TIMEOUT", 5)
+    repository = SlowRepository(delay=0.1)
+    service = QueryService(repository, SingleFlight())
+
+    async def run():
+        return await asyncio.gather(
+            execute(service, timeout=0.02), execute(service), return_exceptions=True
+        )
+
+    first, second = asyncio.run(run())
+    assert first.status_code == 504
+    assert second == {"status_code": 200, "body": {"name": "snorlax"}}
+    # One shared call, bound by the longest deadline instead of the first one
+    assert len(repository.seen) == 1
+    assert 4 < repository.seen[0] <= 5
+
+
+def test_shared_calls_fall_back_to_the_default_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "REQUEST_MAX_TIMEOUT", None)
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT", 3)
+    repository = SlowRepository(delay=0)
+    service = QueryService(repository, SingleFlight())
+
+    assert asyncio.run(execute(service))["status_code"] == 200
+    assert 2 < repository.seen[0] <= 3
+
+
+def test_shared_calls_keep_the_timeout_of_the_query():
+    repository = SlowRepository(delay=0)
+    service = QueryService(repository, SingleFlight())
+
+    async def run():
+        with deadline_scope(0.5):
+            query = api_query(timeout=5)
+            return await service.coalesce(query, "snorlax")
+
+    assert asyncio.run(run())["status_code"] == 200
+    assert 4 < repository.seen[0] <= 5
+
+
+def test_the_call_is_cancelled_when_every_waiter_times_out():
+    repository = SlowRepository(delay=1)
+    flight = SingleFlight()
+    service = QueryService(repository, flight)
+
+    async def run():
+        errors = await asyncio.gather(
+            execute(service, timeout=0.01),
+            execute(service, timeout=0.02),
+            return_exceptions=True,
+        )
+        await asyncio.sleep(0)
+        return [error.error_code for error in errors], len(flight)
+
+    assert asyncio.run(run()) == (["A7", "A7"], 0)
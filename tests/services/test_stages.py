@@ -0,0 +1,54 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from lib.metrics import stage_duration
+from src.repositories.query import QueryRepository
+from src.routers.adapter import AdapterRouter, get_query_service
+from src.services.query import QueryService
+
+CONNECTION = {"type": "REST", "credentials": {"url": "https://pokeapi.co"}}
+METADATA = {"method": "POST", "path": "/berries", "headers": {}, "body": {}}
+
+
+class FakeRepository(QueryRepository):
+    def __init__(self):
+        super().__init__(url="http://dashboards", version="1", http_client=None)
+
+    async def get_by_id(self, query_id: str, cached: bool = True):
+        connection = {"id": "pokeapi", **CONNECTION}
+        return {
+            "status_code": 200,
+            "body": {"connection": connection, "metadata": METADATA},
+        }
+
+    async def get_connection_by_id(self, connection_id: str):
+        return {"status_code": 200, "body": CONNECTION}
+
+    async def execute_query(self, query):
+        return {"status_code": 200, "body": [{"name": "oran"}]}
+
+
+def client() -> TestClient:
+    app = FastAPI()
+    app.include_router(AdapterRouter)
+    app.dependency_overrides[get_query_service] = lambda: QueryService(FakeRepository())
+    return TestClient(app)
+
+
+def test_encoding_is_recorded_with_the_query_labels():
+    before = stage_duration.count(stage="encode", type="REST", method="POST")
+    response = client().post("/v1/adapter/execute/berries", json={"parameters": {}})
+    assert response.json()["body"] == [{"name": "oran"}]
+    assert stage_duration.count(stage="encode", type="REST", method="POST") == before + 1
+
+
+def test_preview_records_the_connection_lookup():
+    before = stage_duration.count(stage="connection", type="REST", method="POST")
+    response = client().post(
+        "/v1/adapter/pokeapi/preview",
+        json={"parameters": {}, "connection_metadata": METADATA},
+    )
+    assert response.json()["body"] == [{"name": "oran"}]
+    assert (
+        stage_duration.count(stage="connection", type="REST", method="POST") == before + 1
+    )
@@ -0,0 +1,7 @@
+from src.main import app
+
+
+def test_deadlines_are_tracked_inside_compression():
+    # The first middleware of the list is the outermost one
+    names = [middleware.cls.__name__ for middleware in app.user_middleware]
+    assert names.index("CompressionMiddleware") < names.index("DeadlineMiddleware")